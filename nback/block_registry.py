@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+"""Cross-participant index of issued blocks (SQLite).
+
+Every block handed to a participant is recorded under a content hash of its
+stimuli, target flags and lure codes (plus the position columns of dual
+blocks). The hash is the table's primary key, so checking or claiming a
+block is one indexed lookup regardless of cohort size, and the database
+itself guarantees that no block is issued twice. The task claims each
+block just before running it and draws a replacement when the claim fails.
+
+The file lives under `data/` by default and can be shared by every session
+run on a machine (SQLite serializes concurrent writers).
+"""
+
+import hashlib
+import os
+import sqlite3
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+
+from nback.sequences import BlockPlan, DualBlockPlan
+
+REGISTRY_FILE = "issued_blocks.sqlite"
+# Replacement draws per block before giving up and running a duplicate
+MAX_REDRAWS = 50
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS issued_blocks (
+    hash TEXT PRIMARY KEY,
+    participant_id TEXT NOT NULL,
+    session_timestamp TEXT NOT NULL,
+    block_label TEXT NOT NULL,
+    n_back INTEGER,
+    n_trials INTEGER NOT NULL,
+    issued_at TEXT NOT NULL
+) WITHOUT ROWID
+"""
+
+
+def block_hash(plan: BlockPlan) -> str:
+    """Hex digest of a block's content (ITI is ignored; it is not part of the sequence)."""
+    cols = [plan.stimuli, plan.is_target, plan.lure]
+    if isinstance(plan, DualBlockPlan):
+        cols += [plan.positions, plan.position_is_target, plan.position_lure]
+    h = hashlib.blake2b(digest_size=16)
+    h.update(b"dual" if isinstance(plan, DualBlockPlan) else b"single")
+    for col in cols:
+        h.update(np.ascontiguousarray(col, dtype=np.uint8).tobytes())
+    return h.hexdigest()
+
+
+class BlockRegistry:
+    """SQLite-backed set of issued block hashes."""
+
+    def __init__(self, path: str) -> None:
+        parent = os.path.dirname(path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=10.0)
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+
+    def __contains__(self, digest: str) -> bool:
+        row = self._conn.execute("SELECT 1 FROM issued_blocks WHERE hash = ?", (digest,)).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        return int(self._conn.execute("SELECT COUNT(*) FROM issued_blocks").fetchone()[0])
+
+    def is_issued(self, plan: BlockPlan) -> bool:
+        return block_hash(plan) in self
+
+    def claim(self, plan: BlockPlan, *, participant: str, session: str, label: str,
+              n_back: Optional[int] = None) -> bool:
+        """Record `plan` as issued; returns False (and records nothing) if it already was."""
+        cur = self._conn.execute(
+            "INSERT OR IGNORE INTO issued_blocks VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (block_hash(plan), participant, session, label, n_back, len(plan),
+             datetime.now().isoformat(timespec="seconds")),
+        )
+        self._conn.commit()
+        return cur.rowcount == 1
+
+    def owner(self, plan: BlockPlan) -> Optional[tuple]:
+        """(participant_id, session_timestamp, block_label) of an issued block, else None."""
+        return self._conn.execute(
+            "SELECT participant_id, session_timestamp, block_label FROM issued_blocks WHERE hash = ?",
+            (block_hash(plan),),
+        ).fetchone()
+
+    def close(self) -> None:
+        try:
+            self._conn.close()
+        except Exception:
+            pass
+
+
+def open_registry(path: Optional[str]) -> Optional[BlockRegistry]:
+    """Open the registry at `path`, returning None (with a note) if that fails."""
+    if not path:
+        return None
+    try:
+        return BlockRegistry(path)
+    except Exception as e:
+        print(f"Block registry unavailable ({e}); blocks will not be checked for reuse.")
+        return None
+
+
+__all__ = [
+    "REGISTRY_FILE",
+    "MAX_REDRAWS",
+    "block_hash",
+    "BlockRegistry",
+    "open_registry",
+]
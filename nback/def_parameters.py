@@ -42,11 +42,16 @@ TEXT_COLOR = [1.0, 1.0, 1.0]
 FONT = "Arial"
 FONT_HEIGHT = 0.12  # normalized units
 FIXATION_HEIGHT = 0.18
+# Dual mode: distance between neighbouring grid cells (height units)
+DUAL_GRID_SPACING = 0.28
 
 # Keys
 KEY_PROCEED = "return"
 KEY_RESPONSE = "space"
 KEY_QUIT = "escape"
+# Dual mode: one response key per stream
+KEY_RESPONSE_LETTER = "l"
+KEY_RESPONSE_POSITION = "a"
 
 __all__ = [
     # structure
@@ -75,8 +80,11 @@ __all__ = [
     "FONT",
     "FONT_HEIGHT",
     "FIXATION_HEIGHT",
+    "DUAL_GRID_SPACING",
     # keys
     "KEY_PROCEED",
     "KEY_RESPONSE",
+    "KEY_RESPONSE_LETTER",
+    "KEY_RESPONSE_POSITION",
     "KEY_QUIT",
 ]
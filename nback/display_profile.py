@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+"""Bounded refresh-rate measurement with a per-machine cache.
+
+`win.getActualFrameRate` can block for a long time on displays without a
+stable vsync, so the task measures the rate itself from flips it performs
+anyway. The consent screen feeds every flip to a `RefreshProbe` until a
+fixed time budget runs out. The rate comes from the intervals near the
+median flip interval, and a measurement is trusted only if most intervals
+lie that close.
+
+Trusted results are cached in a JSON profile under `data/`, keyed by host
+name and screen index. A cached value is reused only while the display
+signature is unchanged: window size, fullscreen flag and window backend. A
+new resolution or a switch to windowed mode therefore triggers a fresh
+measurement.
+"""
+
+import json
+import os
+import platform
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+PROFILE_FILE = "display_profile.json"
+# Hard time budget for one measurement (seconds of flipping)
+MEASURE_BUDGET_S = 2.0
+# Flip intervals needed before a measurement can end early
+MIN_INTERVALS = 90
+# Share of intervals that must lie within INTERVAL_TOLERANCE of the median
+MIN_STABLE_SHARE = 0.9
+INTERVAL_TOLERANCE = 0.1
+
+
+@dataclass
+class RefreshMeasurement:
+    refresh_hz: float
+    intervals: int
+    interval_sd_ms: float
+    stable_share: float
+
+
+def display_signature(win, screen: Optional[int], fullscr: bool) -> Dict[str, object]:
+    """Properties that must match for a cached refresh rate to be reused."""
+    try:
+        size = [int(v) for v in win.size]
+    except Exception:
+        size = None
+    return {
+        "host": platform.node(),
+        "screen": screen,
+        "size": size,
+        "fullscr": bool(fullscr),
+        "win_type": getattr(win, "winType", None),
+    }
+
+
+def _profile_key(signature: Dict[str, object]) -> str:
+    screen = signature.get("screen")
+    return f"{signature.get('host')}:screen={'default' if screen is None else screen}"
+
+
+def _read_profile(path: str) -> Dict[str, Dict]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except Exception:
+        return {}
+
+
+def cached_refresh_hz(path: str, signature: Dict[str, object]) -> Optional[float]:
+    """Refresh rate stored for this machine and screen, or None if absent or the signature changed."""
+    entry = _read_profile(path).get(_profile_key(signature))
+    if not entry or entry.get("signature") != signature:
+        return None
+    hz = entry.get("refresh_hz")
+    return float(hz) if hz else None
+
+
+def save_refresh(path: str, signature: Dict[str, object], measurement: RefreshMeasurement) -> None:
+    """Store a trusted measurement for this machine and screen (other entries are kept)."""
+    profile = _read_profile(path)
+    profile[_profile_key(signature)] = {
+        "signature": signature,
+        **asdict(measurement),
+        "measured_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    try:
+        parent = os.path.dirname(path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(profile, f, indent=2)
+        os.replace(tmp, path)
+    except Exception as e:
+        print(f"Could not write display profile ({e}).")
+
+
+class RefreshProbe:
+    """Collects flip timestamps until MIN_INTERVALS are in or the time budget is spent."""
+
+    def __init__(self, budget_s: float = MEASURE_BUDGET_S, min_intervals: int = MIN_INTERVALS) -> None:
+        self.budget_s = budget_s
+        self.min_intervals = min_intervals
+        self._flips: List[float] = []
+
+    @property
+    def done(self) -> bool:
+        flips = self._flips
+        if len(flips) < 2:
+            return False
+        return len(flips) > self.min_intervals or flips[-1] - flips[0] >= self.budget_s
+
+    def add(self, t: float) -> None:
+        """Record one flip timestamp (ignored once the probe is done)."""
+        if not self.done:
+            self._flips.append(t)
+
+    def finish(self, win, draw=None) -> Optional[RefreshMeasurement]:
+        """Flip until done (within the budget), then return the measurement.
+
+        `draw` (optional) is called before every flip to keep the screen content.
+        """
+        while not self.done:
+            if draw is not None:
+                draw()
+            self.add(win.flip())
+        return self.result()
+
+    def result(self) -> Optional[RefreshMeasurement]:
+        """Measured rate, or None if there were too few flips or the intervals were unstable."""
+        if len(self._flips) < 3:
+            return None
+        intervals = np.diff(np.asarray(self._flips, dtype=np.float64))
+        median = float(np.median(intervals))
+        if median <= 0:
+            return None
+        stable = np.abs(intervals - median) <= INTERVAL_TOLERANCE * median
+        share = float(stable.mean())
+        if share < MIN_STABLE_SHARE:
+            return None
+        return RefreshMeasurement(
+            refresh_hz=round(1.0 / float(intervals[stable].mean()), 3),
+            intervals=int(len(intervals)),
+            interval_sd_ms=round(float(intervals[stable].std()) * 1000.0, 4),
+            stable_share=round(share, 3),
+        )
+
+
+__all__ = [
+    "PROFILE_FILE",
+    "MEASURE_BUDGET_S",
+    "MIN_INTERVALS",
+    "RefreshMeasurement",
+    "RefreshProbe",
+    "display_signature",
+    "cached_refresh_hz",
+    "save_refresh",
+]
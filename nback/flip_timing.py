@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+"""Per-flip timestamp recording and dropped-frame accounting.
+
+`run_block` stores the return value of every `win.flip()` in a
+`FlipRecorder`. The timestamp buffer is preallocated for the whole block
+(and only grows if a block runs longer than planned), so recording a flip is
+one array store. The recorder also keeps the index of each trial's onset flip
+and of the flip that replaced the stimulus with fixation.
+
+Everything else is derived once per block with whole-array NumPy operations:
+- `trial_timing`: actual stimulus duration, refreshes the stimulus was on
+  screen and dropped frames per trial
+- `summary`: frame-interval statistics for the block (stored in meta.json)
+
+A flip interval of k nominal frame periods (rounded) counts as k - 1 dropped
+frames. The nominal period comes from the known refresh rate, or from the
+median flip interval of the block when the rate is unknown.
+
+`frames_advanced` is the online counterpart used by frame-locked scheduling:
+each flip advances one frame, and an interval only counts as several when it
+is longer than DROP_THRESHOLD periods.
+"""
+
+import math
+from typing import Dict, Optional
+
+import numpy as np
+
+# Refresh rate assumed when sizing the buffer without a known rate (upper bound)
+MAX_EXPECTED_HZ = 240.0
+# Flip interval (in nominal frame periods) above which frames count as dropped
+DROP_THRESHOLD = 1.5
+
+TRIAL_TIMING_DTYPE = np.dtype([
+    ("stim_duration_ms", "f8"),
+    ("stim_frames", "i4"),
+    ("dropped_frames", "i4"),
+])
+
+
+def flips_per_trial(soa_ms: float, refresh_hz: Optional[float] = None) -> int:
+    """Upper estimate of flips in one trial, used to size the buffer."""
+    hz = refresh_hz or MAX_EXPECTED_HZ
+    return int(math.ceil(soa_ms * hz / 1000.0)) + 2
+
+
+def frames_advanced(interval_s: float, refresh_hz: float) -> int:
+    """Display frames a flip interval spans: 1, or more when it counts as a drop.
+
+    Only intervals longer than DROP_THRESHOLD nominal periods count as
+    several frames, so a small error in the nominal rate never changes the
+    count.
+    """
+    ratio = interval_s * refresh_hz
+    if ratio <= DROP_THRESHOLD:
+        return 1
+    return int(round(ratio))
+
+
+class FlipRecorder:
+    """Preallocated flip-timestamp buffer for one block at a time."""
+
+    def __init__(self, capacity: int = 4096, max_trials: int = 256) -> None:
+        self._t = np.empty(max(1, capacity), dtype=np.float64)
+        self._onset = np.empty(max(1, max_trials), dtype=np.int64)
+        self._offset = np.empty(max(1, max_trials), dtype=np.int64)
+        self._n = 0
+        self._trials = 0
+
+    def start_block(self, n_trials: int, flips_per_trial: int) -> None:
+        """Forget the previous block and make room for this one up front."""
+        capacity = n_trials * flips_per_trial
+        if capacity > len(self._t):
+            self._t = np.empty(capacity, dtype=np.float64)
+        if n_trials > len(self._onset):
+            self._onset = np.empty(n_trials, dtype=np.int64)
+            self._offset = np.empty(n_trials, dtype=np.int64)
+        self._n = 0
+        self._trials = 0
+
+    def __len__(self) -> int:
+        return self._n
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        """Flip timestamps (s) recorded in the current block (a view)."""
+        return self._t[:self._n]
+
+    @property
+    def n_trials(self) -> int:
+        return self._trials
+
+    def flip(self, t: float) -> None:
+        """Record one flip."""
+        if self._n == len(self._t):
+            self._t = np.concatenate([self._t, np.empty(len(self._t), dtype=np.float64)])
+        self._t[self._n] = t
+        self._n += 1
+
+    def onset(self, t: float) -> None:
+        """Record the stimulus-onset flip of a new trial."""
+        if self._trials == len(self._onset):
+            extra = np.empty(len(self._onset), dtype=np.int64)
+            self._onset = np.concatenate([self._onset, extra])
+            self._offset = np.concatenate([self._offset, extra])
+        self._onset[self._trials] = self._n
+        self._offset[self._trials] = -1
+        self._trials += 1
+        self.flip(t)
+
+    def offset(self, t: float) -> None:
+        """Record the flip that replaced the current trial's stimulus with fixation."""
+        self._offset[self._trials - 1] = self._n
+        self.flip(t)
+
+    def frame_period(self, refresh_hz: Optional[float] = None) -> float:
+        """Nominal frame period (s): 1 / refresh_hz, else the median flip interval (nan if unknown)."""
+        if refresh_hz:
+            return 1.0 / float(refresh_hz)
+        if self._n < 2:
+            return float("nan")
+        return float(np.median(np.diff(self.timestamps)))
+
+    def _dropped_per_interval(self, period: float) -> np.ndarray:
+        intervals = np.diff(self.timestamps)
+        if not np.isfinite(period) or period <= 0:
+            return np.zeros(len(intervals), dtype=np.int64)
+        return np.maximum(np.rint(intervals / period).astype(np.int64) - 1, 0)
+
+    def trial_timing(self, refresh_hz: Optional[float] = None) -> np.ndarray:
+        """Per-trial stimulus duration, refreshes shown and dropped frames (TRIAL_TIMING_DTYPE).
+
+        A trial spans its onset flip to the next trial's onset (the last trial
+        ends at the last recorded flip). A stimulus that was never replaced by
+        fixation is taken to last the whole trial.
+        """
+        out = np.zeros(self._trials, dtype=TRIAL_TIMING_DTYPE)
+        if self._trials == 0:
+            return out
+        t = self.timestamps
+        period = self.frame_period(refresh_hz)
+        onsets = self._onset[:self._trials]
+        ends = np.append(onsets[1:], self._n - 1)
+        offsets = self._offset[:self._trials]
+        offsets = np.where(offsets >= 0, offsets, ends)
+        duration = t[offsets] - t[onsets]
+        out["stim_duration_ms"] = duration * 1000.0
+        if np.isfinite(period) and period > 0:
+            out["stim_frames"] = np.rint(duration / period)
+        else:
+            out["stim_frames"] = offsets - onsets
+        # Cumulative drops over flip intervals; a trial owns intervals onset..end-1
+        cum = np.concatenate([[0], np.cumsum(self._dropped_per_interval(period))])
+        out["dropped_frames"] = cum[ends] - cum[onsets]
+        return out
+
+    def summary(self, refresh_hz: Optional[float] = None) -> Dict[str, object]:
+        """Frame-interval statistics of the current block (JSON-ready)."""
+        intervals = np.diff(self.timestamps) * 1000.0
+        period = self.frame_period(refresh_hz)
+        known = np.isfinite(period) and period > 0
+        summary: Dict[str, object] = {
+            "flips": self._n,
+            "trials": self._trials,
+            "frame_period_ms": round(period * 1000.0, 4) if known else None,
+            "period_source": "refresh_hz" if refresh_hz else "median",
+        }
+        if len(intervals) == 0:
+            return summary
+        p50, p95, p99 = np.percentile(intervals, [50, 95, 99])
+        dropped = self._dropped_per_interval(period)
+        summary.update({
+            "interval_mean_ms": round(float(intervals.mean()), 4),
+            "interval_sd_ms": round(float(intervals.std()), 4),
+            "interval_min_ms": round(float(intervals.min()), 4),
+            "interval_median_ms": round(float(p50), 4),
+            "interval_p95_ms": round(float(p95), 4),
+            "interval_p99_ms": round(float(p99), 4),
+            "interval_max_ms": round(float(intervals.max()), 4),
+            "long_intervals": int(np.count_nonzero(dropped)),
+            "dropped_frames": int(dropped.sum()),
+        })
+        return summary
+
+
+__all__ = [
+    "MAX_EXPECTED_HZ",
+    "DROP_THRESHOLD",
+    "TRIAL_TIMING_DTYPE",
+    "flips_per_trial",
+    "frames_advanced",
+    "FlipRecorder",
+]
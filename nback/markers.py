@@ -6,9 +6,19 @@ This module centralizes event marker codes and provides simple hooks to emit
 them over the same backends used by the Bosch task (parallel port and EyeLink).
 By default, markers are disabled to keep the task self-contained; enable them
 only when hardware/software is available and configured.
+
+While a `MarkerWorker` is running (see `start_worker`), `send_named` only
+stamps and enqueues the marker. A dedicated thread performs the backend writes
+(parallel port, EyeLink message), so a slow transport never delays a flip.
+One queue keeps markers in call order, and each sent marker is logged with its
+enqueue and send times (nothing is queued while markers are disabled).
 """
 
-from typing import Optional, Dict, Any
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
 
 # Toggle markers here (keep False by default; set to True when hardware is available)
 ENABLE_MARKERS = True
@@ -71,15 +81,127 @@ def send_marker(code: int,
 def send_named(name: str,
                parallel_port: Optional[Any] = None,
                eyelink: Optional[Any] = None,
-               info: Optional[Dict[str, Any]] = None) -> None:
+               info: Optional[Dict[str, Any]] = None,
+               immediate: bool = False) -> bool:
     """Lookup a named trigger and send it via the available backends.
 
     Parameters
     - name: one of the keys in TRIGGERS (raises KeyError if unknown)
     - other args passed to send_marker
+    - immediate: write the parallel port on the calling thread even while a
+      worker is running (for markers sent from win.callOnFlip, where the port
+      write must coincide with the flip); the EyeLink message is still queued.
+      If earlier port writes are still queued the marker is queued behind
+      them, so codes never reach the port out of order.
+
+    Returns True if the marker was written before returning (synchronous
+    send, or an immediate port write), False if it was queued or disabled.
     """
     code = TRIGGERS[name]
-    send_marker(code, parallel_port=parallel_port, eyelink=eyelink)
+    if not ENABLE_MARKERS:
+        return False
+    worker = _WORKER
+    if worker is None:
+        send_marker(code, parallel_port=parallel_port, eyelink=eyelink)
+        return True
+    if immediate and parallel_port is not None and worker.port_idle:
+        send_marker(code, parallel_port=parallel_port)
+        worker.post(name, code, None, eyelink, port_time=worker.clock())
+        return True
+    worker.post(name, code, parallel_port, eyelink)
+    return False
+
+
+@dataclass
+class MarkerRecord:
+    name: str
+    code: int
+    enqueued: float  # worker clock, when send_named was called
+    sent: float      # worker clock, after the backend writes returned
+    port_time: Optional[float] = None  # when the parallel-port write returned (None without a port)
+
+
+_STOP = object()
+
+
+class MarkerWorker:
+    """Background thread that performs marker writes in the order they were posted.
+
+    `post` runs on the render thread. It reads the clock once and puts a tuple
+    on a `queue.SimpleQueue`, whose put never blocks (the queue is unbounded).
+    The worker wakes as soon as an item arrives. `clock` should be the clock
+    the caller uses for flip timestamps, so both logs share one time base.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.perf_counter) -> None:
+        self.clock = clock
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._log: List[MarkerRecord] = []
+        # Queued vs. finished parallel-port writes; only the posting thread writes _port_posted
+        self._port_posted = 0
+        self._port_done = 0
+        self._thread = threading.Thread(target=self._run, name="marker-worker", daemon=True)
+        self._thread.start()
+
+    def post(self, name: str, code: int, parallel_port: Optional[Any] = None,
+             eyelink: Optional[Any] = None, port_time: Optional[float] = None) -> None:
+        """Queue a marker; `port_time` marks a port write the caller already made."""
+        if parallel_port is not None:
+            self._port_posted += 1
+        self._queue.put((name, code, parallel_port, eyelink, self.clock(), port_time))
+
+    @property
+    def port_idle(self) -> bool:
+        """True when no queued marker still has to write the parallel port."""
+        return self._port_done == self._port_posted
+
+    def _run(self) -> None:
+        clock = self.clock
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            name, code, parallel_port, eyelink, enqueued, port_time = item
+            if parallel_port is not None:
+                send_marker(code, parallel_port=parallel_port)
+                port_time = clock()
+                self._port_done += 1
+            send_marker(code, eyelink=eyelink)
+            # list.append is atomic; drain_log may run concurrently
+            self._log.append(MarkerRecord(name, code, enqueued, clock(), port_time))
+
+    def drain_log(self) -> List[MarkerRecord]:
+        """Records of markers sent since the last call (oldest first)."""
+        n = len(self._log)
+        records = self._log[:n]
+        del self._log[:n]
+        return records
+
+    def stop(self, timeout: float = 2.0) -> None:
+        """Send everything still queued, then end the thread (waits at most `timeout` s)."""
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+
+_WORKER: Optional[MarkerWorker] = None
+
+
+def start_worker(clock: Callable[[], float] = time.perf_counter) -> MarkerWorker:
+    """Route `send_named` through a new background worker and return it."""
+    global _WORKER
+    if _WORKER is not None:
+        _WORKER.stop()
+    _WORKER = MarkerWorker(clock)
+    return _WORKER
+
+
+def stop_worker(timeout: float = 2.0) -> Optional[MarkerWorker]:
+    """Flush and stop the worker (send_named is synchronous again); returns it for its log."""
+    global _WORKER
+    worker, _WORKER = _WORKER, None
+    if worker is not None:
+        worker.stop(timeout)
+    return worker
 
 
 def set_enable(value: bool) -> None:
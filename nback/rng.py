@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+"""Independent, order-free random streams for sequence generation.
+
+Every block, practice attempt and session-level draw gets its own stream,
+derived from (session seed, participant, stream kind, index) through NumPy's
+`SeedSequence`. A stream therefore does not depend on how many numbers any
+other stream consumed: block 5 can be generated first, in another process, or
+regenerated on its own and still come out bit-for-bit identical.
+
+Streams are exposed both as `random.Random` (for `generate_sequence`) and as a
+Philox-backed `numpy.random.Generator` (for `generate_sequences_batch`).
+"""
+
+import random
+import secrets
+import zlib
+from typing import Optional
+
+import numpy as np
+
+# Stream kinds (part of the derivation key; do not renumber)
+STREAM_SESSION = 0
+STREAM_BLOCK = 1
+STREAM_PRACTICE = 2
+
+
+def new_session_seed() -> int:
+    """Return fresh entropy for sessions started without --seed (log it to reproduce)."""
+    return secrets.randbits(63)
+
+
+def stream_seed_sequence(seed: int, participant: str, stream: int, index: int = 0,
+                         redraw: int = 0) -> np.random.SeedSequence:
+    """Return the SeedSequence for one stream.
+
+    `redraw` > 0 selects a replacement stream for the same block (e.g. after
+    the block registry reported a collision); redraw 0 keeps the original key.
+    """
+    participant_key = zlib.crc32(str(participant).encode("utf-8"))
+    spawn_key = (participant_key, int(stream), int(index)) + ((int(redraw),) if redraw else ())
+    return np.random.SeedSequence(int(seed), spawn_key=spawn_key)
+
+
+def stream_random(seed: int, participant: str, stream: int, index: int = 0, redraw: int = 0) -> random.Random:
+    """Return a `random.Random` seeded from the stream's 128-bit state."""
+    words = stream_seed_sequence(seed, participant, stream, index, redraw).generate_state(4, dtype=np.uint32)
+    state = 0
+    for w in words:
+        state = (state << 32) | int(w)
+    return random.Random(state)
+
+
+def stream_generator(seed: int, participant: str, stream: int, index: int = 0,
+                     redraw: int = 0) -> np.random.Generator:
+    """Return a Philox-backed NumPy Generator for the stream."""
+    return np.random.Generator(np.random.Philox(stream_seed_sequence(seed, participant, stream, index, redraw)))
+
+
+def resolve_session_seed(seed: Optional[int]) -> int:
+    """Use the CLI seed when given, otherwise draw fresh entropy."""
+    return int(seed) if seed is not None else new_session_seed()
+
+
+__all__ = [
+    "STREAM_SESSION",
+    "STREAM_BLOCK",
+    "STREAM_PRACTICE",
+    "new_session_seed",
+    "resolve_session_seed",
+    "stream_seed_sequence",
+    "stream_random",
+    "stream_generator",
+]
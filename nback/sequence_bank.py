@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+"""Precomputed sequence bank for the PsychoPy N-back task.
+
+A bank is a directory holding one memory-mapped `.npy` file per parameter set
+plus an `index.json` describing them. Each file has shape (count, 3, n_trials)
+and dtype uint8; the three rows of a block are letter codes (indices into
+LETTERS), target flags, and lure codes (see `nback.sequences.LURE_NAMES`).
+
+Blocks are generated and validated offline (`scripts/build_sequence_bank.py`),
+so the task only has to slice a memory map between blocks.
+"""
+
+import json
+import os
+import random
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from nback.sequence_metrics import sequence_metrics
+from nback.sequences import (
+    BlockPlan,
+    check_feasibility,
+    generate_sequences_batch,
+    validate_sequences_batch,
+)
+
+INDEX_FILE = "index.json"
+BANK_FORMAT_VERSION = 1
+
+
+def bank_key(n_back: int, n_trials: int, *, target_rate: float,
+             lure_n_minus_1_rate: float, lure_n_plus_1_rate: float,
+             max_consec_targets: int, include_lures: bool = True,
+             lure_mode: str = "rate") -> str:
+    """Return the canonical key (and file stem) for one parameter set.
+
+    Lure rates are ignored when `include_lures` is False so that, e.g., a
+    practice block requested with non-zero rates but lures disabled maps to
+    the same entry as one requested with zero rates. Quota-mode lures get a
+    "_quota" suffix; rate-mode keys are unchanged from earlier banks.
+    """
+    if not include_lures:
+        lure_n_minus_1_rate = lure_n_plus_1_rate = 0.0
+        lure_mode = "rate"
+    return (
+        f"n{int(n_back)}_t{int(n_trials)}_r{target_rate:.3f}"
+        f"_l{lure_n_minus_1_rate:.3f}-{lure_n_plus_1_rate:.3f}"
+        f"_c{int(max_consec_targets)}_{'lures' if include_lures else 'nolures'}"
+        f"{'_quota' if lure_mode == 'quota' else ''}"
+    )
+
+
+def build_bank(root: str, param_sets: Iterable[Dict[str, Any]], count: int, *,
+               seed: Optional[int] = None) -> Dict[str, Any]:
+    """Generate, validate and store `count` blocks for every parameter set.
+
+    Each entry of `param_sets` holds the keyword arguments of `bank_key`.
+    Blocks that fail `validate_sequence` are discarded and replaced; a
+    parameter set that `check_feasibility` rejects is skipped with a warning.
+    Existing entries with the same key are overwritten. Returns the index.
+    Only rate-mode lures can be batch-generated; quota-mode parameter sets
+    are skipped with a warning.
+    """
+    os.makedirs(root, exist_ok=True)
+    index = _read_index(root) or {"version": BANK_FORMAT_VERSION, "entries": {}}
+    for params in param_sets:
+        key = bank_key(**params)
+        if params.get("include_lures", True) and params.get("lure_mode", "rate") == "quota":
+            print(f"Warning: skipping {key}: quota-mode lures are not supported in banks")
+            continue
+        n_back = int(params["n_back"])
+        n_trials = int(params["n_trials"])
+        fz = check_feasibility(n_back, n_trials, target_rate=params["target_rate"],
+                               max_consec_targets=params["max_consec_targets"])
+        if not fz.feasible:
+            print(f"Warning: skipping {key}: {fz.message}")
+            continue
+        # Seed per key so rebuilding one entry does not depend on the others
+        child = np.random.SeedSequence(seed, spawn_key=(zlib.crc32(key.encode("utf-8")),))
+        rng_seed = int(child.generate_state(1)[0])
+        kept: List[np.ndarray] = []
+        have = 0
+        for _round in range(10):
+            batch = generate_sequences_batch(
+                n_back, n_trials, max(count - have, 1) + count // 10,
+                target_rate=params["target_rate"],
+                lure_n_minus_1_rate=params["lure_n_minus_1_rate"],
+                lure_n_plus_1_rate=params["lure_n_plus_1_rate"],
+                max_consec_targets=params["max_consec_targets"],
+                include_lures=params.get("include_lures", True),
+                seed=rng_seed + _round,
+            )
+            blocks = np.stack([batch.stimuli, batch.is_target, batch.lure], axis=1)
+            mask, _codes = validate_sequences_batch(
+                batch.stimuli, batch.is_target, batch.lure,
+                n_back=n_back,
+                target_rate=params["target_rate"],
+                max_consec_targets=params["max_consec_targets"],
+            )
+            kept.append(blocks[mask])
+            have += int(mask.sum())
+            if have >= count:
+                break
+        if have < count:
+            print(f"Warning: only {have}/{count} valid blocks for {key}; skipping.")
+            continue
+        data = np.concatenate(kept, axis=0)[:count]
+        fname = f"{key}.npy"
+        np.save(os.path.join(root, fname), np.ascontiguousarray(data, dtype=np.uint8))
+        index["entries"][key] = {
+            "file": fname,
+            "count": int(count),
+            "n_back": n_back,
+            "n_trials": n_trials,
+            "target_rate": float(params["target_rate"]),
+            "lure_n_minus_1_rate": float(params["lure_n_minus_1_rate"]),
+            "lure_n_plus_1_rate": float(params["lure_n_plus_1_rate"]),
+            "max_consec_targets": int(params["max_consec_targets"]),
+            "include_lures": bool(params.get("include_lures", True)),
+            "seed": seed,
+        }
+    with open(os.path.join(root, INDEX_FILE), "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=2)
+    return index
+
+
+def _read_index(root: str) -> Optional[Dict[str, Any]]:
+    path = os.path.join(root, INDEX_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class SequenceBank:
+    """Read-only view of a bank directory; block arrays are memory-mapped lazily."""
+
+    def __init__(self, root: str) -> None:
+        index = _read_index(root)
+        if index is None:
+            raise FileNotFoundError(f"No {INDEX_FILE} in sequence bank {root!r}")
+        if int(index.get("version", 0)) != BANK_FORMAT_VERSION:
+            raise ValueError(f"Unsupported sequence bank version: {index.get('version')}")
+        self.root = root
+        self.entries: Dict[str, Dict[str, Any]] = index["entries"]
+        self._arrays: Dict[str, np.ndarray] = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    def count(self, key: str) -> int:
+        return int(self.entries[key]["count"])
+
+    def array(self, key: str) -> np.ndarray:
+        """Return the (count, 3, n_trials) memory map for `key`."""
+        arr = self._arrays.get(key)
+        if arr is None:
+            arr = np.load(os.path.join(self.root, self.entries[key]["file"]), mmap_mode="r")
+            self._arrays[key] = arr
+        return arr
+
+    def audit(self, key: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Re-validate every block of `key`; returns (ok mask, reason codes)."""
+        entry = self.entries[key]
+        arr = self.array(key)
+        return validate_sequences_batch(
+            arr[:, 0], arr[:, 1], arr[:, 2],
+            n_back=int(entry["n_back"]),
+            target_rate=float(entry["target_rate"]),
+            max_consec_targets=int(entry["max_consec_targets"]),
+        )
+
+    def metrics(self, key: str) -> np.ndarray:
+        """Quality metrics for every block of `key` (see `nback.sequence_metrics`)."""
+        arr = self.array(key)
+        return sequence_metrics(arr[:, 0], arr[:, 1], arr[:, 2], n_back=int(self.entries[key]["n_back"]))
+
+    def block(self, key: str, k: int, fixed_iti_ms: int = 500) -> BlockPlan:
+        """Return block `k` of `key` as a BlockPlan (5 bytes per trial)."""
+        stim, flags, lures = self.array(key)[k]
+        return BlockPlan.from_arrays(stim, flags, lures, fixed_iti_ms)
+
+    def draw(self, key: str, n: int, rng: Optional[random.Random] = None) -> List[int]:
+        """Pick `n` distinct block indices for `key` (with replacement if n > count)."""
+        r = rng or random
+        total = self.count(key)
+        if n <= total:
+            return r.sample(range(total), n)
+        return [r.randrange(total) for _ in range(n)]
+
+
+def load_bank(root: Optional[str]) -> Optional[SequenceBank]:
+    """Open a bank directory, returning None (with a note) if it is unusable."""
+    if not root:
+        return None
+    try:
+        return SequenceBank(root)
+    except Exception as e:
+        print(f"Sequence bank unavailable ({e}); generating blocks on the fly.")
+        return None
+
+
+__all__ = [
+    "INDEX_FILE",
+    "BANK_FORMAT_VERSION",
+    "bank_key",
+    "build_bank",
+    "SequenceBank",
+    "load_bank",
+]
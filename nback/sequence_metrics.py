@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+"""Vectorized quality metrics for many N-back blocks at once.
+
+Inputs are the array form used by `validate_sequences_batch`, sequence
+batches and bank memory maps: (count, n_trials) arrays of letter codes,
+0/1 target flags and lure codes. `sequence_metrics` returns one record per
+block in a NumPy structured array, so a bank can be screened with plain
+boolean masks, e.g. `m[(m["entropy"] > 4.2) & (m["max_target_run"] <= 1)]`.
+
+Metrics per block:
+- entropy / entropy_norm: Shannon entropy of letter frequencies (bits, and
+  relative to the uniform maximum log2(n_letters))
+- rep_lag: share of trials i >= k whose letter equals the letter k trials
+  back, for k = 1..N+2 (k = N is the target lag, N-1 and N+1 the lure lags)
+- target_count / target_rate: realized targets over all trials
+- lure_n_minus_1_rate / lure_n_plus_1_rate: realized lures per non-target
+- target_runs / letter_runs: histograms of target run lengths and
+  identical-letter run lengths (bin j counts runs of length j + 1; the last
+  bin also counts longer runs), plus their maxima and the longest stretch
+  without a target (max_gap)
+
+Everything is computed with whole-array NumPy operations; there is no
+Python loop over blocks.
+"""
+
+import numpy as np
+
+from nback.sequences import LETTERS, LURE_N_MINUS_1, LURE_N_PLUS_1
+
+# Run-length histogram bins (runs of RUN_BINS or more share the last bin)
+RUN_BINS = 4
+
+
+def metrics_dtype(n_back: int, run_bins: int = RUN_BINS) -> np.dtype:
+    """Record layout of `sequence_metrics` output for one N level."""
+    return np.dtype([
+        ("entropy", "f4"),
+        ("entropy_norm", "f4"),
+        ("rep_lag", "f4", (n_back + 2,)),
+        ("target_count", "u4"),
+        ("target_rate", "f4"),
+        ("lure_n_minus_1_rate", "f4"),
+        ("lure_n_plus_1_rate", "f4"),
+        ("target_runs", "u4", (run_bins,)),
+        ("letter_runs", "u4", (run_bins,)),
+        ("max_target_run", "u4"),
+        ("max_letter_run", "u4"),
+        ("max_gap", "u4"),
+    ])
+
+
+def _runs(mask: np.ndarray) -> tuple:
+    """(row, length) of every run of True values in a (count, n_trials) mask."""
+    count, n_trials = mask.shape
+    prev = np.zeros_like(mask)
+    prev[:, 1:] = mask[:, :-1]
+    nxt = np.zeros_like(mask)
+    nxt[:, :-1] = mask[:, 1:]
+    # Starts and ends pair up in row-major order, one of each per run
+    starts = np.flatnonzero(mask & ~prev)
+    ends = np.flatnonzero(mask & ~nxt)
+    return starts // max(n_trials, 1), ends - starts + 1
+
+
+def _run_summary(rows: np.ndarray, lengths: np.ndarray, count: int, run_bins: int) -> tuple:
+    """Per-row run-length histogram and longest run."""
+    bins = np.minimum(lengths, run_bins) - 1
+    hist = np.bincount(rows * run_bins + bins, minlength=count * run_bins).reshape(count, run_bins)
+    longest = np.zeros(count, dtype=np.int64)
+    np.maximum.at(longest, rows, lengths)
+    return hist, longest
+
+
+def sequence_metrics(stimuli: np.ndarray, is_target: np.ndarray, lure: np.ndarray, *,
+                     n_back: int, n_letters: int = len(LETTERS),
+                     run_bins: int = RUN_BINS) -> np.ndarray:
+    """Compute quality metrics for every block; returns a structured array (see module docstring)."""
+    stim = np.asarray(stimuli).astype(np.int64)
+    tgt = np.asarray(is_target).astype(bool)
+    lur = np.asarray(lure)
+    count, n_trials = stim.shape
+    out = np.zeros(count, dtype=metrics_dtype(n_back, run_bins))
+    if count == 0 or n_trials == 0:
+        return out
+    rows = np.arange(count)
+
+    # Letter frequency entropy
+    freq = np.bincount((rows[:, None] * n_letters + stim).ravel(), minlength=count * n_letters)
+    p = freq.reshape(count, n_letters) / n_trials
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out["entropy"] = -np.where(p > 0, p * np.log2(p), 0.0).sum(axis=1)
+    out["entropy_norm"] = out["entropy"] / np.log2(n_letters) if n_letters > 1 else 0.0
+
+    # Lag-k repetition, k = 1..N+2
+    for j, k in enumerate(range(1, n_back + 3)):
+        if k < n_trials:
+            out["rep_lag"][:, j] = (stim[:, k:] == stim[:, :-k]).mean(axis=1)
+
+    # Realized target and lure rates
+    targets = tgt.sum(axis=1)
+    non_targets = np.maximum(n_trials - targets, 1)
+    out["target_count"] = targets
+    out["target_rate"] = targets / n_trials
+    out["lure_n_minus_1_rate"] = (lur == LURE_N_MINUS_1).sum(axis=1) / non_targets
+    out["lure_n_plus_1_rate"] = (lur == LURE_N_PLUS_1).sum(axis=1) / non_targets
+
+    # Run-length distributions
+    out["target_runs"], out["max_target_run"] = _run_summary(*_runs(tgt), count, run_bins)
+    _gap_rows, gap_lengths = _runs(~tgt)
+    _hist, out["max_gap"] = _run_summary(_gap_rows, gap_lengths, count, run_bins)
+    # Identical-letter runs: every row starts a run at column 0, so run lengths
+    # are the distances between consecutive run starts in flat (row-major) order
+    new_run = np.ones_like(tgt)
+    new_run[:, 1:] = stim[:, 1:] != stim[:, :-1]
+    starts = np.flatnonzero(new_run)
+    lengths = np.diff(np.append(starts, count * n_trials))
+    out["letter_runs"], out["max_letter_run"] = _run_summary(starts // n_trials, lengths, count, run_bins)
+    return out
+
+
+def summarize_metrics(metrics: np.ndarray, percentiles: tuple = (5, 50, 95)) -> str:
+    """Compact text table: percentiles of every scalar metric (and each lag / run bin)."""
+    cols = []
+    for name in metrics.dtype.names:
+        values = metrics[name]
+        if values.ndim == 1:
+            cols.append((name, values))
+        else:
+            cols.extend((f"{name}[{j + 1}]", values[:, j]) for j in range(values.shape[1]))
+    head = f"{'metric':<24}" + "".join(f"{'p' + str(q):>10}" for q in percentiles)
+    lines = [f"{len(metrics)} blocks", head]
+    for name, values in cols:
+        if len(values) == 0:
+            continue
+        qs = np.percentile(values.astype(np.float64), percentiles)
+        lines.append(f"{name:<24}" + "".join(f"{q:>10.3f}" for q in qs))
+    return "\n".join(lines)
+
+
+def save_metrics_csv(path: str, metrics: np.ndarray) -> None:
+    """Write one CSV row per block (with its index); array fields become `name_1..name_k` columns."""
+    cols = [("block", np.arange(len(metrics)))]
+    for name in metrics.dtype.names:
+        values = metrics[name]
+        if values.ndim == 1:
+            cols.append((name, values))
+        else:
+            cols.extend((f"{name}_{j + 1}", values[:, j]) for j in range(values.shape[1]))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(",".join(name for name, _ in cols) + "\n")
+        table = np.column_stack([v.astype(np.float64) for _, v in cols])
+        np.savetxt(f, table, delimiter=",", fmt="%.6g")
+
+
+__all__ = [
+    "RUN_BINS",
+    "metrics_dtype",
+    "sequence_metrics",
+    "summarize_metrics",
+    "save_metrics_csv",
+]
@@ -14,10 +14,17 @@ Timing notes:
     after the stimulus). Presentation logic in nback_task.py controls when to flip.
 """
 
+import math
 import random
 import string
-from dataclasses import dataclass
-from typing import Dict, List, Optional, Tuple
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from enum import IntEnum
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
 
 LETTERS = [c for c in string.ascii_uppercase if c not in {"I", "O", "Q"}]
 
@@ -27,6 +34,34 @@ LURE_N_PLUS_1_RATE = 0.05
 MAX_IDENTICAL_RUN = 2
 MAX_ATTEMPTS = 300
 MAX_CONSEC_TARGETS_DEFAULT = 1
+# Dual mode: cap on trials that are targets in both streams, as a fraction of the block
+MAX_DUAL_TARGET_RATE = 0.10
+# Lure layouts resampled per attempt when a quota comes up short (lure_mode="quota")
+LURE_QUOTA_RETRIES = 8
+# iter_trials: max distance of the running target count from target_rate x eligible trials
+RATE_SLACK = 1.5
+
+# Integer lure codes used by the array-backed representations (BlockPlan, batches, banks)
+LURE_NONE = 0
+LURE_N_MINUS_1 = 1
+LURE_N_PLUS_1 = 2
+LURE_NAMES = ("none", "n-1", "n+1")
+LURE_CODES = {name: code for code, name in enumerate(LURE_NAMES)}
+LETTER_CODES = {c: i for i, c in enumerate(LETTERS)}
+# Dual mode spatial stream: cells of a 3x3 grid without the centre, row by row (0 = top-left)
+POSITIONS = list(range(8))
+
+
+class LureType(IntEnum):
+    """Lure category as stored in BlockPlan arrays; `label` is the CSV string."""
+    NONE = LURE_NONE
+    N_MINUS_1 = LURE_N_MINUS_1
+    N_PLUS_1 = LURE_N_PLUS_1
+
+    @property
+    def label(self) -> str:
+        return LURE_NAMES[self]
+
 
 @dataclass
 class TrialPlan:
@@ -44,35 +79,271 @@ class TrialPlan:
     iti_ms: int
 
 
-def _choose_letter(candidates: List[str], freq: Dict[str, int], soft_balance: bool = True) -> str:
-    """Choose a letter, optionally soft-balancing toward less frequent ones."""
-    if not candidates:
-        candidates = LETTERS[:]
-    if soft_balance:
-        max_count = max(freq.values()) if freq else 1
-        weights = [(max_count - freq.get(c, 0) + 1) for c in candidates]
-        weights = [max(w, 1) for w in weights]
-        total = float(sum(weights))
-        r = random.random() * total
-        acc = 0.0
-        for c, w in zip(candidates, weights):
-            acc += w
-            if r <= acc:
-                return c
-        return candidates[-1]
-    return random.choice(candidates)
-
-
-def _valid_run_limit(seq: List[str], candidate: str, max_run: int) -> bool:
-    """Return True if adding candidate keeps identical-letter runs within max_run."""
-    if max_run <= 0:
-        return True
-    run_len = 1
-    i = len(seq) - 1
-    while i >= 0 and seq[i] == candidate:
-        run_len += 1
-        i -= 1
-    return run_len <= max_run
+# One record per trial: 5 bytes instead of a dataclass with a str and two ints
+BLOCK_DTYPE = np.dtype([
+    ("stimulus", "u1"),   # index into LETTERS
+    ("is_target", "u1"),
+    ("lure", "u1"),       # LureType
+    ("iti_ms", "<u2"),
+])
+
+
+class TrialView:
+    """Read-only view of one BlockPlan trial with the TrialPlan attribute names."""
+    __slots__ = ("_rec",)
+
+    def __init__(self, rec: np.void) -> None:
+        self._rec = rec
+
+    @property
+    def stimulus(self) -> str:
+        return LETTERS[self._rec["stimulus"]]
+
+    @property
+    def is_target(self) -> int:
+        return int(self._rec["is_target"])
+
+    @property
+    def lure(self) -> LureType:
+        return LureType(int(self._rec["lure"]))
+
+    @property
+    def lure_type(self) -> str:
+        return LURE_NAMES[self._rec["lure"]]
+
+    @property
+    def iti_ms(self) -> int:
+        return int(self._rec["iti_ms"])
+
+    def to_plan(self) -> TrialPlan:
+        return TrialPlan(self.stimulus, self.is_target, self.lure_type, self.iti_ms)
+
+    def __repr__(self) -> str:
+        return (f"TrialView(stimulus={self.stimulus!r}, is_target={self.is_target}, "
+                f"lure_type={self.lure_type!r}, iti_ms={self.iti_ms})")
+
+
+class BlockPlan:
+    """One block as a structured array (`BLOCK_DTYPE`), i.e. struct-of-arrays.
+
+    `stimuli`, `is_target`, `lure` and `iti_ms` are views on the columns.
+    Indexing and iteration yield `TrialView`s, which expose the same
+    attributes as `TrialPlan`, so code written for list[TrialPlan] keeps
+    working. `save` writes a plain .npy file and `load` memory-maps it back
+    without copying.
+    """
+    __slots__ = ("trials",)
+    DTYPE = BLOCK_DTYPE
+    VIEW = TrialView
+
+    def __init__(self, trials: np.ndarray) -> None:
+        if trials.dtype != self.DTYPE or trials.ndim != 1:
+            raise ValueError(f"{type(self).__name__} needs a 1-D array of {self.DTYPE}, got {trials.dtype} {trials.shape}")
+        self.trials = trials
+
+    @classmethod
+    def from_arrays(cls, stimuli: Sequence[int], is_target: Sequence[int], lure: Sequence[int],
+                    iti_ms: Union[int, Sequence[int]]) -> "BlockPlan":
+        """Build from letter codes, 0/1 flags, lure codes and a constant or per-trial ITI."""
+        trials = np.empty(len(stimuli), dtype=cls.DTYPE)
+        trials["stimulus"] = stimuli
+        trials["is_target"] = is_target
+        trials["lure"] = lure
+        trials["iti_ms"] = iti_ms
+        return cls(trials)
+
+    @classmethod
+    def from_trials(cls, plans: Sequence[TrialPlan]) -> "BlockPlan":
+        """Pack a list[TrialPlan] (or anything with the same attributes)."""
+        return cls.from_arrays(
+            [LETTER_CODES[p.stimulus] for p in plans],
+            [p.is_target for p in plans],
+            [LURE_CODES[p.lure_type] for p in plans],
+            [p.iti_ms for p in plans],
+        )
+
+    @property
+    def stimuli(self) -> np.ndarray:
+        return self.trials["stimulus"]
+
+    @property
+    def is_target(self) -> np.ndarray:
+        return self.trials["is_target"]
+
+    @property
+    def lure(self) -> np.ndarray:
+        return self.trials["lure"]
+
+    @property
+    def iti_ms(self) -> np.ndarray:
+        return self.trials["iti_ms"]
+
+    def __len__(self) -> int:
+        return int(self.trials.shape[0])
+
+    def __getitem__(self, i: int) -> TrialView:
+        return self.VIEW(self.trials[i])
+
+    def __iter__(self) -> Iterator[TrialView]:
+        view = self.VIEW
+        for rec in self.trials:
+            yield view(rec)
+
+    def letters(self) -> str:
+        """Stimulus letters as one string."""
+        return "".join(LETTERS[c] for c in self.stimuli)
+
+    def to_trials(self) -> List[TrialPlan]:
+        """Expand into the legacy list[TrialPlan] form."""
+        return [v.to_plan() for v in self]
+
+    def save(self, path: str) -> None:
+        """Write the trial records as a .npy file (no conversion)."""
+        np.save(path, np.ascontiguousarray(self.trials))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "BlockPlan":
+        """Load a block written by `save`; memory-mapped (zero-copy) by default."""
+        return cls(np.load(path, mmap_mode="r" if mmap else None))
+
+
+# Dual mode adds the spatial stream's position (index into POSITIONS), target flag and lure code
+DUAL_BLOCK_DTYPE = np.dtype(BLOCK_DTYPE.descr + [
+    ("position", "u1"),
+    ("position_is_target", "u1"),
+    ("position_lure", "u1"),
+])
+
+
+class DualTrialView(TrialView):
+    """TrialView with the position-stream fields of a DualBlockPlan trial."""
+    __slots__ = ()
+
+    @property
+    def position(self) -> int:
+        return int(self._rec["position"])
+
+    @property
+    def position_is_target(self) -> int:
+        return int(self._rec["position_is_target"])
+
+    @property
+    def position_lure_type(self) -> str:
+        return LURE_NAMES[self._rec["position_lure"]]
+
+    def __repr__(self) -> str:
+        return (f"DualTrialView(stimulus={self.stimulus!r}, is_target={self.is_target}, "
+                f"lure_type={self.lure_type!r}, position={self.position}, "
+                f"position_is_target={self.position_is_target}, "
+                f"position_lure_type={self.position_lure_type!r}, iti_ms={self.iti_ms})")
+
+
+class DualBlockPlan(BlockPlan):
+    """BlockPlan for dual N-back: letter stream plus spatial-position stream."""
+    __slots__ = ()
+    DTYPE = DUAL_BLOCK_DTYPE
+    VIEW = DualTrialView
+
+    @classmethod
+    def from_arrays(cls, stimuli: Sequence[int], is_target: Sequence[int], lure: Sequence[int],
+                    iti_ms: Union[int, Sequence[int]], *, position: Sequence[int],
+                    position_is_target: Sequence[int], position_lure: Sequence[int]) -> "DualBlockPlan":
+        """Like `BlockPlan.from_arrays`, plus the three position-stream columns."""
+        plan = super().from_arrays(stimuli, is_target, lure, iti_ms)
+        plan.trials["position"] = position
+        plan.trials["position_is_target"] = position_is_target
+        plan.trials["position_lure"] = position_lure
+        return plan
+
+    @property
+    def positions(self) -> np.ndarray:
+        return self.trials["position"]
+
+    @property
+    def position_is_target(self) -> np.ndarray:
+        return self.trials["position_is_target"]
+
+    @property
+    def position_lure(self) -> np.ndarray:
+        return self.trials["position_lure"]
+
+    def dual_targets(self) -> int:
+        """Number of trials that are targets in both streams."""
+        return int(np.count_nonzero(self.is_target & self.position_is_target))
+
+
+class LetterSampler:
+    """Soft-balanced letter sampler backed by a Fenwick tree, O(log k) per call.
+
+    Each letter has weight (max_count + 1 - count), so less frequent letters
+    are favored and every letter keeps weight >= 1. The tree stores the counts;
+    since all weights share the (max_count + 1) offset, any tree node's weight
+    sum is size * (max_count + 1) - count sum, so sampling is a single
+    top-down descent. Excluded letters (e.g. the N-back letter and the last
+    letter) are masked by temporarily raising their count to zero weight and
+    restoring it afterwards, without rebuilding anything.
+
+    With soft_balance=False letters are drawn uniformly instead.
+    """
+
+    def __init__(self, letters: Optional[List[str]] = None, soft_balance: bool = True) -> None:
+        self.letters = list(letters or LETTERS)
+        self.soft_balance = soft_balance
+        self.index = {c: i for i, c in enumerate(self.letters)}
+        self.counts = [0] * len(self.letters)
+        self.total_count = 0
+        self.max_count = 0
+        self._tree = [0] * (len(self.letters) + 1)  # 1-based Fenwick tree over counts
+        self._top = 1 << (len(self.letters).bit_length() - 1)
+
+    def _update(self, i: int, delta: int) -> None:
+        i += 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & (-i)
+
+    def add(self, letter: str) -> None:
+        """Record one more occurrence of `letter`."""
+        i = self.index[letter]
+        self.counts[i] += 1
+        self.total_count += 1
+        if self.counts[i] > self.max_count:
+            self.max_count = self.counts[i]
+        self._update(i, 1)
+
+    def sample(self, exclude: Tuple[Optional[str], ...] = (), rng: Optional[random.Random] = None) -> str:
+        """Draw a letter, never returning one listed in `exclude` (None entries ignored)."""
+        r = rng or random
+        masked = sorted({self.index[c] for c in exclude if c is not None and c in self.index})
+        k = len(self.letters)
+        if not self.soft_balance or len(masked) >= k:
+            # Uniform draw over the unmasked letters: shift past the sorted exclusions
+            if len(masked) >= k:
+                masked = []
+            j = r.randrange(k - len(masked))
+            for m in masked:
+                if j >= m:
+                    j += 1
+            return self.letters[j]
+        base = self.max_count + 1
+        deltas = [base - self.counts[m] for m in masked]
+        for m, d in zip(masked, deltas):
+            self._update(m, d)
+        total = (k * base) - (self.total_count + sum(deltas))
+        rem = r.randrange(total)
+        pos = 0
+        step = self._top
+        while step:
+            nxt = pos + step
+            if nxt <= k:
+                node_weight = step * base - self._tree[nxt]
+                if node_weight <= rem:
+                    pos = nxt
+                    rem -= node_weight
+            step >>= 1
+        for m, d in zip(masked, deltas):
+            self._update(m, -d)
+        return self.letters[pos]
 
 
 def validate_sequence(seq: List[str], is_target_flags: List[int], lure_types: List[str], *,
@@ -125,44 +396,703 @@ def validate_sequence(seq: List[str], is_target_flags: List[int], lure_types: Li
     return True, "ok"
 
 
-def _sample_target_indices(n_back: int, n_trials: int, desired: int, max_consec_targets: int, *, attempts: int = 200) -> Optional[List[int]]:
-    """Sample target indices >= n_back honoring constraints.
+def _target_capacity(slots: int, run: int, max_consec_targets: int) -> int:
+    """Maximum number of targets that fit in `slots` remaining positions.
+
+    `run` is the length of the target run immediately preceding the first of
+    those positions. Filling greedily (targets until the run cap, then one
+    non-target, repeat) is optimal, so this is closed-form.
+    """
+    if slots <= 0 or max_consec_targets <= 0:
+        return 0
+    m = max_consec_targets
+    head = max(0, m - run)
+    if slots <= head:
+        return slots
+    rest = slots - head - 1
+    return head + (rest // (m + 1)) * m + min(rest % (m + 1), m)
+
+
+def _max_targets(n_back: int, n_trials: int, max_consec_targets: int) -> int:
+    """Largest target count any layout can hold (targets only at i >= n_back)."""
+    return _target_capacity(n_trials - n_back, 0, max_consec_targets)
+
+
+def count_target_placements(n_back: int, n_trials: int, desired: int, max_consec_targets: int) -> int:
+    """Exact number of valid target layouts (dynamic programming, big-int exact).
+
+    Counts 0/1 strings over positions n_back..n_trials-1 with exactly
+    `desired` ones and no run of ones longer than `max_consec_targets`.
+    State is (targets placed, current run); cost O(n_trials * desired * max_consec).
+    With max_consec_targets == 1 the count is closed-form: choose `desired`
+    of the slots - desired + 1 gaps between non-targets.
+    """
+    slots = max(0, n_trials - n_back)
+    if desired < 0:
+        return 0
+    if desired == 0:
+        return 1
+    m = max(0, max_consec_targets)
+    if m == 1:
+        return math.comb(max(0, slots - desired + 1), desired)
+    # ways[k][r]: layouts of the prefix with k targets ending in a run of r
+    ways = [[0] * (m + 1) for _ in range(desired + 1)]
+    ways[0][0] = 1
+    for _ in range(slots):
+        nxt = [[0] * (m + 1) for _ in range(desired + 1)]
+        for k in range(desired + 1):
+            row = ways[k]
+            total = sum(row)
+            if total == 0:
+                continue
+            nxt[k][0] += total
+            if k < desired:
+                for r in range(m):
+                    if row[r]:
+                        nxt[k + 1][r + 1] += row[r]
+        ways = nxt
+    return sum(ways[desired])
+
+
+@dataclass
+class Feasibility:
+    """Outcome of `check_feasibility` for one parameter set.
+
+    Fields:
+    - feasible: True if a block can pass `validate_sequence`
+    - desired_targets: round(target_rate * n_trials)
+    - max_targets: largest target count `max_consec_targets` allows
+    - placements: exact number of target layouts with `desired_targets` targets
+      (None when counting would exceed PLACEMENT_COUNT_LIMIT DP cells)
+    - message: human-readable verdict
+    """
+    feasible: bool
+    desired_targets: int
+    max_targets: int
+    placements: Optional[int]
+    message: str
+
+
+def check_feasibility(n_back: int, n_trials: int, *, target_rate: float,
+                      max_consec_targets: int) -> Feasibility:
+    """Decide up front whether a parameter set can produce valid blocks.
+
+    A block is still acceptable when the quota is one above the capacity
+    (validation allows ±1), so that case is feasible with a capped quota.
+    """
+    desired = round(target_rate * n_trials)
+    cap = _max_targets(n_back, n_trials, max_consec_targets)
+    placements: Optional[int] = 0
+    if desired <= cap:
+        cells = max(0, n_trials - n_back) * (desired + 1) * (max_consec_targets + 1)
+        if max_consec_targets == 1 or cells <= PLACEMENT_COUNT_LIMIT:
+            placements = count_target_placements(n_back, n_trials, desired, max_consec_targets)
+        else:
+            placements = None
+    if desired - 1 > cap:
+        msg = (f"{n_back}-back with {n_trials} trials and target rate {target_rate:g} needs "
+               f"{desired} targets, but at most {cap} fit with --max-consec-targets "
+               f"{max_consec_targets} (targets only from trial {n_back + 1}). Lower the target "
+               f"rate, raise --max-consec-targets, or add trials.")
+        return Feasibility(False, desired, cap, 0, msg)
+    if desired > cap:
+        msg = f"quota capped at {cap} of {desired} targets (within ±1 tolerance)"
+    elif placements is None:
+        msg = "too many target layouts to count exactly"
+    elif placements < 10 ** 15:
+        msg = f"{placements} target layouts"
+    else:
+        msg = f"about 10^{math.log10(placements):.1f} target layouts"
+    return Feasibility(True, desired, cap, placements, msg)
+
+
+# Work counters for generate_sequence (process-wide; see get_generation_counters)
+GENERATION_COUNTERS: Dict[str, int] = {
+    "calls": 0,          # generate_sequence invocations
+    "attempts": 0,       # solver passes started
+    "aborts": 0,         # passes stopped early by the streaming validator
+    "trials_built": 0,   # trials appended across all passes
+    "capped": 0,         # calls whose target quota exceeded capacity
+    "fallbacks": 0,      # calls that returned an unvalidated block after max_attempts
+}
+
+
+def get_generation_counters() -> Dict[str, int]:
+    """Return a snapshot of the generation work counters."""
+    return dict(GENERATION_COUNTERS)
+
+
+def reset_generation_counters() -> None:
+    """Zero the generation work counters."""
+    for k in GENERATION_COUNTERS:
+        GENERATION_COUNTERS[k] = 0
+
+
+@dataclass
+class GenerationStats:
+    """How much work one `generate_sequence` call needed (per-call counterpart of the counters).
+
+    Fields:
+    - attempts: solver passes started
+    - aborts: passes stopped early by the streaming validator
+    - rejections: reason string -> number of passes rejected for it
+    - requested_targets: round(target_rate * n_trials)
+    - placed_targets: targets in the returned block
+    - capped: requested_targets exceeded what max_consec_targets allows
+    - fallback: the block is the unvalidated pass built after max_attempts
+    - lures_n_minus_1 / lures_n_plus_1: lures in the returned block
+    - lure_shortfall: quota lures that could not be placed (lure_mode="quota"
+      only, summed over both streams for `generate_dual_sequence`; None otherwise)
+    - target_sampler: target-layout sampler used, "dp" or "gaps" (exactly
+      uniform) or "streaming" (approximate; large blocks with
+      max_consec_targets > 1, see DP_TABLE_LIMIT)
+    - position_sampler: the same for the position stream
+      (`generate_dual_sequence` only; None otherwise)
+    - elapsed_ms: wall time of the call
+    - position_targets / position_lures / dual_targets: position-stream
+      targets and lures and trials that are targets in both streams
+      (`generate_dual_sequence` only; None otherwise)
+    """
+    attempts: int = 0
+    aborts: int = 0
+    rejections: Dict[str, int] = field(default_factory=dict)
+    requested_targets: int = 0
+    placed_targets: int = 0
+    capped: bool = False
+    fallback: bool = False
+    lures_n_minus_1: int = 0
+    lures_n_plus_1: int = 0
+    lure_shortfall: Optional[int] = None
+    target_sampler: str = "dp"
+    position_sampler: Optional[str] = None
+    elapsed_ms: float = 0.0
+    position_targets: Optional[int] = None
+    position_lures: Optional[int] = None
+    dual_targets: Optional[int] = None
+
+
+class StreamingValidator:
+    """Incremental form of `validate_sequence` with O(1) work per trial.
+
+    Feed trials in order with `append`; it returns False as soon as the
+    prefix violates a rule or can no longer reach the target budget, so a
+    generator can abort the attempt right there. `finish` applies the final
+    target-count check. `ok` and `reason` hold the verdict so far, using the
+    same reason strings as `validate_sequence`.
+
+    Only the last N+1 letters are kept, so memory is O(N) as well.
+    """
+
+    def __init__(self, n_back: int, n_trials: int, *, target_rate: float,
+                 max_consec_targets: int, desired_targets: Optional[int] = None) -> None:
+        self.n_back = n_back
+        self.n_trials = n_trials
+        self.max_consec_targets = max_consec_targets
+        self.desired = round(target_rate * n_trials) if desired_targets is None else int(desired_targets)
+        self.pos = 0
+        self.targets = 0
+        self.consec = 0
+        self.ok = True
+        self.reason = "ok"
+        self._recent: List[str] = [""] * (n_back + 2)  # ring buffer indexed by position
+
+    def _letter_at(self, i: int) -> str:
+        return self._recent[i % len(self._recent)]
+
+    def _fail(self, reason: str) -> bool:
+        self.ok = False
+        self.reason = reason
+        return False
+
+    def append(self, letter: str, is_target: int, lure_type: str) -> bool:
+        """Add the next trial; returns False once the sequence cannot be valid."""
+        if not self.ok:
+            return False
+        i = self.pos
+        n = self.n_back
+        letter_n = self._letter_at(i - n) if i >= n else None
+        if is_target == 1 and i < n:
+            return self._fail("Target in first N trials")
+        if n > 1 and i >= 1 and letter == self._letter_at(i - 1) and is_target == 0 and lure_type == "none":
+            return self._fail("Immediate repeat without target/lure")
+        if lure_type == "n-1":
+            if not (i >= n - 1 and (n - 1) > 0):
+                return self._fail("n-1 lure too early")
+            if is_target == 1:
+                return self._fail("lure double-counted as target")
+            if letter != self._letter_at(i - (n - 1)):
+                return self._fail("n-1 lure mismatch")
+            if letter_n is not None and letter == letter_n:
+                return self._fail("n-1 lure equals target")
+        elif lure_type == "n+1":
+            if not (i >= n + 1):
+                return self._fail("n+1 lure too early")
+            if is_target == 1:
+                return self._fail("lure double-counted as target")
+            if letter != self._letter_at(i - (n + 1)):
+                return self._fail("n+1 lure mismatch")
+            if letter_n is not None and letter == letter_n:
+                return self._fail("n+1 lure equals target")
+        if is_target == 1:
+            self.targets += 1
+            self.consec += 1
+            if self.consec > self.max_consec_targets:
+                return self._fail(f">{self.max_consec_targets} consecutive targets")
+        else:
+            self.consec = 0
+        self._recent[i % len(self._recent)] = letter
+        self.pos = i + 1
+        # Target budget: too many already, or too few slots left to catch up
+        if self.targets > self.desired + 1:
+            return self._fail(f"Target count {self.targets} outside ±1 around {self.desired}")
+        start = max(self.pos, n)
+        run = self.consec if self.pos >= n else 0
+        if self.targets + _target_capacity(self.n_trials - start, run, self.max_consec_targets) < self.desired - 1:
+            return self._fail(f"Target budget infeasible: {self.targets} placed, {self.desired} wanted")
+        return True
+
+    def finish(self) -> Tuple[bool, str]:
+        """Apply the end-of-block checks and return (ok, reason)."""
+        if self.ok and not (self.desired - 1 <= self.targets <= self.desired + 1):
+            self._fail(f"Target count {self.targets} outside ±1 around {self.desired}")
+        return self.ok, self.reason
+
+
+def _sample_target_indices_streaming(n_back: int, n_trials: int, desired: int, max_consec_targets: int, *,
+                           rng: Optional[random.Random] = None) -> Optional[List[int]]:
+    """Sample target indices >= n_back in a single pass with O(1) state.
+
+    Walks positions left to right and decides each one by forward checking:
+    a position is forced to be a target when the remaining quota equals the
+    remaining capacity, forced to be a non-target when the quota is met or the
+    run cap is reached, and otherwise drawn with probability quota/slots.
+    Every decision keeps the rest of the layout feasible, so this never retries,
+    but layouts are not exactly uniform. Used when the DP table of
+    `_sample_target_indices` would be too large.
 
     Constraints:
     - No more than `max_consec_targets` consecutive targets
-    - Break N-back chains: avoid selecting i if (i - n_back) is already a target
-    Returns: sorted index list or None on failure.
+    Returns: sorted index list, or None if `desired` exceeds the capacity.
     """
     if desired <= 0:
         return []
-    positions = list(range(n_back, n_trials))
-    for _ in range(attempts):
-        random.shuffle(positions)
-        chosen: List[int] = []
-        for i in positions:
-            if len(chosen) >= desired:
-                break
-            # Consecutive target constraint
-            if max_consec_targets <= 0:
-                allow = False
-            else:
-                if max_consec_targets == 1 and chosen and i - chosen[-1] == 1:
-                    continue
-                # General case: ensure last run length would not exceed max
-                if chosen:
-                    run = 1
-                    j = len(chosen) - 1
-                    while j >= 0 and chosen[j] == (i - (len(chosen) - j)):
-                        run += 1
-                        j -= 1
-                    if run > max_consec_targets:
-                        continue
-            # Note: Allow N-back chains (i and i-n_back both targets). This improves feasibility
-            # for higher target rates, especially in practice, and is common in N-back designs.
+    if desired > _max_targets(n_back, n_trials, max_consec_targets):
+        return None
+    r = rng or random
+    chosen: List[int] = []
+    remaining = desired
+    run = 0
+    for i in range(n_back, n_trials):
+        if remaining == 0:
+            break
+        slots = n_trials - i
+        if run >= max_consec_targets:
+            take = False
+        elif remaining - 1 > _target_capacity(slots - 1, run + 1, max_consec_targets):
+            take = False
+        elif remaining > _target_capacity(slots - 1, 0, max_consec_targets):
+            take = True
+        else:
+            take = r.random() < remaining / slots
+        if take:
             chosen.append(i)
-        if len(chosen) == desired:
-            return sorted(chosen)
-    return None
+            remaining -= 1
+            run += 1
+        else:
+            run = 0
+    return chosen
+
+
+# Cell budget for the uniform DP sampler's table (big-int cells, cached per parameter set);
+# larger problems use the gap sampler (max_consec_targets == 1) or the approximate
+# streaming sampler, reported as GenerationStats.target_sampler
+DP_TABLE_LIMIT = 200_000
+# Larger budget for the dual sampler's per-layout table (not cached)
+DUAL_DP_TABLE_LIMIT = 2_000_000
+# check_feasibility counts layouts exactly up to this many DP cells (~1 s)
+PLACEMENT_COUNT_LIMIT = 2_000_000
+
+
+def _sample_target_indices_gaps(n_back: int, n_trials: int, desired: int, *,
+                                rng: Optional[random.Random] = None) -> List[int]:
+    """Exactly uniform layout for max_consec_targets == 1 in O(n_trials), no table.
+
+    A layout without adjacent targets is a choice of `desired` of the
+    slots - desired + 1 gaps around the non-targets; the j-th chosen gap
+    (sorted) puts a target at slot gap + j. The caller checks capacity.
+    """
+    r = rng or random
+    gaps = (n_trials - n_back) - desired + 1
+    return [n_back + g + j for j, g in enumerate(sorted(r.sample(range(gaps), desired)))]
+
+
+@lru_cache(maxsize=16)
+def _completion_table(slots: int, desired: int, max_consec_targets: int) -> Tuple[Tuple[int, ...], ...]:
+    """Backward DP for uniform target sampling.
+
+    Entry [j][k * (m + 1) + r] is the number of ways to finish the last
+    `slots - j` positions with exactly k more targets, given a preceding run
+    of r targets. Cached because every block of a session shares parameters.
+    """
+    m = max_consec_targets
+    width = m + 1
+    nxt = [0] * ((desired + 1) * width)
+    for r in range(width):
+        nxt[r] = 1
+    table = [tuple(nxt)]
+    for _ in range(slots):
+        cur = [0] * ((desired + 1) * width)
+        for k in range(desired + 1):
+            base = k * width
+            skip = nxt[base]
+            for r in range(width):
+                ways = skip
+                if k > 0 and r < m:
+                    ways += nxt[base - width + r + 1]
+                cur[base + r] = ways
+        table.append(tuple(cur))
+        nxt = cur
+    table.reverse()
+    return tuple(table)
+
+
+def _target_sampler(n_back: int, n_trials: int, desired: int, max_consec_targets: int) -> str:
+    """Sampler `_sample_target_indices` uses for these parameters.
+
+    "dp" and "gaps" are exactly uniform over valid layouts; "streaming" is not.
+    """
+    m = max_consec_targets
+    if desired <= 0 or (n_trials - n_back) * (desired + 1) * (m + 1) <= DP_TABLE_LIMIT:
+        return "dp"
+    return "gaps" if m == 1 else "streaming"
+
+
+def _position_sampler(n_back: int, n_trials: int, desired: int, max_consec_targets: int,
+                      max_dual_targets: int) -> str:
+    """Sampler `_sample_position_target_indices` uses for these parameters.
+
+    Its own "dp" up to DUAL_DP_TABLE_LIMIT cells; beyond that, layouts from
+    `_target_sampler`'s sampler are drawn until one respects the dual cap.
+    """
+    slots = n_trials - n_back
+    m = max_consec_targets
+    cap = max(0, min(max_dual_targets, desired))
+    if (slots + 1) * (desired + 1) * (m + 1) * (cap + 1) <= DUAL_DP_TABLE_LIMIT:
+        return "dp"
+    return _target_sampler(n_back, n_trials, desired, m)
+
+
+def _sample_target_indices(n_back: int, n_trials: int, desired: int, max_consec_targets: int, *,
+                           rng: Optional[random.Random] = None) -> Optional[List[int]]:
+    """Sample a target layout exactly uniformly over all valid layouts.
+
+    Uses the completion counts of `_completion_table` (a DP over position,
+    targets remaining and current run length): at each position a target is
+    placed with probability ways(with target) / ways(from here), drawn with
+    exact integer arithmetic. Building the table is O(n_trials * desired *
+    max_consec_targets); sampling is O(n_trials) and never fails on a feasible
+    problem. Beyond DP_TABLE_LIMIT cells the layout comes from
+    `_sample_target_indices_gaps` (still uniform) or, for runs longer than
+    one, `_sample_target_indices_streaming`, both linear in n_trials.
+
+    Constraints:
+    - No more than `max_consec_targets` consecutive targets
+    Returns: sorted index list, or None if `desired` exceeds the capacity.
+    """
+    if desired <= 0:
+        return []
+    if desired > _max_targets(n_back, n_trials, max_consec_targets):
+        return None
+    slots = n_trials - n_back
+    m = max_consec_targets
+    sampler = _target_sampler(n_back, n_trials, desired, m)
+    if sampler == "gaps":
+        return _sample_target_indices_gaps(n_back, n_trials, desired, rng=rng)
+    if sampler == "streaming":
+        return _sample_target_indices_streaming(n_back, n_trials, desired, max_consec_targets, rng=rng)
+    r = rng or random
+    table = _completion_table(slots, desired, m)
+    width = m + 1
+    chosen: List[int] = []
+    remaining = desired
+    run = 0
+    for j in range(slots):
+        if remaining == 0:
+            break
+        here = table[j][remaining * width + run]
+        take_ways = table[j + 1][(remaining - 1) * width + run + 1] if run < m else 0
+        if take_ways and r.randrange(here) < take_ways:
+            chosen.append(n_back + j)
+            remaining -= 1
+            run += 1
+        else:
+            run = 0
+    return chosen
+
+
+def _lure_quotas(n_back: int, n_trials: int, n_targets: int,
+                 lure_n_minus_1_rate: float, lure_n_plus_1_rate: float) -> Tuple[int, int]:
+    """Quota-mode lure counts: round(rate * non-targets) per type (no n-1 lures at 1-back)."""
+    non_targets = n_trials - n_targets
+    n_minus_1 = round(lure_n_minus_1_rate * non_targets) if n_back > 1 else 0
+    return n_minus_1, round(lure_n_plus_1_rate * non_targets)
+
+
+def _lure_shortfall(n_back: int, n_trials: int, is_target: Sequence[int], lure_types: Sequence[str],
+                    lure_n_minus_1_rate: float, lure_n_plus_1_rate: float) -> int:
+    """Quota lures missing from a finished stream (0 when both quotas were met)."""
+    n_minus_1_quota, n_plus_1_quota = _lure_quotas(n_back, n_trials, sum(is_target),
+                                                   lure_n_minus_1_rate, lure_n_plus_1_rate)
+    return (max(0, n_minus_1_quota - list(lure_types).count("n-1"))
+            + max(0, n_plus_1_quota - list(lure_types).count("n+1")))
+
+
+def _lure_merge_ok(n_back: int, root: List[int], members: Dict[int, List[int]], lures: Dict[int, str],
+                   i: int, kind: str, max_identical_run: int) -> bool:
+    """Whether turning plain trial i into a `kind` lure keeps a valid layout valid.
+
+    The lure makes every trial rooted at i (i itself and the targets/lures
+    copying it, `members[i]`) share the lured root s. Only equalities between
+    that class and class s are new, so the check looks at the lures that
+    reference a member of class i and at the identical-letter runs containing
+    one; the work is proportional to the class size and those runs, not to
+    the block.
+    """
+    lags = {"n-1": n_back - 1, "n+1": n_back + 1}
+    s = root[i - lags[kind]]
+    if i >= n_back and root[i - n_back] == s:
+        return False
+    n_trials = len(root)
+
+    def _new_root(x: int) -> int:
+        return s if root[x] == i else root[x]
+
+    moved = members[i]
+    for j in moved:
+        # Lures whose lured or N-back source is j
+        for k, k_kind in ((j + n_back, None), (j + lags["n-1"], "n-1"), (j + lags["n+1"], "n+1")):
+            lure_kind = kind if k == i else lures.get(k)
+            if k >= n_trials or lure_kind is None or (k_kind is not None and lure_kind != k_kind):
+                continue
+            if k >= n_back and _new_root(k - lags[lure_kind]) == _new_root(k - n_back):
+                return False
+    if max_identical_run > 0:
+        for j in moved:
+            start = j
+            while start > 0 and _new_root(start - 1) == _new_root(j):
+                start -= 1
+            run = 0
+            x = start
+            while x < n_trials and _new_root(x) == _new_root(j):
+                run += 1
+                if run > max_identical_run and (x == i or x in lures):
+                    return False
+                x += 1
+    return True
+
+
+def _sample_lure_positions(n_back: int, n_trials: int, target_indices: List[int],
+                           n_minus_1_count: int, n_plus_1_count: int, *,
+                           max_identical_run: int,
+                           rng: Optional[random.Random] = None) -> Tuple[Dict[int, str], Dict[int, List[int]]]:
+    """Place n-1 / n+1 lure quotas jointly with a fixed target layout.
+
+    Works on letter *sources* instead of letters: a target or lure copies an
+    earlier trial, so each trial's letter is that of its root (the plain
+    trial the copy chain starts from). A lure at i is only placed where the
+    lured root differs from the N-back root, which is exactly the condition
+    `validate_sequence` checks once letters exist.
+
+    Both lure types share one pool of slots (a slot holds at most one lure).
+    Open non-target slots are visited left to right. A slot where at least
+    one type with quota left is currently valid gets a lure with probability
+    (quota left) / (open slots left), and always once the two are equal. The
+    type is drawn among the valid ones in proportion to their remaining
+    quota. A lure can invalidate later slots, so the forward pass may end
+    short. A repair pass then tries the remaining plain slots in random order
+    and keeps each lure that leaves the layout valid (`_lure_merge_ok`).
+    A quota can still end short when no valid layout is found; callers
+    report that (GenerationStats.lure_shortfall).
+
+    Returns (lures, avoid): lure type per trial index, and for each plain
+    root the earlier roots whose letter it must not reuse (so the lured and
+    N-back letters really differ when letters are assigned).
+    """
+    r = rng or random
+    target_set = set(target_indices)
+    lags = {"n-1": n_back - 1, "n+1": n_back + 1}
+    quota = {"n-1": n_minus_1_count if n_back > 1 else 0, "n+1": n_plus_1_count}
+    first = min((lag for kind, lag in lags.items() if quota[kind] > 0), default=n_trials)
+    # Open (non-target) slots from i onward where some lure type is in range
+    left = [0] * (n_trials + 1)
+    for i in range(n_trials - 1, -1, -1):
+        left[i] = left[i + 1] + int(i >= first and i not in target_set)
+
+    root = list(range(n_trials))
+    lures: Dict[int, str] = {}
+    same_run = 0
+    for i in range(n_trials):
+        root_n = root[i - n_back] if i >= n_back else None
+        if i in target_set:
+            root[i] = root[i - n_back]
+        elif i >= first:
+            wanted = sum(q for kind, q in quota.items() if i >= lags[kind])
+            if wanted and r.random() * left[i] < wanted:
+                valid = []
+                for kind, lag in lags.items():
+                    if quota[kind] <= 0 or i < lag:
+                        continue
+                    src = root[i - lag]
+                    if src == root_n:
+                        continue
+                    if max_identical_run > 0 and src == root[i - 1] and same_run + 1 > max_identical_run:
+                        continue
+                    valid.append(kind)
+                if valid:
+                    pick = r.random() * sum(quota[k] for k in valid)
+                    kind = valid[-1]
+                    for k in valid:
+                        pick -= quota[k]
+                        if pick < 0:
+                            kind = k
+                            break
+                    lures[i] = kind
+                    quota[kind] -= 1
+                    root[i] = root[i - lags[kind]]
+        same_run = same_run + 1 if i >= 1 and root[i] == root[i - 1] else 1
+
+    if any(quota.values()):
+        # Repair: incremental checks keep the pass roughly linear in n_trials
+        members: Dict[int, List[int]] = {}
+        for j, rt in enumerate(root):
+            members.setdefault(rt, []).append(j)
+        candidates = [i for i in range(first, n_trials) if i not in target_set and i not in lures]
+        r.shuffle(candidates)
+        for i in candidates:
+            kinds = [k for k in lags if quota[k] > 0 and i >= lags[k]]
+            r.shuffle(kinds)
+            for kind in kinds:
+                if _lure_merge_ok(n_back, root, members, lures, i, kind, max_identical_run):
+                    src = root[i - lags[kind]]
+                    for j in members[i]:
+                        root[j] = src
+                    members[src].extend(members.pop(i))
+                    lures[i] = kind
+                    quota[kind] -= 1
+                    break
+            if not any(quota.values()):
+                break
+
+    avoid: Dict[int, List[int]] = {}
+    for i in sorted(lures):
+        if i >= n_back:
+            root_n = root[i - n_back]
+            avoid.setdefault(max(root[i], root_n), []).append(min(root[i], root_n))
+    return lures, avoid
+
+
+def _plan_quota_lures(n_back: int, n_trials: int, target_indices: List[int], *,
+                      lure_n_minus_1_rate: float, lure_n_plus_1_rate: float, max_identical_run: int,
+                      rng: Optional[random.Random] = None) -> Tuple[Dict[int, str], Dict[int, List[int]]]:
+    """Quota-mode lure layout for one stream: round(rate * non-targets) lures of each type.
+
+    A layout that ends short is resampled up to LURE_QUOTA_RETRIES times and
+    the fullest one is kept; any remaining shortfall shows up in the block's
+    lure counts (see GenerationStats.lure_shortfall).
+    """
+    n_minus_1_quota, n_plus_1_quota = _lure_quotas(n_back, n_trials, len(target_indices),
+                                                   lure_n_minus_1_rate, lure_n_plus_1_rate)
+    wanted = n_minus_1_quota + n_plus_1_quota
+    best = None
+    for _ in range(LURE_QUOTA_RETRIES):
+        planned = _sample_lure_positions(n_back, n_trials, target_indices, n_minus_1_quota, n_plus_1_quota,
+                                         max_identical_run=max_identical_run, rng=rng)
+        if best is None or len(planned[0]) > len(best[0]):
+            best = planned
+        if len(best[0]) >= wanted:
+            break
+    return best
+
+
+def _solve_block(n_back: int, n_trials: int, target_indices: List[int], *,
+                 lure_n_minus_1_rate: float, lure_n_plus_1_rate: float,
+                 max_identical_run: int, soft_balance: bool,
+                 include_lures: bool,
+                 validator: Optional[StreamingValidator] = None,
+                 planned_lures: Optional[Tuple[Dict[int, str], Dict[int, List[int]]]] = None,
+                 alphabet: Optional[Sequence] = None,
+                 rng: Optional[random.Random] = None) -> Tuple[List[str], List[int], List[str]]:
+    """Assign letters and lures to a fixed target layout in one forward pass.
+
+    Each trial's letter domain is pruned against everything `validate_sequence`
+    checks before a value is picked, so the pass cannot dead-end:
+    - targets copy the N-back letter
+    - lures are only placed where the lured letter differs from the N-back
+      letter (otherwise the trial would silently become a target)
+    - plain non-targets exclude the N-back letter and the previous letter
+    With 23 letters and at most two exclusions the domain is never empty.
+    `alphabet` replaces LETTERS for other streams (e.g. POSITIONS); it needs
+    at least three symbols.
+
+    With `planned_lures` (from `_sample_lure_positions`) lure positions are
+    fixed in advance instead of drawn per trial, and plain letters also avoid
+    the letters listed for them, which keeps every planned lure valid.
+
+    If a `validator` is given, every trial is streamed into it and the pass
+    stops at the first trial it rejects (the returned lists are then a prefix).
+    Returns (letters, target flags, lure types).
+    """
+    r = rng or random
+    target_set = set(target_indices)
+    seq: List[str] = []
+    is_target_flags: List[int] = []
+    lure_types: List[str] = []
+    sampler = LetterSampler(list(alphabet or LETTERS), soft_balance=soft_balance)
+    same_run = 0  # identical-letter run ending at the previous trial
+
+    def _run_ok(cand: str) -> bool:
+        return max_identical_run <= 0 or (same_run + 1 if seq and seq[-1] == cand else 1) <= max_identical_run
+
+    for i in range(n_trials):
+        letter_n = seq[i - n_back] if i >= n_back else None
+        lure_type = "none"
+        if i in target_set:
+            letter = seq[i - n_back]
+            is_target_flags.append(1)
+        else:
+            letter = None
+            if planned_lures is not None:
+                lure_type = planned_lures[0].get(i, "none")
+                if lure_type != "none":
+                    letter = seq[i - (n_back - 1)] if lure_type == "n-1" else seq[i - (n_back + 1)]
+            elif include_lures:
+                # n-1 lure
+                if (n_back - 1) > 0 and i >= (n_back - 1) and r.random() < lure_n_minus_1_rate:
+                    cand = seq[i - (n_back - 1)]
+                    if cand != letter_n and _run_ok(cand):
+                        letter, lure_type = cand, "n-1"
+                # n+1 lure
+                if letter is None and i >= (n_back + 1) and r.random() < lure_n_plus_1_rate:
+                    cand = seq[i - (n_back + 1)]
+                    if cand != letter_n and _run_ok(cand):
+                        letter, lure_type = cand, "n+1"
+            if letter is None:
+                exclude: Tuple[Optional[str], ...] = (letter_n, seq[-1] if seq else None)
+                if planned_lures is not None and i in planned_lures[1]:
+                    extra = tuple(seq[q] for q in planned_lures[1][i])
+                    # Small alphabets: never let must-differ letters empty the domain
+                    if len(set(exclude + extra) - {None}) < len(sampler.letters):
+                        exclude += extra
+                letter = sampler.sample(exclude, rng=r)
+            is_target_flags.append(0)
+        lure_types.append(lure_type)
+        same_run = same_run + 1 if seq and seq[-1] == letter else 1
+        seq.append(letter)
+        sampler.add(letter)
+        if validator is not None and not validator.append(letter, is_target_flags[-1], lure_type):
+            break
+    GENERATION_COUNTERS["trials_built"] += len(seq)
+    return seq, is_target_flags, lure_types
 
 
 def generate_sequence(n_back: int, n_trials: int, *,
@@ -174,8 +1104,19 @@ def generate_sequence(n_back: int, n_trials: int, *,
                       fixed_iti_ms: int = 500,
                       max_attempts: int = MAX_ATTEMPTS,
                       soft_balance_initial: bool = True,
-                      include_lures: bool = True) -> List[TrialPlan]:
-    """Generate a list of TrialPlan entries for a block.
+                      include_lures: bool = True,
+                      lure_mode: str = "rate",
+                      rng: Optional[random.Random] = None,
+                      stats: Optional[GenerationStats] = None) -> BlockPlan:
+    """Generate one block as a `BlockPlan`.
+
+    The block is built by a constraint-propagating solver: target positions
+    are sampled uniformly over all valid layouts (`_sample_target_indices`)
+    and letters/lures are then assigned with pruned domains (`_solve_block`).
+    A feasible parameter set therefore yields a valid block on the first
+    attempt, in time linear in `n_trials`. Each trial is also streamed into a
+    `StreamingValidator`, which aborts a pass at the first violation instead
+    of after the whole block; see `get_generation_counters` for the tally.
 
     Inputs:
     - n_back: N level (1/2/3)
@@ -185,173 +1126,676 @@ def generate_sequence(n_back: int, n_trials: int, *,
     - max_consec_targets: max consecutive targets allowed
     - max_identical_run: cap identical-letter runs unless required by constraints
     - fixed_iti_ms: ITI remainder per trial (SOA - stimulus duration)
-    - max_attempts: number of attempts to produce a valid sequence
+    - max_attempts: safety bound on solver passes (one pass suffices when the
+      parameters are feasible)
     - soft_balance_initial: favor less-frequent letters early
     - include_lures: whether to include lures on non-target trials
+    - lure_mode: "rate" draws each lure independently per non-target trial;
+      "quota" aims for round(rate * non-targets) lures of each type, placed
+      jointly with the target layout (`_sample_lure_positions`); any lures it
+      could not place are counted in `stats.lure_shortfall`
+    - rng: random source (e.g. a per-block stream from `nback.rng`); defaults
+      to the global `random` module
+    - stats: optional fresh `GenerationStats`, filled in with this call's
+      attempts, rejection reasons, capping and fallback
 
-    Returns: list[TrialPlan]
+    If `target_rate` asks for more targets than `max_consec_targets` allows,
+    the layout is filled to capacity and returned even though it falls outside
+    the ±1 tolerance (the old lure-free emergency fallback did the same,
+    silently and after exhausting every attempt).
+
+    Returns: BlockPlan (iterates like list[TrialPlan]; see `BlockPlan.to_trials`)
     """
-    tolerance = 1
+    if lure_mode not in ("rate", "quota"):
+        raise ValueError(f"lure_mode must be 'rate' or 'quota', got {lure_mode!r}")
+    t0 = time.perf_counter()
+    st = stats if stats is not None else GenerationStats()
     desired_targets = round(target_rate * n_trials)
+    st.requested_targets = desired_targets
+    capacity = _max_targets(n_back, n_trials, max_consec_targets)
+    if desired_targets > capacity:
+        GENERATION_COUNTERS["capped"] += 1
+        st.capped = True
+        desired_targets = capacity
+    st.target_sampler = _target_sampler(n_back, n_trials, desired_targets, max_consec_targets)
+    use_quota = include_lures and lure_mode == "quota"
 
-    for _attempt in range(1, max_attempts + 1):
-        seq: List[str] = []
-        is_target_flags: List[int] = []
-        lure_types: List[str] = []
-        freqs: Dict[str, int] = {c: 0 for c in LETTERS}
+    def _plan_lures(target_indices: List[int]) -> Optional[Tuple[Dict[int, str], Dict[int, List[int]]]]:
+        if not use_quota:
+            return None
+        return _plan_quota_lures(n_back, n_trials, target_indices,
+                                 lure_n_minus_1_rate=lure_n_minus_1_rate, lure_n_plus_1_rate=lure_n_plus_1_rate,
+                                 max_identical_run=max_identical_run, rng=rng)
 
-        target_indices = _sample_target_indices(n_back, n_trials, desired_targets, max_consec_targets)
-        if target_indices is None:
-            continue
-        target_set = set(target_indices)
-
-        for i in range(n_trials):
-            iti_ms = int(fixed_iti_ms)
-            planned_lure_type = "none"
-            # Target placement by pre-sampled indices
-            if i in target_set and i >= n_back:
-                # Letter must match n-back
-                if i >= n_back:
-                    letter = seq[i - n_back]
+    solver_kwargs = dict(
+        lure_n_minus_1_rate=lure_n_minus_1_rate,
+        lure_n_plus_1_rate=lure_n_plus_1_rate,
+        max_identical_run=max_identical_run,
+        soft_balance=soft_balance_initial,
+        include_lures=include_lures,
+        rng=rng,
+    )
+    GENERATION_COUNTERS["calls"] += 1
+    seq: List[str] = []
+    is_target_flags: List[int] = []
+    lure_types: List[str] = []
+    ok = False
+    for _attempt in range(1, max(1, max_attempts) + 1):
+        GENERATION_COUNTERS["attempts"] += 1
+        st.attempts += 1
+        target_indices = _sample_target_indices(n_back, n_trials, desired_targets, max_consec_targets, rng=rng) or []
+        # Budget is checked against the (possibly capped) quota actually being placed
+        validator = StreamingValidator(n_back, n_trials, target_rate=target_rate,
+                                       max_consec_targets=max_consec_targets,
+                                       desired_targets=desired_targets)
+        seq, is_target_flags, lure_types = _solve_block(
+            n_back, n_trials, target_indices, validator=validator,
+            planned_lures=_plan_lures(target_indices), **solver_kwargs)
+        ok, reason = validator.finish()
+        if ok:
+            break
+        st.rejections[reason] = st.rejections.get(reason, 0) + 1
+        if len(seq) < n_trials:
+            GENERATION_COUNTERS["aborts"] += 1
+            st.aborts += 1
+    if not ok:
+        # Unreachable for the built-in solver; keep a complete block regardless
+        GENERATION_COUNTERS["fallbacks"] += 1
+        st.fallback = True
+        target_indices = _sample_target_indices(n_back, n_trials, desired_targets, max_consec_targets, rng=rng) or []
+        seq, is_target_flags, lure_types = _solve_block(n_back, n_trials, target_indices,
+                                                        planned_lures=_plan_lures(target_indices), **solver_kwargs)
+
+    plans = BlockPlan.from_arrays(
+        [LETTER_CODES[c] for c in seq],
+        is_target_flags,
+        [LURE_CODES[t] for t in lure_types],
+        int(fixed_iti_ms),
+    )
+    st.placed_targets = sum(is_target_flags)
+    st.lures_n_minus_1 = lure_types.count("n-1")
+    st.lures_n_plus_1 = lure_types.count("n+1")
+    if use_quota:
+        st.lure_shortfall = _lure_shortfall(n_back, n_trials, is_target_flags, lure_types,
+                                            lure_n_minus_1_rate, lure_n_plus_1_rate)
+    st.elapsed_ms = (time.perf_counter() - t0) * 1000.0
+    return plans
+
+
+def _rate_state_safe(drift: float, run: int, rate: float, slack: float, max_consec_targets: int) -> bool:
+    """True if the target stream can continue forever from (drift, run).
+
+    Follows the continuation with the most targets until its run has to
+    break; the state is safe if the non-target ending that run keeps the
+    drift within -slack. For rate <= m / (m + 1) every later cycle of m
+    targets and one non-target gains drift, so checking one run suffices.
+    """
+    while run < max_consec_targets and drift + 1.0 - rate <= slack + 1e-9:
+        drift += 1.0 - rate
+        run += 1
+    return drift - rate >= -slack - 1e-9
+
+
+def iter_trials(n_back: int, n_trials: Optional[int] = None, *,
+                target_rate: float = TARGET_RATE,
+                lure_n_minus_1_rate: float = LURE_N_MINUS_1_RATE,
+                lure_n_plus_1_rate: float = LURE_N_PLUS_1_RATE,
+                max_consec_targets: int = MAX_CONSEC_TARGETS_DEFAULT,
+                max_identical_run: int = MAX_IDENTICAL_RUN,
+                rate_slack: float = RATE_SLACK,
+                fixed_iti_ms: int = 500,
+                soft_balance: bool = True,
+                include_lures: bool = True,
+                rng: Optional[random.Random] = None) -> Iterator[TrialPlan]:
+    """Yield trials one at a time, for very long or endless (`n_trials=None`) blocks.
+
+    Nothing is planned ahead beyond O(max_consec_targets) forward checks and
+    only the last N+2 letters are kept, so the first trial is available
+    immediately and memory stays constant however long the stream runs.
+
+    Targets are decided online. After every trial the running target count
+    stays within `rate_slack` of `target_rate` x (trials since trial N), so
+    any window of W consecutive trials holds target_rate x W +/- 2 x
+    rate_slack targets. A target is only placed where the stream can still
+    keep that bound and the `max_consec_targets` cap from then on
+    (`_rate_state_safe`), so no trial is ever retried. Between the forced
+    cases a trial is a target with probability `target_rate`. Rates above
+    m / (m + 1) cannot be sustained under a cap of m consecutive targets and
+    are capped there.
+
+    Letters and rate-mode lures follow the same rules as `_solve_block`:
+    targets copy the N-back letter, lures never coincide with it, plain
+    letters avoid the N-back and previous letter, and identical-letter runs
+    stay within `max_identical_run`. Fixed-length blocks that must match
+    `validate_sequence` exactly should use `generate_sequence` instead.
+    """
+    if rate_slack < 0.5:
+        raise ValueError(f"rate_slack must be >= 0.5, got {rate_slack!r}")
+    r = rng or random
+    m = max(0, int(max_consec_targets))
+    rate = min(max(0.0, float(target_rate)), m / (m + 1))
+    sampler = LetterSampler(list(LETTERS), soft_balance=soft_balance)
+    recent: deque = deque(maxlen=n_back + 2)  # recent[-k] is the letter k trials back
+    targets = 0
+    eligible = 0
+    run = 0
+    same_run = 0  # identical-letter run ending at the previous trial
+    i = 0
+    while n_trials is None or i < n_trials:
+        letter_n = recent[-n_back] if i >= n_back else None
+        prev = recent[-1] if recent else None
+        is_target = 0
+        if i >= n_back:
+            eligible += 1
+            drift = targets - rate * eligible
+            can_hit = (run < m and drift + 1.0 <= rate_slack + 1e-9
+                       and _rate_state_safe(drift + 1.0, run + 1, rate, rate_slack, m))
+            can_miss = drift >= -rate_slack - 1e-9 and _rate_state_safe(drift, 0, rate, rate_slack, m)
+            is_target = int(can_hit and (not can_miss or r.random() < rate))
+        lure_type = "none"
+        if is_target:
+            letter = letter_n
+            targets += 1
+            run += 1
+        else:
+            run = 0
+            letter = None
+            if include_lures:
+                for kind, lag, p in (("n-1", n_back - 1, lure_n_minus_1_rate), ("n+1", n_back + 1, lure_n_plus_1_rate)):
+                    if lag > 0 and i >= lag and r.random() < p:
+                        cand = recent[-lag]
+                        run_ok = max_identical_run <= 0 or (same_run + 1 if cand == prev else 1) <= max_identical_run
+                        if cand != letter_n and run_ok:
+                            letter, lure_type = cand, kind
+                            break
+            if letter is None:
+                letter = sampler.sample((letter_n, prev), rng=r)
+        same_run = same_run + 1 if letter == prev else 1
+        recent.append(letter)
+        sampler.add(letter)
+        GENERATION_COUNTERS["trials_built"] += 1
+        i += 1
+        yield TrialPlan(stimulus=letter, is_target=is_target, lure_type=lure_type, iti_ms=int(fixed_iti_ms))
+
+
+def _sample_position_target_indices(n_back: int, n_trials: int, letter_targets: List[int], desired: int,
+                                    max_consec_targets: int, max_dual_targets: int, *,
+                                    rng: Optional[random.Random] = None) -> Optional[List[int]]:
+    """Sample the position-stream target layout given the letter-stream layout.
+
+    Exactly uniform over the layouts that satisfy the usual rules (no target
+    in the first N trials, at most `max_consec_targets` in a row) and share at
+    most `max_dual_targets` trials with `letter_targets`. The completion
+    counts are a DP over (slot, targets left, run length, dual budget left),
+    rebuilt per letter layout; beyond DUAL_DP_TABLE_LIMIT cells, unconstrained
+    layouts are drawn until one respects the cap. Returns None when no layout
+    exists for this letter layout.
+    """
+    if desired <= 0:
+        return []
+    slots = n_trials - n_back
+    m = max_consec_targets
+    if slots <= 0 or m <= 0 or desired > _target_capacity(slots, 0, m):
+        return None
+    letter_set = set(letter_targets)
+    cap = max(0, min(max_dual_targets, desired))
+    if _position_sampler(n_back, n_trials, desired, m, max_dual_targets) != "dp":
+        for _ in range(MAX_ATTEMPTS):
+            cand = _sample_target_indices(n_back, n_trials, desired, m, rng=rng) or []
+            if sum(1 for i in cand if i in letter_set) <= cap:
+                return cand
+        return None
+    r = rng or random
+    dual = [1 if n_back + k in letter_set else 0 for k in range(slots)]
+    # table[k][rem][run][budget]: ways to place `rem` targets in slots k.. after a run of `run`
+    done = [[[1 if rem == 0 else 0] * (cap + 1) for _run in range(m + 1)] for rem in range(desired + 1)]
+    table = [done]
+    for k in range(slots - 1, -1, -1):
+        nxt = table[-1]
+        d = dual[k]
+        layer = []
+        for rem in range(desired + 1):
+            rows = []
+            for run in range(m + 1):
+                skip = nxt[rem][0]
+                if rem > 0 and run < m:
+                    take = nxt[rem - 1][run + 1]
+                    if d:
+                        rows.append([skip[b] + (take[b - 1] if b > 0 else 0) for b in range(cap + 1)])
+                    else:
+                        rows.append([skip[b] + take[b] for b in range(cap + 1)])
                 else:
-                    # Should not happen as indices start at n_back
-                    letter = _choose_letter(LETTERS, freqs, soft_balance=soft_balance_initial)
-                is_target_flags.append(1)
-                lure_types.append("none")
-            else:
-                # Optionally place a lure on non-target trials
-                if include_lures:
-                    # n-1 lure
-                    if (n_back - 1) > 0 and i >= (n_back - 1) and random.random() < lure_n_minus_1_rate:
-                        letter_nm1 = seq[i - (n_back - 1)]
-                        letter_n = seq[i - n_back] if i >= n_back else None
-                        if letter_nm1 and (letter_n is None or letter_nm1 != letter_n) and _valid_run_limit(seq, letter_nm1, max_identical_run):
-                            planned_lure_type = "n-1"
-                            letter = letter_nm1
-                        else:
-                            planned_lure_type = "none"
-                    # n+1 lure
-                    if planned_lure_type == "none" and i >= (n_back + 1) and random.random() < lure_n_plus_1_rate:
-                        letter_np1 = seq[i - (n_back + 1)]
-                        letter_n = seq[i - n_back] if i >= n_back else None
-                        if letter_np1 and (letter_n is None or letter_np1 != letter_n) and _valid_run_limit(seq, letter_np1, max_identical_run):
-                            planned_lure_type = "n+1"
-                            letter = letter_np1
-                        else:
-                            planned_lure_type = "none"
-                # If still none, choose a regular non-target letter
-                if planned_lure_type == "none":
-                    candidates = [c for c in LETTERS]
-                    if i >= n_back:
-                        avoid = seq[i - n_back]
-                        candidates = [c for c in candidates if c != avoid]
-                    if seq:
-                        last = seq[-1]
-                        if last in candidates and not _valid_run_limit(seq, last, max_identical_run - 1):
-                            candidates = [c for c in candidates if c != last]
-                    letter = _choose_letter(candidates, freqs, soft_balance=soft_balance_initial)
-                is_target_flags.append(0)
-                lure_types.append(planned_lure_type)
-
-            # Final run-limit check adjustment
-            if not _valid_run_limit(seq, letter, max_identical_run):
-                # Pick a different non-conflicting letter
-                cands = [c for c in LETTERS if _valid_run_limit(seq, c, max_identical_run)]
-                if i >= n_back:
-                    cands = [c for c in cands if c != (seq[i - n_back] if i >= n_back else None)]
-                if seq:
-                    last = seq[-1]
-                    if last in cands and not _valid_run_limit(seq, last, max_identical_run - 1):
-                        cands = [c for c in cands if c != last]
-                letter = _choose_letter(cands, freqs, soft_balance=soft_balance_initial)
-
-            seq.append(letter)
-            freqs[letter] = freqs.get(letter, 0) + 1
-
-        ok, _reason = validate_sequence(
-            seq, is_target_flags, lure_types,
-            n_back=n_back,
-            target_rate=target_rate,
-            tolerance=1,
-            max_consec_targets=max_consec_targets,
-        )
-        if not ok:
+                    rows.append(list(skip))
+            layer.append(rows)
+        table.append(layer)
+    table.reverse()  # table[k] now describes slots k..end
+    rem, run, budget = desired, 0, cap
+    if table[0][rem][run][budget] == 0:
+        return None
+    chosen: List[int] = []
+    for k in range(slots):
+        if rem == 0:
+            break
+        total = table[k][rem][run][budget]
+        take_ways = 0
+        if run < m and (not dual[k] or budget > 0):
+            take_ways = table[k + 1][rem - 1][run + 1][budget - dual[k]]
+        if r.randrange(total) < take_ways:
+            chosen.append(n_back + k)
+            rem -= 1
+            run += 1
+            budget -= dual[k]
+        else:
+            run = 0
+    return chosen
+
+
+def check_dual_feasibility(n_back: int, n_trials: int, *,
+                           target_rate: float = TARGET_RATE,
+                           position_target_rate: Optional[float] = None,
+                           max_consec_targets: int = MAX_CONSEC_TARGETS_DEFAULT,
+                           max_dual_targets: Optional[int] = None) -> Feasibility:
+    """`check_feasibility` for both streams of a dual block plus the dual-target cap.
+
+    The cap check is the pigeonhole bound (letter + position targets - cap
+    must fit into the eligible trials); letter layouts that still leave no
+    room are resampled by `generate_dual_sequence`. `placements` is the
+    letter-stream count.
+    """
+    if position_target_rate is None:
+        position_target_rate = target_rate
+    if max_dual_targets is None:
+        max_dual_targets = round(MAX_DUAL_TARGET_RATE * n_trials)
+    letters = check_feasibility(n_back, n_trials, target_rate=target_rate, max_consec_targets=max_consec_targets)
+    if not letters.feasible:
+        return letters
+    positions = check_feasibility(n_back, n_trials, target_rate=position_target_rate,
+                                  max_consec_targets=max_consec_targets)
+    if not positions.feasible:
+        return Feasibility(False, positions.desired_targets, positions.max_targets, positions.placements,
+                           "Position stream: " + positions.message)
+    slots = max(0, n_trials - n_back)
+    # The ±1 tolerance lets each stream place one target fewer than requested
+    need = max(0, letters.desired_targets - 1) + max(0, positions.desired_targets - 1)
+    if need - max_dual_targets > slots:
+        return Feasibility(False, letters.desired_targets, letters.max_targets, letters.placements,
+                           f"{need} letter + position targets cannot share {slots} trials "
+                           f"with at most {max_dual_targets} dual targets")
+    return letters
+
+
+def generate_dual_sequence(n_back: int, n_trials: int, *,
+                           target_rate: float = TARGET_RATE,
+                           position_target_rate: Optional[float] = None,
+                           lure_n_minus_1_rate: float = LURE_N_MINUS_1_RATE,
+                           lure_n_plus_1_rate: float = LURE_N_PLUS_1_RATE,
+                           max_consec_targets: int = MAX_CONSEC_TARGETS_DEFAULT,
+                           max_dual_targets: Optional[int] = None,
+                           max_identical_run: int = MAX_IDENTICAL_RUN,
+                           fixed_iti_ms: int = 500,
+                           max_attempts: int = MAX_ATTEMPTS,
+                           soft_balance_initial: bool = True,
+                           include_lures: bool = True,
+                           lure_mode: str = "rate",
+                           rng: Optional[random.Random] = None,
+                           stats: Optional[GenerationStats] = None) -> DualBlockPlan:
+    """Generate one dual N-back block: a letter stream and a position stream.
+
+    Both streams follow the single-stream rules (validated separately with
+    the same tolerance), and at most `max_dual_targets` trials (default
+    round(MAX_DUAL_TARGET_RATE * n_trials)) are targets in both. The layouts
+    are solved jointly rather than by running `generate_sequence` twice: the
+    letter layout is sampled as usual, the position layout is then sampled
+    uniformly among those respecting the cap (`_sample_position_target_indices`),
+    and each stream's symbols and lures are assigned by the single-pass solver.
+    An attempt is only repeated when a letter layout leaves no valid position
+    layout, so the work stays linear in `n_trials` at any N.
+
+    `position_target_rate` defaults to `target_rate`; lure settings apply to
+    both streams. `stats` (a fresh GenerationStats) also receives the
+    position-stream and dual-target counts.
+
+    Returns: DualBlockPlan
+    """
+    if lure_mode not in ("rate", "quota"):
+        raise ValueError(f"lure_mode must be 'rate' or 'quota', got {lure_mode!r}")
+    t0 = time.perf_counter()
+    st = stats if stats is not None else GenerationStats()
+    if position_target_rate is None:
+        position_target_rate = target_rate
+    if max_dual_targets is None:
+        max_dual_targets = round(MAX_DUAL_TARGET_RATE * n_trials)
+    capacity = _max_targets(n_back, n_trials, max_consec_targets)
+    want_letter = round(target_rate * n_trials)
+    want_position = round(position_target_rate * n_trials)
+    st.requested_targets = want_letter
+    if want_letter > capacity or want_position > capacity:
+        GENERATION_COUNTERS["capped"] += 1
+        st.capped = True
+        want_letter = min(want_letter, capacity)
+        want_position = min(want_position, capacity)
+    st.target_sampler = _target_sampler(n_back, n_trials, want_letter, max_consec_targets)
+    st.position_sampler = _position_sampler(n_back, n_trials, want_position, max_consec_targets, max_dual_targets)
+    use_quota = include_lures and lure_mode == "quota"
+    solver_kwargs = dict(
+        lure_n_minus_1_rate=lure_n_minus_1_rate,
+        lure_n_plus_1_rate=lure_n_plus_1_rate,
+        max_identical_run=max_identical_run,
+        soft_balance=soft_balance_initial,
+        include_lures=include_lures,
+        rng=rng,
+    )
+
+    def _stream(target_indices: List[int], desired: int, rate: float, alphabet: Sequence,
+                validate: bool) -> Tuple[List, List[int], List[str], bool, str]:
+        planned = None
+        if use_quota:
+            planned = _plan_quota_lures(n_back, n_trials, target_indices,
+                                        lure_n_minus_1_rate=lure_n_minus_1_rate,
+                                        lure_n_plus_1_rate=lure_n_plus_1_rate,
+                                        max_identical_run=max_identical_run, rng=rng)
+        validator = None
+        if validate:
+            validator = StreamingValidator(n_back, n_trials, target_rate=rate,
+                                           max_consec_targets=max_consec_targets, desired_targets=desired)
+        seq, flags, lures = _solve_block(n_back, n_trials, target_indices, validator=validator,
+                                         planned_lures=planned, alphabet=alphabet, **solver_kwargs)
+        ok, reason = validator.finish() if validator is not None else (True, "ok")
+        return seq, flags, lures, ok, reason
+
+    GENERATION_COUNTERS["calls"] += 1
+    result = None
+    for _attempt in range(1, max(1, max_attempts) + 1):
+        GENERATION_COUNTERS["attempts"] += 1
+        st.attempts += 1
+        letter_targets = _sample_target_indices(n_back, n_trials, want_letter, max_consec_targets, rng=rng) or []
+        position_targets = None
+        # One position target short of the quota is still within the ±1 tolerance
+        for want in (want_position, want_position - 1):
+            if position_targets is None and want >= 0:
+                position_targets = _sample_position_target_indices(n_back, n_trials, letter_targets, want,
+                                                                   max_consec_targets, max_dual_targets, rng=rng)
+        if position_targets is None:
+            reason = "No position layout within the dual-target cap"
+            st.rejections[reason] = st.rejections.get(reason, 0) + 1
             continue
+        letters = _stream(letter_targets, want_letter, target_rate, LETTERS, True)
+        positions = _stream(position_targets, want_position, position_target_rate, POSITIONS, True)
+        failed = [f"{name}: {out[4]}" for name, out in (("letter", letters), ("position", positions)) if not out[3]]
+        if not failed:
+            result = (letters, positions)
+            break
+        for reason in failed:
+            st.rejections[reason] = st.rejections.get(reason, 0) + 1
+        if any(len(out[0]) < n_trials for out in (letters, positions)):
+            GENERATION_COUNTERS["aborts"] += 1
+            st.aborts += 1
+    if result is None:
+        # Keep a complete block regardless; the dual cap may be exceeded here
+        GENERATION_COUNTERS["fallbacks"] += 1
+        st.fallback = True
+        letter_targets = _sample_target_indices(n_back, n_trials, want_letter, max_consec_targets, rng=rng) or []
+        position_targets = _sample_target_indices(n_back, n_trials, want_position, max_consec_targets, rng=rng) or []
+        result = (_stream(letter_targets, want_letter, target_rate, LETTERS, False),
+                  _stream(position_targets, want_position, position_target_rate, POSITIONS, False))
 
-        plans: List[TrialPlan] = []
-        for i in range(n_trials):
-            iti_ms = int(fixed_iti_ms)
-            plans.append(TrialPlan(
-                stimulus=seq[i],
-                is_target=is_target_flags[i],
-                lure_type=lure_types[i],
-                iti_ms=iti_ms,
-            ))
-        return plans
-
-    # --- Emergency non-recursive fallback ---
-    # Build a feasible sequence greedily without lures and with relaxed balancing.
-    desired = desired_targets
-    # Randomized selection of target indices honoring no-adjacent constraint
-    target_flags = [0] * n_trials
-    candidates = list(range(n_back, n_trials))
-    attempts = 0
-    import math
-    while sum(target_flags) < desired and attempts < 50:
-        attempts += 1
-        random.shuffle(candidates)
-        for i in candidates:
-            if sum(target_flags) >= desired:
-                break
-            # Enforce max_consec_targets locally (check immediate neighbors)
-            if max_consec_targets <= 0:
-                continue
-            left_run = 1 if (i-1) >= 0 and target_flags[i-1] == 1 else 0
-            right_run = 1 if (i+1) < n_trials and target_flags[i+1] == 1 else 0
-            if (left_run + right_run) >= max_consec_targets:
-                continue
-            target_flags[i] = 1
-        # If stuck (no progress), relax candidate order and continue
-    # If still short by a small margin, accept being under by up to 1
-    if sum(target_flags) < max(0, desired - 1):
-        # Try a final pass scanning random order but strictly avoiding adjacency
-        needed = desired - sum(target_flags)
-        if needed > 0:
-            pool = [i for i in range(n_back, n_trials) if target_flags[i] == 0]
-            random.shuffle(pool)
-            for i in pool:
-                if needed <= 0:
-                    break
-                left_run = 1 if (i-1) >= 0 and target_flags[i-1] == 1 else 0
-                right_run = 1 if (i+1) < n_trials and target_flags[i+1] == 1 else 0
-                if (left_run + right_run) == 0:
-                    target_flags[i] = 1
-                    needed -= 1
+    (seq, flags, lures, _ok, _r), (pos, pos_flags, pos_lures, _ok2, _r2) = result
+    plans = DualBlockPlan.from_arrays(
+        [LETTER_CODES[c] for c in seq],
+        flags,
+        [LURE_CODES[t] for t in lures],
+        int(fixed_iti_ms),
+        position=pos,
+        position_is_target=pos_flags,
+        position_lure=[LURE_CODES[t] for t in pos_lures],
+    )
+    st.placed_targets = sum(flags)
+    st.lures_n_minus_1 = lures.count("n-1")
+    st.lures_n_plus_1 = lures.count("n+1")
+    if use_quota:
+        st.lure_shortfall = sum(_lure_shortfall(n_back, n_trials, f, l, lure_n_minus_1_rate, lure_n_plus_1_rate)
+                                for f, l in ((flags, lures), (pos_flags, pos_lures)))
+    st.position_targets = sum(pos_flags)
+    st.position_lures = len(pos_lures) - pos_lures.count("none")
+    st.dual_targets = plans.dual_targets()
+    st.elapsed_ms = (time.perf_counter() - t0) * 1000.0
+    return plans
+
+
+@dataclass
+class SequenceBatch:
+    """Many blocks of one parameter set, stored as (count, n_trials) uint8 arrays.
+
+    Fields:
+    - stimuli: letter codes (indices into LETTERS)
+    - is_target: 1 if the trial is an N-back target, else 0
+    - lure: lure codes (LURE_NONE / LURE_N_MINUS_1 / LURE_N_PLUS_1)
+    - n_back: N level shared by every block in the batch
+    """
+    stimuli: np.ndarray
+    is_target: np.ndarray
+    lure: np.ndarray
+    n_back: int
+
+    def __len__(self) -> int:
+        return int(self.stimuli.shape[0])
+
+    def plans(self, k: int, fixed_iti_ms: int = 500) -> BlockPlan:
+        """Return block `k` as the BlockPlan used by run_block."""
+        return BlockPlan.from_arrays(self.stimuli[k], self.is_target[k], self.lure[k], fixed_iti_ms)
+
+
+def _target_capacity_np(slots: int, run: np.ndarray, max_consec_targets: int) -> np.ndarray:
+    """Vectorized `_target_capacity` over an array of preceding run lengths."""
+    if slots <= 0 or max_consec_targets <= 0:
+        return np.zeros_like(run)
+    m = max_consec_targets
+    head = np.maximum(0, m - run)
+    rest = np.maximum(slots - head - 1, 0)
+    filled = head + (rest // (m + 1)) * m + np.minimum(rest % (m + 1), m)
+    return np.where(slots <= head, slots, filled)
+
+
+def generate_sequences_batch(n_back: int, n_trials: int, count: int, *,
+                             target_rate: float = TARGET_RATE,
+                             lure_n_minus_1_rate: float = LURE_N_MINUS_1_RATE,
+                             lure_n_plus_1_rate: float = LURE_N_PLUS_1_RATE,
+                             max_consec_targets: int = MAX_CONSEC_TARGETS_DEFAULT,
+                             max_identical_run: int = MAX_IDENTICAL_RUN,
+                             include_lures: bool = True,
+                             seed: Optional[int] = None,
+                             rng: Optional[np.random.Generator] = None) -> SequenceBatch:
+    """Generate `count` blocks at once as array-backed sequences.
+
+    Applies the same single-pass solver as `generate_sequence`, but each step
+    operates on a whole column (trial position) of the batch, so the Python
+    loop runs `n_trials` times regardless of `count`. Every block satisfies
+    `validate_sequence` whenever the target quota is feasible.
+
+    Differences from `generate_sequence`:
+    - plain non-target letters are drawn uniformly (no soft balancing)
+    - randomness comes from `rng` (e.g. `nback.rng.stream_generator`) or, if
+      not given, a NumPy Generator seeded with `seed`; the global `random`
+      module is never touched
+
+    Returns: SequenceBatch
+    """
+    rng = rng if rng is not None else np.random.default_rng(seed)
+    k = len(LETTERS)
+    desired = min(round(target_rate * n_trials), _max_targets(n_back, n_trials, max_consec_targets))
+
+    # int16 working buffer; -1 marks "no letter" for positions before the start
+    stim = np.full((count, n_trials), -1, dtype=np.int16)
+    is_target = np.zeros((count, n_trials), dtype=np.uint8)
+    lure = np.zeros((count, n_trials), dtype=np.uint8)
+
+    remaining = np.full(count, desired, dtype=np.int64)
+    run = np.zeros(count, dtype=np.int64)
+    same_run = np.zeros(count, dtype=np.int64)
+    none = np.full(count, -1, dtype=np.int16)
 
-    # Construct letters with basic constraints (no immediate repeats; avoid N-back match on non-targets)
-    seq: List[str] = []
-    lure_types: List[str] = []
     for i in range(n_trials):
-        if target_flags[i] == 1 and i >= n_back:
-            letter = seq[i - n_back]
-            lure_types.append("none")
+        prev = stim[:, i - 1] if i >= 1 else none
+        letter_n = stim[:, i - n_back] if i >= n_back else none
+
+        # Targets: feasibility-preserving draw, as in _sample_target_indices
+        if i >= n_back and desired > 0:
+            slots = n_trials - i
+            forced_no = (remaining == 0) | (run >= max_consec_targets)
+            forced_no |= (remaining - 1) > _target_capacity_np(slots - 1, run + 1, max_consec_targets)
+            forced_yes = remaining > _target_capacity(slots - 1, 0, max_consec_targets)
+            take = ~forced_no & (forced_yes | (rng.random(count) < remaining / slots))
         else:
-            candidates = [c for c in LETTERS]
-            if i >= n_back:
-                avoid_n = seq[i - n_back]
-                candidates = [c for c in candidates if c != avoid_n]
-            if i >= 1:
-                candidates = [c for c in candidates if c != seq[i - 1]]
-            letter = random.choice(candidates) if candidates else LETTERS[0]
-            lure_types.append("none")
-        seq.append(letter)
+            take = np.zeros(count, dtype=bool)
+        remaining -= take
+        run = np.where(take, run + 1, 0)
 
-    plans: List[TrialPlan] = []
-    for i in range(n_trials):
-        plans.append(TrialPlan(
-            stimulus=seq[i],
-            is_target=1 if target_flags[i] == 1 else 0,
-            lure_type=lure_types[i],
-            iti_ms=int(fixed_iti_ms),
-        ))
-    return plans
+        letter = np.where(take, letter_n, -1).astype(np.int16)
+        open_ = ~take
+
+        def _try_lure(lag: int, rate: float, code: int) -> None:
+            nonlocal letter, open_
+            cand = stim[:, i - lag]
+            ok = open_ & (rng.random(count) < rate) & (cand != letter_n)
+            # max_identical_run <= 0 means no cap, as in _solve_block
+            ok &= (max_identical_run <= 0) | (cand != prev) | (same_run + 1 <= max_identical_run)
+            letter = np.where(ok, cand, letter)
+            lure[ok, i] = code
+            open_ = open_ & ~ok
+
+        if include_lures:
+            if (n_back - 1) > 0 and i >= (n_back - 1):
+                _try_lure(n_back - 1, lure_n_minus_1_rate, LURE_N_MINUS_1)
+            if i >= (n_back + 1):
+                _try_lure(n_back + 1, lure_n_plus_1_rate, LURE_N_PLUS_1)
+
+        # Plain non-targets: uniform over LETTERS minus {N-back letter, previous letter}.
+        # Draw from the reduced range, then shift past the sorted exclusions.
+        if open_.any():
+            big = np.int16(k + 1)
+            ex_a = np.where(letter_n >= 0, letter_n, big)
+            ex_b = np.where((prev >= 0) & (prev != letter_n), prev, big)
+            lo, hi = np.minimum(ex_a, ex_b), np.maximum(ex_a, ex_b)
+            n_excl = (lo < k).astype(np.int16) + (hi < k).astype(np.int16)
+            draw = (rng.random(count) * (k - n_excl)).astype(np.int16)
+            draw += draw >= lo
+            draw += draw >= hi
+            letter = np.where(open_, draw, letter)
+
+        stim[:, i] = letter
+        is_target[:, i] = take
+        same_run = np.where(letter == prev, same_run + 1, 1)
+
+    return SequenceBatch(
+        stimuli=stim.astype(np.uint8),
+        is_target=is_target,
+        lure=lure,
+        n_back=n_back,
+    )
+
+
+# Reason codes returned by validate_sequences_batch, in validate_sequence's check order
+VALID_OK = 0
+VALID_TARGET_IN_FIRST_N = 1
+VALID_TARGET_COUNT = 2
+VALID_IMMEDIATE_REPEAT = 3
+VALID_NM1_TOO_EARLY = 4
+VALID_LURE_IS_TARGET = 5
+VALID_NM1_MISMATCH = 6
+VALID_NM1_EQUALS_TARGET = 7
+VALID_NP1_TOO_EARLY = 8
+VALID_NP1_MISMATCH = 9
+VALID_NP1_EQUALS_TARGET = 10
+VALID_CONSEC_TARGETS = 11
+VALIDATION_REASONS = (
+    "ok",
+    "Target in first N trials",
+    "Target count outside ±1 of the desired count",
+    "Immediate repeat without target/lure",
+    "n-1 lure too early",
+    "lure double-counted as target",
+    "n-1 lure mismatch",
+    "n-1 lure equals target",
+    "n+1 lure too early",
+    "n+1 lure mismatch",
+    "n+1 lure equals target",
+    "too many consecutive targets",
+)
+
+
+def _lagged(arr: np.ndarray, lag: int, fill: int = -1) -> np.ndarray:
+    """Return arr shifted right by `lag` trials along axis 1, padded with `fill`."""
+    if lag <= 0:
+        return arr
+    out = np.full(arr.shape, fill, dtype=arr.dtype)
+    out[:, lag:] = arr[:, :-lag]
+    return out
+
+
+def validate_sequences_batch(stimuli: np.ndarray, is_target: np.ndarray, lure: np.ndarray, *,
+                             n_back: int, target_rate: float,
+                             max_consec_targets: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Validate many sequences at once (array form of `validate_sequence`).
+
+    Inputs are (count, n_trials) arrays: letter codes, 0/1 target flags and
+    lure codes (LURE_NONE / LURE_N_MINUS_1 / LURE_N_PLUS_1), e.g. the fields
+    of a SequenceBatch or a bank memory map.
+
+    Returns (ok, reason): a boolean mask and a uint8 reason code per sequence.
+    The code is the first failure `validate_sequence` would report (see
+    VALIDATION_REASONS), so the two validators agree row by row.
+    """
+    stim = np.asarray(stimuli).astype(np.int16)
+    tgt = np.asarray(is_target).astype(bool)
+    lur = np.asarray(lure).astype(np.int16)
+    count, n_trials = stim.shape
+    reason = np.zeros(count, dtype=np.uint8)
+
+    def _mark(fail: np.ndarray, code: int) -> None:
+        reason[(reason == VALID_OK) & fail] = code
+
+    _mark(tgt[:, :min(n_back, n_trials)].any(axis=1), VALID_TARGET_IN_FIRST_N)
+
+    desired = round(target_rate * n_trials)
+    total = tgt.sum(axis=1)
+    _mark((total < desired - 1) | (total > desired + 1), VALID_TARGET_COUNT)
+
+    if n_back > 1 and n_trials > 1:
+        rep = (stim[:, 1:] == stim[:, :-1]) & ~tgt[:, 1:] & (lur[:, 1:] == LURE_NONE)
+        _mark(rep.any(axis=1), VALID_IMMEDIATE_REPEAT)
+
+    # Per-trial lure errors; the earliest erroneous trial decides the code
+    idx = np.arange(n_trials)
+    letter_n = _lagged(stim, n_back)
+    equals_target = (idx >= n_back) & (stim == letter_n)
+    is_nm1 = lur == LURE_N_MINUS_1
+    is_np1 = lur == LURE_N_PLUS_1
+    trial_code = np.select(
+        [
+            is_nm1 & ~((idx >= n_back - 1) & (n_back - 1 > 0)),
+            is_nm1 & tgt,
+            is_nm1 & (stim != _lagged(stim, n_back - 1)),
+            is_nm1 & equals_target,
+            is_np1 & ~(idx >= n_back + 1),
+            is_np1 & tgt,
+            is_np1 & (stim != _lagged(stim, n_back + 1)),
+            is_np1 & equals_target,
+        ],
+        [
+            VALID_NM1_TOO_EARLY, VALID_LURE_IS_TARGET, VALID_NM1_MISMATCH, VALID_NM1_EQUALS_TARGET,
+            VALID_NP1_TOO_EARLY, VALID_LURE_IS_TARGET, VALID_NP1_MISMATCH, VALID_NP1_EQUALS_TARGET,
+        ],
+        default=VALID_OK,
+    )
+    if n_trials:
+        first = np.argmax(trial_code != VALID_OK, axis=1)
+        lure_fail = trial_code[np.arange(count), first]
+        open_rows = reason == VALID_OK
+        reason[open_rows] = lure_fail[open_rows]
+
+    # Longest target run: cumulative count minus the count at the last non-target
+    c = np.cumsum(tgt, axis=1)
+    longest = (c - np.maximum.accumulate(np.where(tgt, 0, c), axis=1)).max(axis=1, initial=0)
+    _mark(longest > max_consec_targets, VALID_CONSEC_TARGETS)
+
+    return reason == VALID_OK, reason
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+"""Up-front generation of every block a session will run.
+
+`SessionPlanner` submits one job per block to a `ProcessPoolExecutor` as soon
+as the CLI is parsed, so generation overlaps the consent and instruction
+screens. The block loop then only collects finished plans (`get`), which is
+instant unless a worker is still busy.
+
+Jobs are described by picklable `BlockSpec`s and seeded through `nback.rng`
+streams, so the result does not depend on which worker ran a job or in which
+order jobs finished. This module must stay free of PsychoPy imports: worker
+processes import it on their own.
+"""
+
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Hashable, Optional, Tuple
+
+from nback.rng import stream_random
+from nback.sequences import BlockPlan, GenerationStats, generate_dual_sequence, generate_sequence
+
+# Number of practice blocks generated ahead of time; later attempts are built on demand
+PRACTICE_POOL_SIZE = 3
+
+
+@dataclass(frozen=True)
+class BlockSpec:
+    """Everything needed to generate one block reproducibly in another process."""
+    n_back: int
+    n_trials: int
+    target_rate: float
+    lure_n_minus_1_rate: float
+    lure_n_plus_1_rate: float
+    max_consec_targets: int
+    fixed_iti_ms: int
+    include_lures: bool
+    seed: int
+    participant: str
+    stream: int
+    index: int
+    lure_mode: str = "rate"
+    dual: bool = False
+    max_dual_targets: Optional[int] = None
+    redraw: int = 0  # > 0: replacement block after a registry collision
+
+
+def build_block(spec: BlockSpec, stats: Optional[GenerationStats] = None) -> BlockPlan:
+    """Generate the block described by `spec` (runs in a worker process)."""
+    if spec.dual:
+        return generate_dual_sequence(
+            spec.n_back,
+            spec.n_trials,
+            target_rate=spec.target_rate,
+            lure_n_minus_1_rate=spec.lure_n_minus_1_rate,
+            lure_n_plus_1_rate=spec.lure_n_plus_1_rate,
+            max_consec_targets=spec.max_consec_targets,
+            max_dual_targets=spec.max_dual_targets,
+            fixed_iti_ms=spec.fixed_iti_ms,
+            include_lures=spec.include_lures,
+            lure_mode=spec.lure_mode,
+            rng=stream_random(spec.seed, spec.participant, spec.stream, spec.index, spec.redraw),
+            stats=stats,
+        )
+    return generate_sequence(
+        spec.n_back,
+        spec.n_trials,
+        target_rate=spec.target_rate,
+        lure_n_minus_1_rate=spec.lure_n_minus_1_rate,
+        lure_n_plus_1_rate=spec.lure_n_plus_1_rate,
+        max_consec_targets=spec.max_consec_targets,
+        fixed_iti_ms=spec.fixed_iti_ms,
+        include_lures=spec.include_lures,
+        lure_mode=spec.lure_mode,
+        rng=stream_random(spec.seed, spec.participant, spec.stream, spec.index, spec.redraw),
+        stats=stats,
+    )
+
+
+def build_block_with_stats(spec: BlockSpec) -> Tuple[BlockPlan, GenerationStats]:
+    """`build_block` plus the GenerationStats of the call."""
+    stats = GenerationStats()
+    return build_block(spec, stats), stats
+
+
+def default_workers(n_jobs: int) -> int:
+    """Leave one core for the render loop; never more workers than jobs."""
+    return max(1, min(n_jobs, (os.cpu_count() or 2) - 1))
+
+
+class SessionPlanner:
+    """Collects block plans keyed by caller-chosen keys (e.g. ("block", 3)).
+
+    With `max_workers=0` (or if a process pool cannot be started) every
+    submitted spec is generated immediately in this process instead.
+    `stats` maps each key returned by `get` to its `GenerationStats`
+    (None for plans registered with `put`).
+    """
+
+    def __init__(self, max_workers: Optional[int] = None) -> None:
+        self.max_workers = max_workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._futures: Dict[Hashable, Future] = {}
+        self._specs: Dict[Hashable, BlockSpec] = {}
+        self._ready: Dict[Hashable, Tuple[BlockPlan, Optional[GenerationStats]]] = {}
+        self.stats: Dict[Hashable, Optional[GenerationStats]] = {}
+
+    def put(self, key: Hashable, plans: BlockPlan) -> None:
+        """Register an already available plan (e.g. from a sequence bank)."""
+        self._ready[key] = (plans, None)
+
+    def submit_all(self, jobs: Dict[Hashable, BlockSpec]) -> None:
+        """Start generating every spec; returns without waiting."""
+        if not jobs:
+            return
+        self._specs.update(jobs)
+        workers = default_workers(len(jobs)) if self.max_workers is None else int(self.max_workers)
+        if workers > 0 and self._executor is None:
+            try:
+                self._executor = ProcessPoolExecutor(max_workers=workers)
+            except Exception as e:
+                print(f"Process pool unavailable ({e}); generating blocks in-process.")
+                self._executor = None
+        for key, spec in jobs.items():
+            if self._executor is not None:
+                try:
+                    self._futures[key] = self._executor.submit(build_block_with_stats, spec)
+                    continue
+                except Exception:
+                    pass
+            self._ready[key] = build_block_with_stats(spec)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._ready or key in self._futures
+
+    def get(self, key: Hashable, fallback: Optional[BlockSpec] = None) -> BlockPlan:
+        """Return the plan for `key`, waiting for its worker if needed.
+
+        A failed worker job is regenerated in-process from its spec (same
+        stream, same result). Unknown keys are built from `fallback`.
+        """
+        if key in self._ready:
+            plans, stats = self._ready.pop(key)
+        elif key in self._futures:
+            fut = self._futures.pop(key)
+            try:
+                plans, stats = fut.result()
+            except Exception as e:
+                print(f"Block generation worker failed ({e}); regenerating in-process.")
+                plans, stats = build_block_with_stats(self._specs[key])
+        elif fallback is not None:
+            plans, stats = build_block_with_stats(fallback)
+        else:
+            raise KeyError(f"No plan submitted for {key!r}")
+        self.stats[key] = stats
+        return plans
+
+    def shutdown(self) -> None:
+        """Stop the pool without waiting for unused jobs."""
+        if self._executor is not None:
+            try:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            except Exception:
+                pass
+            self._executor = None
+
+
+__all__ = [
+    "PRACTICE_POOL_SIZE",
+    "BlockSpec",
+    "build_block",
+    "build_block_with_stats",
+    "default_workers",
+    "SessionPlanner",
+]
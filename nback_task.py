@@ -21,7 +21,9 @@ import random
 import argparse
 import json
 import re
-from typing import List, Dict, Optional, Tuple
+import math
+from dataclasses import asdict, replace
+from typing import Callable, List, Dict, Optional, Tuple, Union
 from datetime import datetime
 
 
@@ -35,9 +37,26 @@ from nback.markers import (
     set_enable,
     create_parallel_port,
     send_named,
+    start_worker,
+    stop_worker,
     TRIGGERS,
 )
-from nback.sequences import (TrialPlan, generate_sequence)
+from nback.sequences import (LURE_NAMES, BlockPlan, DualBlockPlan, GenerationStats, TrialPlan,
+                             check_dual_feasibility, check_feasibility)
+from nback.session_plan import (PRACTICE_POOL_SIZE, BlockSpec, SessionPlanner, build_block,
+                                build_block_with_stats)
+from nback.sequence_bank import (SequenceBank, bank_key, load_bank)
+from nback.block_registry import (MAX_REDRAWS, REGISTRY_FILE, BlockRegistry, open_registry)
+from nback.flip_timing import FlipRecorder, flips_per_trial, frames_advanced
+from nback.display_profile import (PROFILE_FILE, RefreshProbe, cached_refresh_hz, display_signature,
+                                   save_refresh)
+from nback.rng import (
+    STREAM_BLOCK,
+    STREAM_PRACTICE,
+    STREAM_SESSION,
+    resolve_session_seed,
+    stream_random,
+)
 from nback.def_parameters import (
     BLOCKS_PER_LOAD_DEFAULT,
     TRIALS_PER_BLOCK,
@@ -59,8 +78,11 @@ from nback.def_parameters import (
     FONT,
     FONT_HEIGHT,
     FIXATION_HEIGHT,
+    DUAL_GRID_SPACING,
     KEY_PROCEED,
     KEY_RESPONSE,
+    KEY_RESPONSE_LETTER,
+    KEY_RESPONSE_POSITION,
     KEY_QUIT,
 )
 from nback.utilities import (
@@ -143,15 +165,32 @@ CONSENT_FILE = os.path.join(TEXTS_DIR, "informed_consent.txt")
 CFG_TARGET_RATE = TARGET_RATE
 CFG_LURE_NM1 = LURE_N_MINUS_1_RATE
 CFG_LURE_NP1 = LURE_N_PLUS_1_RATE
+CFG_LURE_MODE = "rate"  # "rate" (per-trial draws) or "quota" (exact lure counts per block)
+CFG_DUAL = False  # dual mode: letter stream + spatial-position stream (--dual)
+CFG_MAX_DUAL_TARGETS: Optional[int] = None  # None = round(MAX_DUAL_TARGET_RATE * trials)
 CFG_MAX_CONSEC_TARGETS = MAX_CONSEC_TARGETS_DEFAULT
 CFG_SOA_MS = SOA_MS_DEFAULT
 # ITI for logging/sequence plan is the remainder of SOA after stimulus visibility
 CFG_FIXED_ITI_MS = max(0, SOA_MS_DEFAULT - STIM_DUR_MS)
 CFG_USE_HW_KB = True  # toggled by --kb-backend
+# Frame-locked presentation (--frame-locked): durations as whole frames of the refresh rate
+CFG_FRAME_LOCKED = False
+CFG_FRAME_RATE_HZ: Optional[float] = None  # measured or --refresh-hz; None if unknown
+CFG_STIM_FRAMES = 0
+CFG_SOA_FRAMES = 0
+# Optional pregenerated block bank (set from --sequence-bank in main())
+SEQUENCE_BANK: Optional[SequenceBank] = None
+# Up-front block generation (started in main() before the window opens)
+SESSION_PLANNER: Optional[SessionPlanner] = None
+# Cross-participant index of issued blocks (set from --block-registry in main())
+BLOCK_REGISTRY: Optional[BlockRegistry] = None
+# Timestamps of every flip in the block being run (reused across blocks)
+FLIP_RECORDER = FlipRecorder()
 
 # Pre-created stimuli (initialized after window creation)
-STIM_LETTER: Optional[visual.TextStim] = None
 STIM_FIXATION: Optional[visual.TextStim] = None
+# One ready-to-draw TextStim per letter (see _build_glyph_cache)
+GLYPH_CACHE: Dict[str, visual.TextStim] = {}
 
 
 # =========================
@@ -214,18 +253,23 @@ def _setup_eyelink(win: visual.Window, participant: str, session_ts: str):
 """TrialPlan dataclass and sequence generation helpers are in nback.sequences."""
 
 
-# Sequence creation is delegated to nback.sequences.generate_sequence
+# Blocks are built from BlockSpecs by nback.session_plan.SessionPlanner (build_block)
 
 
 # =========================
 # Rendering / Task flow
 # =========================
 
-def show_consent(win: visual.Window, text_stim: Optional[visual.TextStim] = None, consent_file: Optional[str] = None) -> None:
+def show_consent(win: visual.Window, text_stim: Optional[visual.TextStim] = None, consent_file: Optional[str] = None,
+                 probe: Optional[RefreshProbe] = None) -> None:
     """Show informed consent first.
     Loads text from informed_consent.txt and appends "(Press ENTER to continue)".
     ENTER proceeds; ESC quits (no save).
     The consent marker call is present but commented by default.
+    With a `probe`, the text is redrawn every frame (feeding each flip to the
+    refresh-rate measurement) until the probe is done or the key is pressed.
+    If ENTER comes first, the remaining probe flips show a short "please wait"
+    message, so the screen is never blank during the measurement.
     """
     # Load consent text from file (UTF-8). Fallback to minimal notice if missing.
     path = consent_file or CONSENT_FILE
@@ -259,12 +303,23 @@ def show_consent(win: visual.Window, text_stim: Optional[visual.TextStim] = None
     except Exception:
         pass
     event.clearEvents()
+    keys: List[str] = []
+    if probe is not None:
+        while not probe.done and not keys:
+            stim.draw()
+            probe.add(win.flip())
+            keys = event.getKeys(keyList=[KEY_PROCEED, KEY_QUIT])
     while True:
-        keys = event.waitKeys(keyList=[KEY_PROCEED, KEY_QUIT])
+        if not keys:
+            keys = event.waitKeys(keyList=[KEY_PROCEED, KEY_QUIT])
         if KEY_QUIT in keys:
             graceful_quit(None, None, [], win, abort=True)
         if KEY_PROCEED in keys:
             break
+        keys = []
+    if probe is not None and not probe.done:
+        wait_stim = _make_autosized_text(win, "Preparing the task, please wait...")
+        probe.finish(win, draw=wait_stim.draw)
 
 
 INSTR_WELCOME_FILE = os.path.join(TEXTS_DIR, "instructions_welcome.txt")
@@ -297,7 +352,7 @@ def show_instructions_multi(win: visual.Window, load_order: List[int]) -> None:
     """
     base = _load_text(INSTR_WELCOME_FILE, "Welcome to the N-back task.\nPress ENTER/RETURN to begin practice.")
     seq_txt = f"This session includes two difficulty levels: {load_order[0]}-back followed by {load_order[1]}-back.\nPractice will always be 2-back."
-    txt = base.replace("{{N}}", "N").strip() + f"\n\n{seq_txt}\n\n(Press ENTER/RETURN to continue)"
+    txt = base.replace("{{N}}", "N").strip() + f"\n\n{seq_txt}" + _dual_key_hint() + "\n\n(Press ENTER/RETURN to continue)"
     stim = _make_autosized_text(win, txt, align='center')
     stim.draw(); win.flip()
     # Mark instructions shown when displayed
@@ -334,9 +389,18 @@ def _make_autosized_text(
     return util_make_autosized_text(win, text, start_height, min_height, max_height_frac, shrink_factor, align, color=TEXT_COLOR, font=FONT)
 
 
+def _dual_key_hint() -> str:
+    """Extra instruction line for dual mode (empty in single-stream mode)."""
+    if not CFG_DUAL:
+        return ""
+    return (f"\n\nDual task: the letter appears in one of 8 places around the centre.\n"
+            f"Press '{KEY_RESPONSE_LETTER.upper()}' when the LETTER matches, "
+            f"'{KEY_RESPONSE_POSITION.upper()}' when the POSITION matches (both if both match).")
+
+
 def show_practice_headsup(win: visual.Window) -> None:
     """Show a brief screen before starting practice; waits for ENTER or ESC."""
-    msg = _load_text(INSTR_PRACTICE_FILE, "Practice is about to begin. Try to reach the accuracy criterion to proceed.") + "\n\n(Press ENTER/RETURN to start)"
+    msg = _load_text(INSTR_PRACTICE_FILE, "Practice is about to begin. Try to reach the accuracy criterion to proceed.") + _dual_key_hint() + "\n\n(Press ENTER/RETURN to start)"
     stim = _make_autosized_text(win, msg, align='center')
     stim.draw(); win.flip()
     event.clearEvents()
@@ -391,24 +455,158 @@ def show_save_and_exit_prompt(win: visual.Window) -> None:
             break
 
 
-def run_practice(win: visual.Window, n_back: int, practice_trials: int) -> Tuple[float, Optional[float]]:
-    """Run a practice block and provide pass/fail feedback.
-
-    Returns:
-    - acc: fraction correct over practice trials
-    - mean_rt: mean RT (ms) on correct trials, or None if no correct responses
-    Timing: identical to the main task (fixed SOA, stimulus then fixation).
-    """
-    plans = generate_sequence(
+def _practice_bank_key(n_back: int, practice_trials: int) -> str:
+    return bank_key(
         n_back,
         practice_trials,
         target_rate=PRACTICE_TARGET_RATE,
         lure_n_minus_1_rate=CFG_LURE_NM1 if PRACTICE_HAS_LURES else 0.0,
         lure_n_plus_1_rate=CFG_LURE_NP1 if PRACTICE_HAS_LURES else 0.0,
         max_consec_targets=CFG_MAX_CONSEC_TARGETS,
+        include_lures=PRACTICE_HAS_LURES,
+    )
+
+
+def _main_bank_key(n_back: int, trials_per_block: int) -> str:
+    return bank_key(n_back, trials_per_block, target_rate=CFG_TARGET_RATE,
+                    lure_n_minus_1_rate=CFG_LURE_NM1, lure_n_plus_1_rate=CFG_LURE_NP1,
+                    max_consec_targets=CFG_MAX_CONSEC_TARGETS, include_lures=True,
+                    lure_mode=CFG_LURE_MODE)
+
+
+def _bank_block(key: str, stream: int, index: int, redraw: int = 0) -> BlockPlan:
+    """Draw one block for `key` from the sequence bank using the (stream, index, redraw) RNG stream."""
+    rng = stream_random(SESSION_SEED, CURRENT_PARTICIPANT, stream, index, redraw)
+    return SEQUENCE_BANK.block(key, SEQUENCE_BANK.draw(key, 1, rng=rng)[0], CFG_FIXED_ITI_MS)
+
+
+def _practice_block_spec(n_back: int, practice_trials: int, attempt: int) -> BlockSpec:
+    """Spec for practice attempt `attempt` (1-based); seeded by its own stream."""
+    return BlockSpec(
+        n_back=n_back,
+        n_trials=practice_trials,
+        target_rate=PRACTICE_TARGET_RATE,
+        lure_n_minus_1_rate=CFG_LURE_NM1 if PRACTICE_HAS_LURES else 0.0,
+        lure_n_plus_1_rate=CFG_LURE_NP1 if PRACTICE_HAS_LURES else 0.0,
+        max_consec_targets=CFG_MAX_CONSEC_TARGETS,
         fixed_iti_ms=CFG_FIXED_ITI_MS,
         include_lures=PRACTICE_HAS_LURES,
+        seed=SESSION_SEED,
+        participant=CURRENT_PARTICIPANT,
+        stream=STREAM_PRACTICE,
+        index=attempt,
+        dual=CFG_DUAL,
+        max_dual_targets=CFG_MAX_DUAL_TARGETS,
+    )
+
+
+def _main_block_spec(n_back: int, trials_per_block: int, block_idx: int) -> BlockSpec:
+    """Spec for main block `block_idx` (1-based across the session)."""
+    return BlockSpec(
+        n_back=n_back,
+        n_trials=trials_per_block,
+        target_rate=CFG_TARGET_RATE,
+        lure_n_minus_1_rate=CFG_LURE_NM1,
+        lure_n_plus_1_rate=CFG_LURE_NP1,
+        max_consec_targets=CFG_MAX_CONSEC_TARGETS,
+        fixed_iti_ms=CFG_FIXED_ITI_MS,
+        include_lures=True,
+        seed=SESSION_SEED,
+        participant=CURRENT_PARTICIPANT,
+        stream=STREAM_BLOCK,
+        index=block_idx,
+        lure_mode=CFG_LURE_MODE,
+        dual=CFG_DUAL,
+        max_dual_targets=CFG_MAX_DUAL_TARGETS,
     )
+
+
+def _claim_block(label: str, n_back: int, plans: BlockPlan, stats: Optional[GenerationStats],
+                 redraw: Callable[[int], Tuple[BlockPlan, Optional[GenerationStats]]],
+                 ) -> Tuple[BlockPlan, Optional[GenerationStats], Optional[int]]:
+    """Claim a block in the block registry before it is run.
+
+    If the block was already issued (to anyone), `redraw(k)` supplies the k-th
+    replacement until one can be claimed or MAX_REDRAWS is reached. Returns the
+    block to run, its generation stats and the number of redraws (None when
+    no registry is in use).
+    """
+    if BLOCK_REGISTRY is None:
+        return plans, stats, None
+    redraws = 0
+    try:
+        while not BLOCK_REGISTRY.claim(plans, participant=CURRENT_PARTICIPANT, session=SESSION_TS,
+                                       label=label, n_back=n_back):
+            if redraws >= MAX_REDRAWS:
+                print(f"Warning: no unissued block found for {label} after {MAX_REDRAWS} redraws; "
+                      f"running a previously issued block.")
+                break
+            redraws += 1
+            plans, stats = redraw(redraws)
+    except Exception as e:
+        print(f"Warning: block registry check failed for {label} ({e}); running the block unchecked.")
+    return plans, stats, redraws
+
+
+def _big_int_str(value: Optional[int]) -> Optional[str]:
+    """Decimal string of a possibly huge int (None if absent or too long to convert)."""
+    if value is None:
+        return None
+    try:
+        return str(value)
+    except ValueError:
+        return None
+
+
+def _record_generation_stats(meta: Dict, label: str, stats: Optional[GenerationStats],
+                             redraws: Optional[int] = None) -> None:
+    """Add one block's generation stats to the metadata and rewrite the sidecar.
+
+    Bank blocks (no stats) are recorded as such, so every block run has an entry.
+    `redraws` (registry collisions replaced before the block ran) is added when
+    the block registry is in use.
+    """
+    entry = {"source": "bank"} if stats is None else {"source": "generated", **asdict(stats)}
+    if redraws is not None:
+        entry["redraws"] = redraws
+    meta.setdefault("generation_stats", {})[label] = entry
+    try:
+        with open(META_PATH, "w", encoding="utf-8") as mf:
+            json.dump(meta, mf, indent=2)
+    except Exception:
+        pass
+
+
+def _record_frame_intervals(meta: Dict, label: str) -> None:
+    """Add the flip-interval summary of the block just run and rewrite the sidecar."""
+    meta.setdefault("frame_intervals", {})[label] = FLIP_RECORDER.summary(CFG_FRAME_RATE_HZ)
+    try:
+        with open(META_PATH, "w", encoding="utf-8") as mf:
+            json.dump(meta, mf, indent=2)
+    except Exception:
+        pass
+
+
+def run_practice(win: visual.Window, n_back: int, practice_trials: int, attempt: int = 1,
+                 plans: Optional[BlockPlan] = None) -> Tuple[float, Optional[float]]:
+    """Run a practice block and provide pass/fail feedback.
+
+    `attempt` (1-based) selects the practice RNG stream, so a repeated
+    practice gets a new but reproducible block. Pass `plans` to run a block
+    that was generated ahead of time; otherwise it is taken from the sequence
+    bank or generated here.
+
+    Returns:
+    - acc: fraction correct over practice trials
+    - mean_rt: mean RT (ms) on correct trials, or None if no correct responses
+    Timing: identical to the main task (fixed SOA, stimulus then fixation).
+    """
+    if plans is None:
+        key = _practice_bank_key(n_back, practice_trials)
+        if SEQUENCE_BANK is not None and key in SEQUENCE_BANK:
+            plans = _bank_block(key, STREAM_PRACTICE, attempt)
+        else:
+            plans = build_block(_practice_block_spec(n_back, practice_trials, attempt))
     accs: List[int] = []
     rts: List[float] = []
     _ = run_block(win, block_idx=0, n_back=n_back, plans=plans, is_practice=True,
@@ -469,7 +667,7 @@ def show_phase_instructions(win: visual.Window, n_back: int) -> None:
         base = _load_text(path, f"You are about to start the {n_back}-back phase.")
     else:
         base = _load_text(INSTR_TASK_FILE, "Main task is about to begin.")
-    txt = base.replace("{{N}}", str(n_back)).strip()
+    txt = base.replace("{{N}}", str(n_back)).strip() + _dual_key_hint()
     if "Press ENTER" not in txt and "ENTER/RETURN" not in txt:
         txt += "\n\n(Press ENTER/RETURN to start)"
     stim = _make_autosized_text(win, txt, align='center')
@@ -484,10 +682,8 @@ def show_phase_instructions(win: visual.Window, n_back: int) -> None:
 
 
 def _ensure_stims(win: visual.Window) -> None:
-    """Create shared TextStim objects for stimulus and fixation if missing."""
-    global STIM_LETTER, STIM_FIXATION
-    if STIM_LETTER is None:
-        STIM_LETTER = visual.TextStim(win, text="", color=TEXT_COLOR, font=FONT, height=FONT_HEIGHT)
+    """Create the shared fixation TextStim if missing."""
+    global STIM_FIXATION
     if STIM_FIXATION is None:
         STIM_FIXATION = visual.TextStim(win, text="+", color=TEXT_COLOR, font=FONT, height=FIXATION_HEIGHT)
 
@@ -499,12 +695,46 @@ def _draw_fixation(win: visual.Window) -> None:
     STIM_FIXATION.draw()
 
 
-def _draw_stimulus(win: visual.Window, letter: str) -> None:
-    """Draw the letter stimulus using a prebuilt TextStim (does not flip)."""
-    _ensure_stims(win)
-    assert STIM_LETTER is not None
-    STIM_LETTER.text = letter
-    STIM_LETTER.draw()
+def _grid_pos(position: int) -> Tuple[float, float]:
+    """Centre of dual-mode grid cell `position` (3x3 grid without the centre, row by row)."""
+    cell = position if position < 4 else position + 1
+    row, col = divmod(cell, 3)
+    return ((col - 1) * DUAL_GRID_SPACING, (1 - row) * DUAL_GRID_SPACING)
+
+
+def _build_glyph_cache(win: visual.Window, letters: Optional[List[str]] = None) -> None:
+    """Create one TextStim per stimulus letter before the first trial.
+
+    Assigning TextStim.text re-lays out the glyphs and rebuilds the vertices,
+    so the trial loop never sets text: it picks the letter's stimulus from
+    GLYPH_CACHE and only draws it. Each glyph is drawn once into the back
+    buffer (then cleared) so its textures exist before the first trial.
+    """
+    for letter in letters or LETTERS:
+        if letter not in GLYPH_CACHE:
+            GLYPH_CACHE[letter] = visual.TextStim(win, text=letter, color=TEXT_COLOR, font=FONT, height=FONT_HEIGHT)
+    try:
+        for stim in GLYPH_CACHE.values():
+            stim.draw()
+        win.clearBuffer()
+    except Exception:
+        pass
+
+
+def _glyph(win: visual.Window, letter: str, position: Optional[int] = None) -> visual.TextStim:
+    """Cached stimulus for `letter`, placed at its grid cell in dual mode (centred otherwise)."""
+    stim = GLYPH_CACHE.get(letter)
+    if stim is None:
+        # Letter outside the cached alphabet: build it once and keep it
+        _build_glyph_cache(win, [letter])
+        stim = GLYPH_CACHE[letter]
+    stim.pos = (0.0, 0.0) if position is None else _grid_pos(position)
+    return stim
+
+
+def _frames_for(ms: float, refresh_hz: float) -> int:
+    """Whole number of frames closest to `ms` at `refresh_hz` (at least one)."""
+    return max(1, int(round(ms * refresh_hz / 1000.0)))
 
 
 def _marker_code_for_stim(is_target: int, lure_type: str) -> int:
@@ -518,7 +748,20 @@ def _marker_code_for_stim(is_target: int, lure_type: str) -> int:
     return 42
 
 
-def run_block(win: visual.Window, block_idx: int, n_back: int, plans: List[TrialPlan],
+def _flip_marker(name: str, sent_at: Dict[str, float], clock: Callable[[], float]) -> None:
+    """win.callOnFlip target: send a frame-locked marker and note when the write returned.
+
+    Nothing is noted if the marker was queued (earlier port writes pending, no
+    parallel port, or markers disabled); its send time is then in the marker log.
+    """
+    try:
+        if send_named(name, parallel_port=GLOBAL_PARALLEL_PORT, eyelink=GLOBAL_EYELINK, immediate=True):
+            sent_at[name] = clock()
+    except Exception:
+        pass
+
+
+def run_block(win: visual.Window, block_idx: int, n_back: int, plans: Union[BlockPlan, List[TrialPlan]],
               is_practice: bool, accs_out: List[int], rts_out: List[float],
               rows_out: Optional[List[Dict]]) -> Tuple[float, Optional[float]]:
     """Run a single block of trials using fixed-SOA pacing.
@@ -528,9 +771,46 @@ def run_block(win: visual.Window, block_idx: int, n_back: int, plans: List[Trial
     - Stimulus shown for STIM_DUR_MS, then fixation until SOA.
     - Responses collected from onset until SOA elapses (next trial onset).
 
+    With --frame-locked, stimulus offset and the next onset are scheduled in
+    frames (CFG_STIM_FRAMES / CFG_SOA_FRAMES) on a grid anchored at the block's
+    first onset flip, instead of polling the clock. Every flip advances the
+    grid one frame and a detected drop (interval above DROP_THRESHOLD periods)
+    by the frames it spans, so a dropped frame shortens the current trial
+    rather than pushing back every later onset. Each row records planned vs.
+    actual frames.
+
+    Stimulus and fixation markers are sent from win.callOnFlip, right after
+    the flip that shows them. Rows record the measured offset from the flip
+    timestamp to the marker write, and the delay of the response marker after
+    the key press.
+
+    Every flip timestamp is kept in FLIP_RECORDER; after the last trial each
+    row gets the measured stimulus duration, the refreshes it was shown for and
+    the frames dropped during the trial.
+
+    `plans` is normally a BlockPlan; a list[TrialPlan] is packed into one.
+    With a DualBlockPlan the letter is shown at its grid position and each
+    stream has its own response key (KEY_RESPONSE_LETTER /
+    KEY_RESPONSE_POSITION); both decisions count towards accuracy.
+
     Returns:
     - block accuracy and mean RT (ms) for correct trials in this block.
     """
+    if not isinstance(plans, BlockPlan):
+        plans = BlockPlan.from_trials(plans)
+    dual = isinstance(plans, DualBlockPlan)
+    # Unpack the columns once; the trial loop then only indexes plain lists
+    stim_letters = plans.letters()
+    target_flags = plans.is_target.tolist()
+    lure_types = [LURE_NAMES[c] for c in plans.lure.tolist()]
+    iti_values = plans.iti_ms.tolist()
+    if dual:
+        positions = plans.positions.tolist()
+        position_flags = plans.position_is_target.tolist()
+        position_lures = [LURE_NAMES[c] for c in plans.position_lure.tolist()]
+    letter_key = KEY_RESPONSE_LETTER if dual else KEY_RESPONSE
+    response_keys = [letter_key, KEY_RESPONSE_POSITION] if dual else [letter_key]
+
     # Start marker (by load)
     try:
         send_named('block_ll_start' if n_back == 1 else 'block_hl_start',
@@ -546,88 +826,176 @@ def run_block(win: visual.Window, block_idx: int, n_back: int, plans: List[Trial
         except Exception:
             kb = None
 
-    # Trial loop
-    correct_count = 0
+    # Clock of the flip timestamps, for marker offsets
+    clock = _flip_clock()
 
-    for t_idx, plan in enumerate(plans, start=1):
-        # Stimulus onset
-        _draw_stimulus(win, plan.stimulus)
+    # Trial loop
+    n_accs_before = len(accs_out)
+    n_rows_before = len(rows_out) if rows_out is not None else 0
+    recorder = FLIP_RECORDER
+    recorder.start_block(len(plans), CFG_SOA_FRAMES + 1 if CFG_FRAME_LOCKED
+                         else flips_per_trial(CFG_SOA_MS, CFG_FRAME_RATE_HZ))
+    # Frame-locked grid position: flips counted since the block's first onset,
+    # plus the frames skipped by detected drops
+    grid_frame = 0
+    grid_flip: Optional[float] = None
+
+    for t_idx in range(1, len(plans) + 1):
+        letter = stim_letters[t_idx - 1]
+        is_target = target_flags[t_idx - 1]
+        lure_type = lure_types[t_idx - 1]
+        position = positions[t_idx - 1] if dual else None
+        # Stimulus onset; the cached glyph is placed once and only drawn from here on
+        stim = _glyph(win, letter, position)
+        stim.draw()
         # Prepare response clock aligned with the stimulus flip
         resp_clock = core.Clock()
         win.callOnFlip(resp_clock.reset)
         if CFG_USE_HW_KB and _HAVE_HW_KB and kb is not None:
             kb.clock = resp_clock
             kb.clearEvents()
+        # Onset marker goes out from inside the flip, not after it returns
+        marker_times: Dict[str, float] = {}
+        win.callOnFlip(_flip_marker, 'stim_presentation', marker_times, clock)
         stim_onset = win.flip()
-        stim_marker = _marker_code_for_stim(plan.is_target, plan.lure_type)
-        try:
-            send_named('stim_presentation', parallel_port=GLOBAL_PARALLEL_PORT, eyelink=GLOBAL_EYELINK)
-        except Exception:
-            pass
+        recorder.onset(stim_onset)
+        if CFG_FRAME_LOCKED:
+            if grid_flip is not None:
+                grid_frame += frames_advanced(stim_onset - grid_flip, CFG_FRAME_RATE_HZ)
+            grid_flip = stim_onset
+            trial_frame = grid_frame
+        stim_marker = _marker_code_for_stim(is_target, lure_type)
+
+        # Response collection: first press per response key (RT in ms)
+        responses: Dict[str, float] = {}
+        resp_marker_latency: Optional[float] = None
+
+        def _register(name: str, rt_s: float) -> None:
+            nonlocal resp_marker_latency
+            if name == KEY_QUIT:
+                graceful_quit(None, None, rows_out if rows_out is not None else [], win, abort=True)
+            if name in responses:
+                return
+            responses[name] = rt_s * 1000.0
+            # Key presses are not display events: the marker goes out on detection, and
+            # its delay after the (keyboard-timestamped) press is logged
+            try:
+                written = send_named('response_ll' if n_back == 1 else 'response_hl',
+                                     parallel_port=GLOBAL_PARALLEL_PORT, eyelink=GLOBAL_EYELINK, immediate=True)
+            except Exception:
+                written = False
+            if written and resp_marker_latency is None:
+                resp_marker_latency = clock() - (stim_onset + rt_s)
+
+        def _poll_keys() -> None:
+            if len(responses) >= len(response_keys):
+                return
+            if CFG_USE_HW_KB and _HAVE_HW_KB and kb is not None:
+                for k in kb.getKeys(keyList=response_keys + [KEY_QUIT], waitRelease=False, clear=False):
+                    _register(k.name, k.rt or 0.0)
+            else:
+                for k, t in event.getKeys(keyList=response_keys + [KEY_QUIT], timeStamped=resp_clock):
+                    if k:
+                        _register(k, t)
 
-        # Response collection
-        got_response = False
-        resp_key = None
-        rt_ms: Optional[float] = None
+        def _fixation_frame() -> None:
+            nonlocal fixation_mark_sent
+            if not fixation_mark_sent:
+                win.callOnFlip(_flip_marker, 'fixation_onset', marker_times, clock)
+                fixation_mark_sent = True
+            _draw_fixation(win)
 
         # Present for STIM_DUR_MS, then fixation until SOA; accept responses until SOA
         fixation_mark_sent = False
-        while True:
-            now_ms = resp_clock.getTime() * 1000.0
-            if now_ms >= CFG_SOA_MS:
-                break
-            if CFG_USE_HW_KB and _HAVE_HW_KB and kb is not None:
-                keys = kb.getKeys(keyList=[KEY_RESPONSE, KEY_QUIT], waitRelease=False, clear=False)
-                if keys and not got_response:
-                    k = keys[0]
-                    name = k.name
-                    if name == KEY_QUIT:
-                        graceful_quit(None, None, rows_out if rows_out is not None else [], win, abort=True)
-                    got_response = True
-                    resp_key = name
-                    rt_ms = (k.rt or 0.0) * 1000.0
-                    try:
-                        send_named('response_ll' if n_back == 1 else 'response_hl',
-                                   parallel_port=GLOBAL_PARALLEL_PORT, eyelink=GLOBAL_EYELINK)
-                    except Exception:
-                        pass
-            else:
-                keys = event.getKeys(keyList=[KEY_RESPONSE, KEY_QUIT], timeStamped=resp_clock)
-                if keys and not got_response:
-                    for k, t in keys:
-                        if k == KEY_QUIT:
-                            graceful_quit(None, None, rows_out if rows_out is not None else [], win, abort=True)
-                        if k:
-                            got_response = True
-                            resp_key = k
-                            rt_ms = t * 1000.0
-                            try:
-                                send_named('response_ll' if n_back == 1 else 'response_hl',
-                                           parallel_port=GLOBAL_PARALLEL_PORT, eyelink=GLOBAL_EYELINK)
-                            except Exception:
-                                pass
-                            break
-            # Draw based on phase: stimulus then fixation
-            if now_ms < STIM_DUR_MS:
-                _draw_stimulus(win, plan.stimulus)
-            else:
-                if not fixation_mark_sent:
-                    try:
-                        send_named('fixation_onset', parallel_port=GLOBAL_PARALLEL_PORT, eyelink=GLOBAL_EYELINK)
-                    except Exception:
-                        pass
-                    fixation_mark_sent = True
-                _draw_fixation(win)
-            win.flip()
-
-        # Score
-        is_space = (resp_key == KEY_RESPONSE)
-        correct = int((plan.is_target == 1 and is_space) or (plan.is_target == 0 and not is_space))
-        if correct:
-            correct_count += 1
+        fixation_flip: Optional[float] = None
+        frame_cols: Dict[str, object] = {}
+        if CFG_FRAME_LOCKED:
+            # Onsets are planned on the block's frame grid, so a dropped frame shortens
+            # this trial instead of delaying every later onset
+            onset_frame = (t_idx - 1) * CFG_SOA_FRAMES
+            fixation_frame: Optional[int] = None
+            # grid_frame + 1 is the frame the next flip lands on
+            while grid_frame + 1 < onset_frame + CFG_SOA_FRAMES:
+                _poll_keys()
+                first_fixation = False
+                if grid_frame + 1 < onset_frame + CFG_STIM_FRAMES:
+                    stim.draw()
+                else:
+                    first_fixation = not fixation_mark_sent
+                    _fixation_frame()
+                flip_time = win.flip()
+                grid_frame += frames_advanced(flip_time - grid_flip, CFG_FRAME_RATE_HZ)
+                grid_flip = flip_time
+                if first_fixation:
+                    fixation_flip = flip_time
+                    fixation_frame = grid_frame
+                    recorder.offset(flip_time)
+                else:
+                    recorder.flip(flip_time)
+            _poll_keys()
+            # Frames this trial actually got on the grid (late onset or drops count)
+            frames_actual = grid_frame - trial_frame + 1
+            stim_frames_actual = fixation_frame - trial_frame if fixation_frame is not None else frames_actual
+            frame_cols = {
+                "frames_planned": CFG_SOA_FRAMES,
+                "frames_actual": frames_actual,
+                "stim_frames_planned": CFG_STIM_FRAMES,
+                "stim_frames_actual": stim_frames_actual,
+            }
+        else:
+            while True:
+                now_ms = resp_clock.getTime() * 1000.0
+                if now_ms >= CFG_SOA_MS:
+                    break
+                _poll_keys()
+                # Draw based on phase: stimulus then fixation
+                first_fixation = False
+                if now_ms < STIM_DUR_MS:
+                    stim.draw()
+                else:
+                    first_fixation = not fixation_mark_sent
+                    _fixation_frame()
+                flip_time = win.flip()
+                if first_fixation:
+                    fixation_flip = flip_time
+                    recorder.offset(flip_time)
+                else:
+                    recorder.flip(flip_time)
+
+        # Flip-to-marker offsets (marker write returned minus flip timestamp)
+        stim_marker_at = marker_times.get('stim_presentation')
+        fixation_marker_at = marker_times.get('fixation_onset')
+        marker_cols = {
+            "stim_marker_offset_ms": f"{(stim_marker_at - stim_onset) * 1000.0:.3f}" if stim_marker_at is not None else "",
+            "fixation_marker_offset_ms": (f"{(fixation_marker_at - fixation_flip) * 1000.0:.3f}"
+                                          if fixation_marker_at is not None and fixation_flip is not None else ""),
+            "resp_marker_latency_ms": f"{resp_marker_latency * 1000.0:.3f}" if resp_marker_latency is not None else "",
+        }
+
+        # Score (letter stream; position stream too in dual mode)
+        rt_ms = responses.get(letter_key)
+        pressed = rt_ms is not None
+        correct = int((is_target == 1 and pressed) or (is_target == 0 and not pressed))
         accs_out.append(correct)
         if correct and rt_ms is not None:
             rts_out.append(rt_ms)
+        position_cols: Dict[str, object] = {}
+        if dual:
+            position_is_target = position_flags[t_idx - 1]
+            pos_rt_ms = responses.get(KEY_RESPONSE_POSITION)
+            pos_pressed = pos_rt_ms is not None
+            pos_correct = int((position_is_target == 1 and pos_pressed) or (position_is_target == 0 and not pos_pressed))
+            accs_out.append(pos_correct)
+            if pos_correct and pos_rt_ms is not None:
+                rts_out.append(pos_rt_ms)
+            position_cols = {
+                "position": position,
+                "position_is_target": position_is_target,
+                "position_lure_type": position_lures[t_idx - 1],
+                "position_response_key": KEY_RESPONSE_POSITION if pos_pressed else "",
+                "position_rt_ms": f"{pos_rt_ms:.2f}" if pos_rt_ms is not None else "",
+                "position_correct": pos_correct,
+            }
 
         # Row output
         if rows_out is not None:
@@ -637,21 +1005,32 @@ def run_block(win: visual.Window, block_idx: int, n_back: int, plans: List[Trial
                 "block_idx": block_idx,
                 "trial_idx": t_idx,
                 "n_back": n_back,
-                "stimulus": plan.stimulus,
-                "is_target": plan.is_target,
-                "lure_type": plan.lure_type,
-                "iti_ms": plan.iti_ms,
+                "stimulus": letter,
+                "is_target": is_target,
+                "lure_type": lure_type,
+                "iti_ms": iti_values[t_idx - 1],
                 "stim_onset_time": f"{stim_onset:.6f}",
-                "response_key": resp_key or "",
+                "response_key": letter_key if pressed else "",
                 "rt_ms": f"{rt_ms:.2f}" if rt_ms is not None else "",
                 "correct": correct,
                 "marker_code_stim": stim_marker,
-                "marker_code_resp": (50 if n_back == 1 else 51) if got_response else "",
+                "marker_code_resp": (50 if n_back == 1 else 51) if responses else "",
+                **marker_cols,
+                **position_cols,
+                **frame_cols,
             }
             rows_out.append(row)
 
     # No trailing ITI; pacing is enforced per-trial via SOA
 
+    # Measured presentation per trial, derived from the block's flip timestamps
+    if rows_out is not None:
+        timing = recorder.trial_timing(CFG_FRAME_RATE_HZ)
+        for row, (duration_ms, frames, dropped) in zip(rows_out[n_rows_before:], timing.tolist()):
+            row["stim_duration_ms"] = f"{duration_ms:.2f}"
+            row["stim_frames"] = frames
+            row["dropped_frames"] = dropped
+
     # End marker (by load)
     try:
         send_named('block_ll_end' if n_back == 1 else 'block_hl_end',
@@ -659,7 +1038,8 @@ def run_block(win: visual.Window, block_idx: int, n_back: int, plans: List[Trial
     except Exception:
         pass
 
-    acc = correct_count / len(plans) if plans else 0.0
+    block_accs = accs_out[n_accs_before:]
+    acc = sum(block_accs) / len(block_accs) if block_accs else 0.0
     mean_rt = (sum(rts_out) / len(rts_out)) if rts_out else None
     return acc, mean_rt
 
@@ -670,9 +1050,35 @@ def run_block(win: visual.Window, block_idx: int, n_back: int, plans: List[Trial
 
 CURRENT_PARTICIPANT = ""
 SESSION_TS = ""
+SESSION_SEED = 0  # root of all per-block/practice RNG streams (see nback.rng)
 CSV_PATH = ""
 ABORT_WITHOUT_SAVE = False
 META_PATH = ""
+MARKERS_PATH = ""
+
+
+def _flip_clock() -> Callable[[], float]:
+    """Clock that win.flip() timestamps are read from (PsychoPy's logging clock)."""
+    monotonic = getattr(core, "monotonicClock", None)
+    return monotonic.getTime if monotonic is not None else core.getTime
+
+
+def _write_marker_log(records: List) -> None:
+    """Append sent-marker records (nback.markers.MarkerRecord) to the markers CSV."""
+    if not records or not MARKERS_PATH:
+        return
+    try:
+        new_file = not os.path.exists(MARKERS_PATH)
+        with open(MARKERS_PATH, "a", newline="", encoding="utf-8") as mf:
+            w = csv.writer(mf)
+            if new_file:
+                w.writerow(["name", "code", "enqueued_time", "port_time", "sent_time", "dispatch_latency_ms"])
+            for rec in records:
+                w.writerow([rec.name, rec.code, f"{rec.enqueued:.6f}",
+                            f"{rec.port_time:.6f}" if rec.port_time is not None else "",
+                            f"{rec.sent:.6f}", f"{(rec.sent - rec.enqueued) * 1000.0:.3f}"])
+    except Exception:
+        pass
 
 
 def graceful_quit(writer: Optional[csv.DictWriter], f: Optional[object], rows: List[Dict], win: Optional[visual.Window], abort: bool = False) -> None:
@@ -684,6 +1090,14 @@ def graceful_quit(writer: Optional[csv.DictWriter], f: Optional[object], rows: L
     global ABORT_WITHOUT_SAVE
     ABORT_WITHOUT_SAVE = ABORT_WITHOUT_SAVE or abort
 
+    # Stop any block generation still running in the background
+    if SESSION_PLANNER is not None:
+        SESSION_PLANNER.shutdown()
+    if BLOCK_REGISTRY is not None:
+        BLOCK_REGISTRY.close()
+    # Send any queued markers before the transports are closed below
+    marker_worker = stop_worker()
+
     # Only save when not aborting
     if not ABORT_WITHOUT_SAVE:
         try:
@@ -692,6 +1106,8 @@ def graceful_quit(writer: Optional[csv.DictWriter], f: Optional[object], rows: L
                 f.flush()
         except Exception:
             pass
+        if marker_worker is not None:
+            _write_marker_log(marker_worker.drain_log())
     # Close file handle if present
     try:
         if f is not None:
@@ -710,6 +1126,11 @@ def graceful_quit(writer: Optional[csv.DictWriter], f: Optional[object], rows: L
                 os.remove(META_PATH)
         except Exception:
             pass
+        try:
+            if MARKERS_PATH and os.path.exists(MARKERS_PATH):
+                os.remove(MARKERS_PATH)
+        except Exception:
+            pass
     # Close window
     try:
         if win is not None:
@@ -754,7 +1175,7 @@ def main(argv: Optional[List[str]] = None) -> int:
     - Consent → Instructions → Practice (optional) → Heads-up → Blocks → Thanks → Save/Exit.
     - Writes per-trial CSV and a metadata JSON sidecar.
     """
-    global CURRENT_PARTICIPANT, SESSION_TS, CSV_PATH, META_PATH
+    global CURRENT_PARTICIPANT, SESSION_TS, CSV_PATH, META_PATH, MARKERS_PATH, SESSION_SEED
 
     parser = argparse.ArgumentParser(description="PsychoPy N-back Task (two-load version)")
     parser.add_argument("--participant", "-p", default="anon", help="Participant ID")
@@ -767,6 +1188,9 @@ def main(argv: Optional[List[str]] = None) -> int:
     # Fixed SOA timing (legacy ITI jitter removed)
     parser.add_argument("--lure-nminus1", type=float, default=LURE_N_MINUS_1_RATE, help="Probability of n-1 lures per non-target trial")
     parser.add_argument("--lure-nplus1", type=float, default=LURE_N_PLUS_1_RATE, help="Probability of n+1 lures per non-target trial")
+    parser.add_argument("--lure-mode", choices=["rate", "quota"], default="rate", help="'rate': lure rates are per-trial probabilities; 'quota': round(rate x non-targets) lures of each type per block (shortfalls logged in generation_stats)")
+    parser.add_argument("--dual", action="store_true", help=f"Dual N-back: letter stream plus grid-position stream (keys: '{KEY_RESPONSE_LETTER}' letter, '{KEY_RESPONSE_POSITION}' position)")
+    parser.add_argument("--max-dual-targets", type=int, default=None, help="Dual mode: max trials per block that are targets in both streams (default: 10%% of trials)")
     parser.add_argument("--target-rate", type=float, default=TARGET_RATE, help="Target rate (0-1) per block")
     parser.add_argument("--max-consec-targets", type=int, default=MAX_CONSEC_TARGETS_DEFAULT, help="Maximum allowed consecutive targets")
     parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducibility")
@@ -774,8 +1198,15 @@ def main(argv: Optional[List[str]] = None) -> int:
     parser.add_argument("--windowed", action="store_true", help="Run windowed for debugging (default: fullscreen)")
     parser.add_argument("--screen", type=int, default=None, help="Display/screen index (0=primary). If unset, PsychoPy default is used.")
     parser.add_argument("--list-screens", action="store_true", help="List detected screens and exit.")
+    parser.add_argument("--frame-locked", action="store_true", help="Schedule stimulus offset and trial onsets by counting display frames (durations rounded to whole frames of the refresh rate)")
+    parser.add_argument("--refresh-hz", type=float, default=None, help="Display refresh rate to assume instead of measuring it")
+    parser.add_argument("--remeasure-refresh", action="store_true", help="Ignore the cached refresh rate for this machine/screen and measure it again")
     parser.add_argument("--kb-backend", choices=["ptb", "event"], default="event", help="Keyboard backend: 'ptb' (hardware; low-latency) or 'event' (fallback)")
     parser.add_argument("--soa-ms", type=int, default=SOA_MS_DEFAULT, help="Constant stimulus onset asynchrony (ms). Default: 2500")
+    parser.add_argument("--sequence-bank", default=None, help="Directory of pregenerated blocks (see scripts/build_sequence_bank.py)")
+    parser.add_argument("--block-registry", nargs="?", const=os.path.join(DATA_DIR, REGISTRY_FILE), default=None,
+                        metavar="PATH", help=f"Never issue the same block twice across sessions/participants, using an SQLite index (default path: data/{REGISTRY_FILE})")
+    parser.add_argument("--plan-workers", type=int, default=None, help="Worker processes for up-front block generation (0 = in-process; default: CPU count - 1)")
     # If legacy single-load flags are present in argv, fail with guidance
     if argv is None:
         argv_check = sys.argv[1:]
@@ -833,15 +1264,20 @@ def main(argv: Optional[List[str]] = None) -> int:
     CURRENT_PARTICIPANT = safe_filename(str(args.participant)) or "anon"
     SESSION_TS = timestamp()
 
-    # Configure RNG
-    if args.seed is not None:
-        random.seed(int(args.seed))
+    # Configure RNG: each block/practice attempt draws from its own stream derived
+    # from (session seed, participant, index), independent of generation order.
+    SESSION_SEED = resolve_session_seed(args.seed)
+    random.seed(SESSION_SEED)
 
     # Apply CLI config
-    global CFG_TARGET_RATE, CFG_LURE_NM1, CFG_LURE_NP1, CFG_MAX_CONSEC_TARGETS, CFG_SOA_MS, CFG_FIXED_ITI_MS
+    global CFG_TARGET_RATE, CFG_LURE_NM1, CFG_LURE_NP1, CFG_LURE_MODE, CFG_MAX_CONSEC_TARGETS, CFG_SOA_MS, CFG_FIXED_ITI_MS
     CFG_TARGET_RATE = float(max(0.0, min(1.0, args.target_rate)))
     CFG_LURE_NM1 = float(max(0.0, min(1.0, args.lure_nminus1)))
     CFG_LURE_NP1 = float(max(0.0, min(1.0, args.lure_nplus1)))
+    CFG_LURE_MODE = args.lure_mode
+    global CFG_DUAL, CFG_MAX_DUAL_TARGETS
+    CFG_DUAL = bool(args.dual)
+    CFG_MAX_DUAL_TARGETS = None if args.max_dual_targets is None else max(0, int(args.max_dual_targets))
     CFG_MAX_CONSEC_TARGETS = max(1, int(args.max_consec_targets))
     # Fixed SOA: ITI = SOA - STIM_DUR_MS; response window extends until next onset
     CFG_SOA_MS = max(1, int(args.soa_ms))
@@ -852,10 +1288,74 @@ def main(argv: Optional[List[str]] = None) -> int:
     if args.kb_backend == "ptb" and not _HAVE_HW_KB:
         print("Note: psychtoolbox keyboard backend unavailable; falling back to 'event' backend.")
 
+    # Fail fast on parameter sets that cannot produce valid blocks; keep the exact
+    # number of target layouts for the metadata.
+    feasibility_checks = {f"{n}-back": (n, trials_per_block, CFG_TARGET_RATE) for n in load_order}
+    if not args.no_practice:
+        feasibility_checks["practice"] = (2, max(1, int(args.practice_trials)), PRACTICE_TARGET_RATE)
+    sequence_feasibility: Dict[str, Dict] = {}
+    for label, (n_back, n_trials, rate) in feasibility_checks.items():
+        if CFG_DUAL:
+            fz = check_dual_feasibility(n_back, n_trials, target_rate=rate, max_consec_targets=CFG_MAX_CONSEC_TARGETS,
+                                        max_dual_targets=CFG_MAX_DUAL_TARGETS)
+        else:
+            fz = check_feasibility(n_back, n_trials, target_rate=rate, max_consec_targets=CFG_MAX_CONSEC_TARGETS)
+        if not fz.feasible:
+            raise SystemExit(f"Infeasible sequence parameters ({label}): {fz.message}")
+        sequence_feasibility[label] = {
+            "desired_targets": fz.desired_targets,
+            "max_targets": fz.max_targets,
+            # exact count can exceed 64 bits; keep it as a decimal string
+            "target_placements": _big_int_str(fz.placements),
+            "target_placements_log10": round(math.log10(fz.placements), 3) if fz.placements else None,
+        }
+
+    # Optional sequence bank: pick every main block up front so block transitions only slice a memory map
+    global SEQUENCE_BANK
+    SEQUENCE_BANK = load_bank(args.sequence_bank)
+    if SEQUENCE_BANK is not None and CFG_DUAL:
+        print("Sequence banks hold single-stream blocks; ignoring --sequence-bank in dual mode.")
+        SEQUENCE_BANK = None
+    bank_picks: Dict[int, List[int]] = {}
+    if SEQUENCE_BANK is not None:
+        for n_back in load_order:
+            key = _main_bank_key(n_back, trials_per_block)
+            if key in SEQUENCE_BANK:
+                pick_rng = stream_random(SESSION_SEED, CURRENT_PARTICIPANT, STREAM_SESSION, n_back)
+                bank_picks[n_back] = SEQUENCE_BANK.draw(key, blocks_per_load, rng=pick_rng)
+            else:
+                print(f"Sequence bank has no entry {key}; {n_back}-back blocks will be generated on the fly.")
+
+    # Generate every block of the session up front. Workers start before the window opens
+    # and run while consent/instructions are on screen; the block loop only collects plans.
+    global SESSION_PLANNER
+    SESSION_PLANNER = SessionPlanner(max_workers=args.plan_workers)
+    practice_trials = max(1, int(args.practice_trials))
+    jobs: Dict[Tuple[str, int], BlockSpec] = {}
+    block_no = 0
+    for n_back in load_order:
+        for within_phase_b in range(1, blocks_per_load + 1):
+            block_no += 1
+            if n_back in bank_picks:
+                SESSION_PLANNER.put(("block", block_no),
+                                    SEQUENCE_BANK.block(_main_bank_key(n_back, trials_per_block),
+                                                        bank_picks[n_back][within_phase_b - 1], CFG_FIXED_ITI_MS))
+            else:
+                jobs[("block", block_no)] = _main_block_spec(n_back, trials_per_block, block_no)
+    practice_from_bank = SEQUENCE_BANK is not None and _practice_bank_key(2, practice_trials) in SEQUENCE_BANK
+    if not args.no_practice and not practice_from_bank:
+        for attempt in range(1, PRACTICE_POOL_SIZE + 1):
+            jobs[("practice", attempt)] = _practice_block_spec(2, practice_trials, attempt)
+    SESSION_PLANNER.submit_all(jobs)
+
+    global BLOCK_REGISTRY
+    BLOCK_REGISTRY = open_registry(args.block_registry)
+
     make_data_dir(DATA_DIR)
     csv_name = f"nback_{CURRENT_PARTICIPANT}_{SESSION_TS}.csv"
     CSV_PATH = os.path.join(DATA_DIR, csv_name)
     META_PATH = os.path.join(DATA_DIR, f"nback_{CURRENT_PARTICIPANT}_{SESSION_TS}.meta.json")
+    MARKERS_PATH = os.path.join(DATA_DIR, f"nback_{CURRENT_PARTICIPANT}_{SESSION_TS}.markers.csv")
 
     # Configure window
     fullscr = not bool(args.windowed)
@@ -874,18 +1374,22 @@ def main(argv: Optional[List[str]] = None) -> int:
     except Exception:
         pass
 
-    # Detect and report display refresh rate (skip probe to avoid hangs)
-    refresh_hz = None
-    try:
-        refresh_hz = None  # skip getActualFrameRate to prevent blocking
-        # To probe later (faster/safer), try:
-        # refresh_hz = win.getActualFrameRate(nIdentical=5, nMaxFrames=120, nWarmUpFrames=10, threshold=1)
-    except Exception:
-        refresh_hz = None
-    if refresh_hz:
-        print(f"Detected display refresh: {refresh_hz:.3f} Hz (frame ≈ {1000.0/refresh_hz:.2f} ms)")
-    else:
-        print("Skipping display refresh measurement (set manually if needed).")
+    # Display refresh rate: --refresh-hz, else the value cached for this machine/screen,
+    # else measured from the consent screen's flips (bounded; see nback.display_profile)
+    profile_path = os.path.join(DATA_DIR, PROFILE_FILE)
+    display_sig = display_signature(win, args.screen, fullscr)
+    refresh_hz: Optional[float] = None
+    refresh_source: Optional[str] = None
+    if args.refresh_hz:
+        refresh_hz, refresh_source = float(args.refresh_hz), "cli"
+    elif not args.remeasure_refresh:
+        refresh_hz = cached_refresh_hz(profile_path, display_sig)
+        refresh_source = "profile" if refresh_hz else None
+    refresh_probe = RefreshProbe() if refresh_hz is None else None
+
+    # Lay out every letter once now so trials only draw prebuilt stimuli
+    _build_glyph_cache(win)
+    _ensure_stims(win)
 
     # =========================
     # Hardware markers: safe initialization (works without hardware)
@@ -910,6 +1414,10 @@ def main(argv: Optional[List[str]] = None) -> int:
         GLOBAL_EYELINK = None
         EDF_NAME = ""
 
+    # Marker writes (parallel port, EyeLink messages) run on a worker thread from here on;
+    # send_named only enqueues, stamped with the flip clock
+    marker_worker = start_worker(_flip_clock())
+
     # Mark experiment start
     try:
         send_named('experiment_start', parallel_port=GLOBAL_PARALLEL_PORT, eyelink=GLOBAL_EYELINK)
@@ -919,7 +1427,31 @@ def main(argv: Optional[List[str]] = None) -> int:
     # =========================
     # PHASE: Consent -> Instructions -> Practice heads-up
     # =========================
-    show_consent(win)
+    show_consent(win, probe=refresh_probe)
+    if refresh_probe is not None:
+        # show_consent runs the probe to completion
+        measurement = refresh_probe.result()
+        if measurement is not None:
+            refresh_hz, refresh_source = measurement.refresh_hz, "measured"
+            save_refresh(profile_path, display_sig, measurement)
+    if refresh_hz:
+        print(f"Display refresh ({refresh_source}): {refresh_hz:.3f} Hz (frame ≈ {1000.0/refresh_hz:.2f} ms)")
+    else:
+        print("Display refresh could not be measured reliably (pass --refresh-hz to set it).")
+
+    global CFG_FRAME_LOCKED, CFG_FRAME_RATE_HZ, CFG_STIM_FRAMES, CFG_SOA_FRAMES
+    CFG_FRAME_RATE_HZ = float(refresh_hz) if refresh_hz else None
+    CFG_FRAME_LOCKED = bool(args.frame_locked)
+    if CFG_FRAME_LOCKED and not refresh_hz:
+        print("Warning: refresh rate unknown; --frame-locked disabled (pass --refresh-hz to force it).")
+        CFG_FRAME_LOCKED = False
+    if CFG_FRAME_LOCKED:
+        CFG_STIM_FRAMES = _frames_for(STIM_DUR_MS, CFG_FRAME_RATE_HZ)
+        CFG_SOA_FRAMES = max(CFG_STIM_FRAMES, _frames_for(CFG_SOA_MS, CFG_FRAME_RATE_HZ))
+        frame_ms = 1000.0 / CFG_FRAME_RATE_HZ
+        print(f"Frame-locked timing: stimulus {CFG_STIM_FRAMES} frames ({CFG_STIM_FRAMES * frame_ms:.1f} ms), "
+              f"SOA {CFG_SOA_FRAMES} frames ({CFG_SOA_FRAMES * frame_ms:.1f} ms)")
+
     show_instructions_multi(win, load_order)
     show_practice_headsup(win)
 
@@ -929,13 +1461,24 @@ def main(argv: Optional[List[str]] = None) -> int:
         "n_back", "stimulus", "is_target", "lure_type", "iti_ms",
         "stim_onset_time", "response_key", "rt_ms", "correct",
         "marker_code_stim", "marker_code_resp",
+        "stim_duration_ms", "stim_frames", "dropped_frames",
+        "stim_marker_offset_ms", "fixation_marker_offset_ms", "resp_marker_latency_ms",
     ]
+    if CFG_DUAL:
+        # Letter-stream columns above; position stream below (response_key is the letter key)
+        fieldnames += [
+            "position", "position_is_target", "position_lure_type",
+            "position_response_key", "position_rt_ms", "position_correct",
+        ]
+    if CFG_FRAME_LOCKED:
+        fieldnames += ["frames_planned", "frames_actual", "stim_frames_planned", "stim_frames_actual"]
 
     f = open(CSV_PATH, "w", newline="", encoding="utf-8")
     writer = csv.DictWriter(f, fieldnames=fieldnames)
     writer.writeheader()
 
     # Write sidecar metadata JSON for reproducibility (includes display refresh and fullscreen)
+    meta: Dict = {}
     try:
         meta = {
             "participant_id": CURRENT_PARTICIPANT,
@@ -952,17 +1495,38 @@ def main(argv: Optional[List[str]] = None) -> int:
             "target_rate": CFG_TARGET_RATE,
             "lure_nminus1_rate": CFG_LURE_NM1,
             "lure_nplus1_rate": CFG_LURE_NP1,
+            "lure_mode": CFG_LURE_MODE,
+            "dual": CFG_DUAL,
+            "max_dual_targets": CFG_MAX_DUAL_TARGETS,
+            "response_keys": ({"letter": KEY_RESPONSE_LETTER, "position": KEY_RESPONSE_POSITION}
+                              if CFG_DUAL else {"letter": KEY_RESPONSE}),
             "max_consec_targets": CFG_MAX_CONSEC_TARGETS,
             # constant SOA model; per-trial iti_ms equals (soa_ms - stim_dur_ms)
             "seed": args.seed,
+            # Per-block streams: SeedSequence(session_seed, spawn_key=(crc32(participant), stream, index))
+            "session_seed": SESSION_SEED,
             "letters": LETTERS,
             "psychopy_version": None,
             "display_refresh_hz": refresh_hz,
+            "display_refresh_source": refresh_source,
+            "frame_locked": CFG_FRAME_LOCKED,
+            "stim_frames": CFG_STIM_FRAMES if CFG_FRAME_LOCKED else None,
+            "soa_frames": CFG_SOA_FRAMES if CFG_FRAME_LOCKED else None,
             "window_fullscreen": bool(fullscr),
             "screen_index": args.screen,
             "soa_ms": CFG_SOA_MS,
             "fixed_iti_ms": CFG_FIXED_ITI_MS,
             "kb_backend": "ptb" if (CFG_USE_HW_KB and _HAVE_HW_KB) else "event",
+            "sequence_bank": args.sequence_bank if SEQUENCE_BANK is not None else None,
+            "sequence_bank_picks": {str(n): picks for n, picks in bank_picks.items()},
+            "plan_workers": args.plan_workers,
+            "block_registry": BLOCK_REGISTRY.path if BLOCK_REGISTRY is not None else None,
+            "marker_log": os.path.basename(MARKERS_PATH),
+            "sequence_feasibility": sequence_feasibility,
+            # filled in per block as blocks are run (see _record_generation_stats)
+            "generation_stats": {},
+            # flip-interval summary per block (see _record_frame_intervals)
+            "frame_intervals": {},
         }
         try:
             import psychopy
@@ -981,14 +1545,30 @@ def main(argv: Optional[List[str]] = None) -> int:
     # =========================
     # PHASE: Practice (always 2-back)
     # =========================
-    practice_trials = max(1, int(args.practice_trials))
     if not args.no_practice and practice_trials > 0:
         try:
             send_named('practice_start', parallel_port=GLOBAL_PARALLEL_PORT, eyelink=GLOBAL_EYELINK)
         except Exception:
             pass
+        practice_attempt = 0
         while True:
-            acc, _ = run_practice(win, 2, practice_trials)
+            practice_attempt += 1
+            pre = ("practice", practice_attempt)
+            label = f"practice_{practice_attempt}"
+            if pre in SESSION_PLANNER or not practice_from_bank:
+                spec = _practice_block_spec(2, practice_trials, practice_attempt)
+                practice_plans = SESSION_PLANNER.get(pre, fallback=spec)
+                practice_stats = SESSION_PLANNER.stats[pre]
+                redraw = lambda k, spec=spec: build_block_with_stats(replace(spec, redraw=k))
+            else:
+                key = _practice_bank_key(2, practice_trials)
+                practice_plans = _bank_block(key, STREAM_PRACTICE, practice_attempt)
+                practice_stats = None
+                redraw = lambda k, key=key, idx=practice_attempt: (_bank_block(key, STREAM_PRACTICE, idx, k), None)
+            practice_plans, practice_stats, redraws = _claim_block(label, 2, practice_plans, practice_stats, redraw)
+            _record_generation_stats(meta, label, practice_stats, redraws)
+            acc, _ = run_practice(win, 2, practice_trials, attempt=practice_attempt, plans=practice_plans)
+            _record_frame_intervals(meta, label)
             if acc >= PRACTICE_PASS_ACC:
                 break
             # If failed, re-show very brief reminder before repeating
@@ -1017,16 +1597,17 @@ def main(argv: Optional[List[str]] = None) -> int:
 
         for within_phase_b in range(1, blocks_per_load + 1):
             block_counter += 1
-            plans = generate_sequence(
-                n_back,
-                trials_per_block,
-                target_rate=CFG_TARGET_RATE,
-                lure_n_minus_1_rate=CFG_LURE_NM1,
-                lure_n_plus_1_rate=CFG_LURE_NP1,
-                max_consec_targets=CFG_MAX_CONSEC_TARGETS,
-                fixed_iti_ms=CFG_FIXED_ITI_MS,
-                include_lures=True,
-            )
+            spec = _main_block_spec(n_back, trials_per_block, block_counter)
+            plans = SESSION_PLANNER.get(("block", block_counter), fallback=spec)
+            stats = SESSION_PLANNER.stats[("block", block_counter)]
+            if n_back in bank_picks:
+                key = _main_bank_key(n_back, trials_per_block)
+                redraw = lambda k, key=key, idx=block_counter: (_bank_block(key, STREAM_BLOCK, idx, k), None)
+            else:
+                redraw = lambda k, spec=spec: build_block_with_stats(replace(spec, redraw=k))
+            label = f"block_{block_counter}"
+            plans, stats, redraws = _claim_block(label, n_back, plans, stats, redraw)
+            _record_generation_stats(meta, label, stats, redraws)
             block_accs: List[int] = []
             block_rts: List[float] = []
 
@@ -1041,8 +1622,10 @@ def main(argv: Optional[List[str]] = None) -> int:
                 rts_out=block_rts,
                 rows_out=all_rows,
             )
+            _record_frame_intervals(meta, label)
 
             # Persist rows periodically (per block)
+            _write_marker_log(marker_worker.drain_log())
             if all_rows:
                 writer.writerows(all_rows)
                 f.flush()
@@ -1054,6 +1637,10 @@ def main(argv: Optional[List[str]] = None) -> int:
             if block_counter < total_blocks:
                 show_break(win, block_counter, acc, mean_rt)
 
+    SESSION_PLANNER.shutdown()
+    if BLOCK_REGISTRY is not None:
+        BLOCK_REGISTRY.close()
+
     # Finish
     show_thanks(win)
     # Require explicit save/exit confirmation (ENTER) and avoid ESC here
@@ -1077,6 +1664,9 @@ def main(argv: Optional[List[str]] = None) -> int:
         send_named('experiment_end', parallel_port=GLOBAL_PARALLEL_PORT, eyelink=GLOBAL_EYELINK)
     except Exception:
         pass
+    # Drain the marker queue before the EyeLink connection is closed
+    stop_worker()
+    _write_marker_log(marker_worker.drain_log())
 
     # EyeLink finalization (normal exit)
     try:
@@ -1104,8 +1694,13 @@ def main(argv: Optional[List[str]] = None) -> int:
 
     # Summary
     total_trials = (2 * blocks_per_load) * trials_per_block
-    overall_acc = sum(overall_accs) / total_trials if total_trials else 0.0
-    # Accuracy by target/non-target requires re-reading CSV rows; quick pass
+    # Dual blocks add two decisions per trial (letter and position) to overall_accs
+    overall_acc = sum(overall_accs) / len(overall_accs) if overall_accs else 0.0
+    # Accuracy by stream and by target/non-target requires re-reading CSV rows; quick pass
+    streams = [("Letter", "is_target", "correct")]
+    if CFG_DUAL:
+        streams.append(("Position", "position_is_target", "position_correct"))
+    stream_counts = {name: [0, 0] for name, _, _ in streams}  # correct, total
     target_correct = 0
     target_total = 0
     nontarget_correct = 0
@@ -1115,16 +1710,19 @@ def main(argv: Optional[List[str]] = None) -> int:
         with open(CSV_PATH, "r", encoding="utf-8") as rf:
             r = csv.DictReader(rf)
             for row in r:
-                itarget = int(row["is_target"]) if row["is_target"] != "" else 0
-                corr = int(row["correct"]) if row["correct"] != "" else 0
-                if itarget == 1:
-                    target_total += 1
-                    if corr == 1:
-                        target_correct += 1
-                else:
-                    nontarget_total += 1
-                    if corr == 1:
-                        nontarget_correct += 1
+                for name, target_col, correct_col in streams:
+                    itarget = int(row[target_col]) if row.get(target_col, "") != "" else 0
+                    corr = int(row[correct_col]) if row.get(correct_col, "") != "" else 0
+                    stream_counts[name][0] += corr
+                    stream_counts[name][1] += 1
+                    if itarget == 1:
+                        target_total += 1
+                        if corr == 1:
+                            target_correct += 1
+                    else:
+                        nontarget_total += 1
+                        if corr == 1:
+                            nontarget_correct += 1
     except Exception:
         pass
 
@@ -1136,6 +1734,9 @@ def main(argv: Optional[List[str]] = None) -> int:
     print(f"File: {CSV_PATH}")
     print(f"Trials: {total_trials}")
     print(f"Overall accuracy: {overall_acc*100:.1f}%")
+    if CFG_DUAL:
+        for name, (correct, total) in stream_counts.items():
+            print(f"{name} accuracy: {(correct / total if total else 0.0)*100:.1f}% (n={total})")
     print(f"Target accuracy: {target_acc*100:.1f}% (n={target_total})")
     print(f"Non-target accuracy: {nontarget_acc*100:.1f}% (n={nontarget_total})")
     if mean_rt is not None:
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""Print quality metrics for the blocks of a sequence bank.
+
+For every entry (or the ones given with `--key`) prints percentiles of the
+`nback.sequence_metrics` table: letter entropy, lag-k repetition rates,
+realized target/lure rates and run-length histograms. With `--csv-dir` the
+full per-block table of each entry is written to `<key>.metrics.csv`.
+
+Usage:
+    PYTHONPATH=. python scripts/bank_metrics.py banks/default
+    PYTHONPATH=. python scripts/bank_metrics.py banks/default --key n3_t60_r0.300_l0.050-0.050_c1_lures --csv-dir metrics/
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import time
+
+from nback.sequence_bank import SequenceBank
+from nback.sequence_metrics import save_metrics_csv, summarize_metrics
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Quality metrics for a sequence bank")
+    parser.add_argument("bank", help="Bank directory")
+    parser.add_argument("--key", nargs="+", default=None, help="Entries to report (default: all)")
+    parser.add_argument("--csv-dir", default=None, help="Also write per-block metrics CSVs here")
+    args = parser.parse_args()
+
+    bank = SequenceBank(args.bank)
+    keys = args.key or sorted(bank.entries)
+    missing = [k for k in keys if k not in bank]
+    if missing:
+        print(f"Not in bank: {', '.join(missing)}")
+        return 1
+    if args.csv_dir:
+        os.makedirs(args.csv_dir, exist_ok=True)
+    for key in keys:
+        t0 = time.perf_counter()
+        metrics = bank.metrics(key)
+        dt = (time.perf_counter() - t0) * 1000.0
+        print(f"== {key} ({dt:.0f} ms)")
+        print(summarize_metrics(metrics))
+        if args.csv_dir:
+            save_metrics_csv(os.path.join(args.csv_dir, f"{key}.metrics.csv"), metrics)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""Benchmark `generate_sequence` over a parameter grid.
+
+Sweeps N level, block length, target rate, lure rates and
+`max_consec_targets` (cartesian product). For every point it generates
+`--reps` blocks and records wall time per block, solver attempts per block
+(from the generation counters), the share of blocks whose target quota had to
+be capped, and the share that came from the unvalidated fallback. Points that
+`check_feasibility` rejects are listed as skipped.
+
+Results are written as JSON and compared with a stored result file: the
+script exits with status 1 if any point got slower than `--max-slowdown`
+times its baseline (ignoring differences below `--min-delta-ms`), needs more
+attempts, or falls back more often. The baseline defaults to the tracked
+`scripts/bench_baseline_quick.json` (the `--quick` grid; points missing from
+it are not compared); pass `--baseline FILE` for another one or
+`--no-baseline` to skip the comparison. Wall times are machine-specific:
+attempts and fallbacks compare across machines, but for timing regressions
+record a baseline on the machine you compare on (`--update-baseline`).
+
+With `--scaling` the sweep runs block lengths from 1,000 to 100,000 trials
+instead and fits the exponent of time vs. length (log-log least squares) per
+parameter set; it exits with status 1 if any exponent exceeds
+`--max-exponent` (1.0 is linear scaling).
+
+Usage:
+    PYTHONPATH=. python scripts/bench_sequences.py --out bench.json
+    PYTHONPATH=. python scripts/bench_sequences.py --quick --out bench.json --update-baseline scripts/bench_baseline_quick.json
+    PYTHONPATH=. python scripts/bench_sequences.py --out bench.json --update-baseline bench_baseline.json
+    PYTHONPATH=. python scripts/bench_sequences.py --out bench.json --baseline bench_baseline.json
+    PYTHONPATH=. python scripts/bench_sequences.py --quick --out bench.json
+    PYTHONPATH=. python scripts/bench_sequences.py --scaling --out scaling.json
+"""
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from typing import Any, Dict, List
+
+from nback.sequences import (
+    check_feasibility,
+    generate_sequence,
+    get_generation_counters,
+    reset_generation_counters,
+)
+
+BENCH_FORMAT_VERSION = 1
+
+# Tracked baseline for the --quick grid, used unless --baseline / --no-baseline is given
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline_quick.json")
+
+# Full sweep
+N_BACK = [1, 2, 3, 4, 5]
+TRIALS = [20, 60, 200, 1000]
+TARGET_RATES = [0.1, 0.2, 0.3, 0.45, 0.6]
+LURE_RATES = ["0:0", "0.05:0.05", "0.15:0.15"]
+MAX_CONSEC = [1, 2, 3]
+
+# --quick: one representative value per axis besides N and length
+QUICK = dict(n_back=[1, 3, 5], trials=[20, 200, 1000], target_rate=[0.3], lures=["0.05:0.05"], max_consec=[1])
+
+# --scaling: long blocks; max_consec 1 and 2 cover both large-block target samplers
+SCALING = dict(n_back=[1, 3], trials=[1000, 2000, 5000, 10000, 20000, 50000, 100000], target_rate=[0.3],
+               lures=["0.05:0.05"], max_consec=[1, 2])
+
+
+def point_key(n_back: int, n_trials: int, target_rate: float, l1: float, l2: float,
+              max_consec: int, lure_mode: str) -> str:
+    return f"n{n_back}_t{n_trials}_r{target_rate:.3f}_l{l1:.3f}-{l2:.3f}_c{max_consec}_{lure_mode}"
+
+
+def bench_point(n_back: int, n_trials: int, target_rate: float, l1: float, l2: float,
+                max_consec: int, lure_mode: str, reps: int, seed: int) -> Dict[str, Any]:
+    key = point_key(n_back, n_trials, target_rate, l1, l2, max_consec, lure_mode)
+    fz = check_feasibility(n_back, n_trials, target_rate=target_rate, max_consec_targets=max_consec)
+    if not fz.feasible:
+        return {"skipped": fz.message}
+    rng = random.Random(f"{seed}:{key}")
+    times_ms: List[float] = []
+    reset_generation_counters()
+    for _ in range(reps):
+        t0 = time.perf_counter()
+        generate_sequence(n_back, n_trials, target_rate=target_rate,
+                          lure_n_minus_1_rate=l1, lure_n_plus_1_rate=l2,
+                          max_consec_targets=max_consec, lure_mode=lure_mode, rng=rng)
+        times_ms.append((time.perf_counter() - t0) * 1000.0)
+    c = get_generation_counters()
+    times_ms.sort()
+    return {
+        "reps": reps,
+        "mean_ms": round(statistics.fmean(times_ms), 4),
+        "median_ms": round(statistics.median(times_ms), 4),
+        "p95_ms": round(times_ms[min(len(times_ms) - 1, int(0.95 * len(times_ms)))], 4),
+        "attempts_per_block": round(c["attempts"] / reps, 4),
+        "aborts_per_block": round(c["aborts"] / reps, 4),
+        "capped_rate": round(c["capped"] / reps, 4),
+        "fallback_rate": round(c["fallbacks"] / reps, 4),
+    }
+
+
+def scaling_exponent(points: Dict[int, float]) -> float:
+    """Least-squares slope of log(time) vs log(n_trials); 1.0 means linear."""
+    xs = [math.log(n) for n in points]
+    ys = [math.log(max(t, 1e-9)) for t in points.values()]
+    mx, my = statistics.fmean(xs), statistics.fmean(ys)
+    sxx = sum((x - mx) ** 2 for x in xs)
+    return sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / sxx if sxx else 0.0
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], *,
+            max_slowdown: float, min_delta_ms: float) -> List[str]:
+    """Return one message per regressed point (points missing on either side are ignored)."""
+    problems: List[str] = []
+    for key, cur in results.items():
+        base = baseline.get(key)
+        if base is None or "skipped" in cur or "skipped" in base:
+            continue
+        slow = cur["median_ms"] - base["median_ms"]
+        if cur["median_ms"] > base["median_ms"] * max_slowdown and slow > min_delta_ms:
+            problems.append(f"{key}: median {cur['median_ms']:.3f} ms vs baseline {base['median_ms']:.3f} ms")
+        if cur["attempts_per_block"] > base["attempts_per_block"] * 1.10 + 0.05:
+            problems.append(f"{key}: {cur['attempts_per_block']:.2f} attempts/block "
+                            f"vs baseline {base['attempts_per_block']:.2f}")
+        if cur["fallback_rate"] > base["fallback_rate"]:
+            problems.append(f"{key}: fallback rate {cur['fallback_rate']:.3f} vs baseline {base['fallback_rate']:.3f}")
+    return problems
+
+
+def _parse_lures(spec: str) -> tuple:
+    a, _, b = spec.partition(":")
+    return float(a), float(b or a)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark sequence generation over a parameter grid")
+    parser.add_argument("--out", required=True, help="Write results JSON here")
+    parser.add_argument("--reps", type=int, default=10, help="Blocks generated per grid point")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--quick", action="store_true", help="Small grid for a fast check")
+    parser.add_argument("--scaling", action="store_true", help="Block lengths 1k-100k; report time-vs-length exponents")
+    parser.add_argument("--max-exponent", type=float, default=1.15, help="--scaling: fail above this exponent")
+    parser.add_argument("--n-back", type=int, nargs="+", default=None)
+    parser.add_argument("--trials", type=int, nargs="+", default=None)
+    parser.add_argument("--target-rate", type=float, nargs="+", default=None)
+    parser.add_argument("--lures", nargs="+", default=None, help="n-1:n+1 rate pairs, e.g. 0.05:0.05")
+    parser.add_argument("--max-consec-targets", type=int, nargs="+", default=None)
+    parser.add_argument("--lure-mode", choices=["rate", "quota"], nargs="+", default=["rate"])
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE,
+                        help="Compare against this results file; exit 1 on regression (default: the tracked --quick baseline)")
+    parser.add_argument("--no-baseline", action="store_true", help="Skip the baseline comparison")
+    parser.add_argument("--update-baseline", default=None, help="Also write the results to this baseline file")
+    parser.add_argument("--max-slowdown", type=float, default=1.5, help="Allowed median-time ratio vs baseline")
+    parser.add_argument("--min-delta-ms", type=float, default=0.5, help="Ignore slowdowns smaller than this")
+    args = parser.parse_args()
+
+    if args.scaling:
+        grid = SCALING
+    elif args.quick:
+        grid = QUICK
+    else:
+        grid = dict(n_back=N_BACK, trials=TRIALS, target_rate=TARGET_RATES, lures=LURE_RATES, max_consec=MAX_CONSEC)
+    axes = (
+        args.n_back or grid["n_back"],
+        args.trials or grid["trials"],
+        args.target_rate or grid["target_rate"],
+        [_parse_lures(s) for s in (args.lures or grid["lures"])],
+        args.max_consec_targets or grid["max_consec"],
+        args.lure_mode,
+    )
+
+    results: Dict[str, Dict[str, Any]] = {}
+    t0 = time.perf_counter()
+    for n, t, r, (l1, l2), c, mode in itertools.product(*axes):
+        key = point_key(n, t, r, l1, l2, c, mode)
+        results[key] = dict(n_back=n, n_trials=t, target_rate=r, lure_n_minus_1_rate=l1,
+                            lure_n_plus_1_rate=l2, max_consec_targets=c, lure_mode=mode,
+                            **bench_point(n, t, r, l1, l2, c, mode, max(1, args.reps), args.seed))
+    total_s = time.perf_counter() - t0
+
+    # Per parameter set (all axes but length): time-vs-length exponent
+    scaling: Dict[str, Dict[str, Any]] = {}
+    if args.scaling:
+        for v in results.values():
+            if "skipped" in v:
+                continue
+            group = point_key(v["n_back"], 0, v["target_rate"], v["lure_n_minus_1_rate"],
+                              v["lure_n_plus_1_rate"], v["max_consec_targets"], v["lure_mode"]).replace("_t0", "")
+            scaling.setdefault(group, {"median_ms": {}})["median_ms"][v["n_trials"]] = v["median_ms"]
+        for group in scaling.values():
+            group["exponent"] = round(scaling_exponent(group["median_ms"]), 3)
+            group["us_per_trial"] = {n: round(ms * 1000.0 / n, 3) for n, ms in group["median_ms"].items()}
+
+    report = {
+        "version": BENCH_FORMAT_VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "reps": args.reps,
+        "seed": args.seed,
+        "total_s": round(total_s, 2),
+        "results": results,
+    }
+    if args.scaling:
+        report["scaling"] = scaling
+    for path in filter(None, (args.out, args.update_baseline)):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    ran = [v for v in results.values() if "skipped" not in v]
+    print(f"Benchmarked {len(ran)}/{len(results)} points in {total_s:.1f} s -> {args.out}")
+    if ran:
+        worst = max(ran, key=lambda v: v["median_ms"])
+        print(f"  slowest median: {worst['median_ms']:.2f} ms "
+              f"(n={worst['n_back']} t={worst['n_trials']} r={worst['target_rate']})")
+        print(f"  blocks needing >1 attempt: {sum(v['attempts_per_block'] > 1 for v in ran)} points; "
+              f"fallbacks: {sum(v['fallback_rate'] > 0 for v in ran)} points")
+
+    if args.scaling:
+        steep = {k: g for k, g in scaling.items() if g["exponent"] > args.max_exponent}
+        for key, g in scaling.items():
+            per_trial = ", ".join(f"{n}: {us:.2f}" for n, us in g["us_per_trial"].items())
+            print(f"  {key}: exponent {g['exponent']:.2f}; us/trial {per_trial}")
+        if steep:
+            print(f"{len(steep)} parameter set(s) scale worse than n^{args.max_exponent:g}")
+            return 1
+
+    if args.baseline and not args.no_baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        problems = compare(results, baseline.get("results", {}),
+                           max_slowdown=args.max_slowdown, min_delta_ms=args.min_delta_ms)
+        if problems:
+            print(f"{len(problems)} regression(s) vs {args.baseline}:")
+            for msg in problems:
+                print(f"  {msg}")
+            return 1
+        print(f"No regressions vs {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""Pregenerate a bank of validated N-back blocks.
+
+Builds every combination of the given parameter lists (cartesian product) and
+stores `--count` validated blocks per combination as memory-mapped `.npy`
+files with an `index.json`. The task picks blocks from the bank when started
+with `--sequence-bank DIR`, so no generation happens during the session.
+
+Defaults cover the parameters `nback_task.py` uses out of the box: main
+blocks at 1- and 3-back plus the lure-free 2-back practice block.
+
+Usage:
+    PYTHONPATH=. python scripts/build_sequence_bank.py --out banks/default --count 2000 --seed 1
+    PYTHONPATH=. python scripts/build_sequence_bank.py --out banks/hi --n-back 2 3 --target-rate 0.3 0.4 --no-practice
+"""
+from __future__ import annotations
+
+import argparse
+import itertools
+import time
+
+from nback.def_parameters import (
+    LURE_N_MINUS_1_RATE,
+    LURE_N_PLUS_1_RATE,
+    MAX_CONSEC_TARGETS_DEFAULT,
+    PRACTICE_HAS_LURES,
+    PRACTICE_TARGET_RATE,
+    PRACTICE_TRIALS,
+    TARGET_RATE,
+    TRIALS_PER_BLOCK,
+)
+from nback.sequence_bank import bank_key, build_bank
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Pregenerate a sequence bank for nback_task.py")
+    parser.add_argument("--out", required=True, help="Bank directory (created if missing)")
+    parser.add_argument("--count", type=int, default=1000, help="Blocks per parameter combination")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for reproducible banks")
+    parser.add_argument("--n-back", type=int, nargs="+", default=[1, 3], help="N levels for main blocks")
+    parser.add_argument("--trials", type=int, nargs="+", default=[TRIALS_PER_BLOCK], help="Trials per block")
+    parser.add_argument("--target-rate", type=float, nargs="+", default=[TARGET_RATE])
+    parser.add_argument("--lure-nminus1", type=float, nargs="+", default=[LURE_N_MINUS_1_RATE])
+    parser.add_argument("--lure-nplus1", type=float, nargs="+", default=[LURE_N_PLUS_1_RATE])
+    parser.add_argument("--max-consec-targets", type=int, nargs="+", default=[MAX_CONSEC_TARGETS_DEFAULT])
+    parser.add_argument("--no-practice", action="store_true", help="Do not add the 2-back practice combinations")
+    parser.add_argument("--practice-trials", type=int, nargs="+", default=[PRACTICE_TRIALS])
+    args = parser.parse_args()
+
+    param_sets = []
+    for n, t, r, l1, l2, c in itertools.product(args.n_back, args.trials, args.target_rate,
+                                                args.lure_nminus1, args.lure_nplus1,
+                                                args.max_consec_targets):
+        param_sets.append(dict(n_back=n, n_trials=t, target_rate=r, lure_n_minus_1_rate=l1,
+                               lure_n_plus_1_rate=l2, max_consec_targets=c, include_lures=True))
+    if not args.no_practice:
+        for t, c in itertools.product(args.practice_trials, args.max_consec_targets):
+            param_sets.append(dict(n_back=2, n_trials=t, target_rate=PRACTICE_TARGET_RATE,
+                                   lure_n_minus_1_rate=args.lure_nminus1[0] if PRACTICE_HAS_LURES else 0.0,
+                                   lure_n_plus_1_rate=args.lure_nplus1[0] if PRACTICE_HAS_LURES else 0.0,
+                                   max_consec_targets=c, include_lures=PRACTICE_HAS_LURES))
+
+    t0 = time.perf_counter()
+    index = build_bank(args.out, param_sets, args.count, seed=args.seed)
+    dt = time.perf_counter() - t0
+    built = [bank_key(**p) for p in param_sets if bank_key(**p) in index["entries"]]
+    print(f"Built {len(built)}/{len(param_sets)} combinations x {args.count} blocks in {dt:.1f} s -> {args.out}")
+    for key in built:
+        print(f"  {key}")
+    return 0 if len(built) == len(param_sets) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,76 @@
+"""Sequence bank and block registry round trips (nback.sequence_bank, nback.block_registry)."""
+
+import random
+
+import numpy as np
+
+from nback.block_registry import BlockRegistry, block_hash
+from nback.sequence_bank import SequenceBank, bank_key, build_bank, load_bank
+from nback.sequences import BlockPlan, generate_dual_sequence, generate_sequence, validate_sequence
+
+PARAMS = dict(n_back=2, n_trials=30, target_rate=0.3, lure_n_minus_1_rate=0.05,
+              lure_n_plus_1_rate=0.05, max_consec_targets=1)
+
+
+def test_bank_round_trip(tmp_path):
+    index = build_bank(str(tmp_path), [PARAMS], count=20, seed=1)
+    key = bank_key(**PARAMS)
+    assert index["entries"][key]["count"] == 20
+
+    bank = load_bank(str(tmp_path))
+    assert isinstance(bank, SequenceBank) and key in bank
+    mask, _codes = bank.audit(key)
+    assert mask.all()
+    arr = bank.array(key)
+    for k in bank.draw(key, 5, rng=random.Random(0)):
+        plan = bank.block(key, k)
+        np.testing.assert_array_equal(plan.stimuli, arr[k, 0])
+        trials = plan.to_trials()
+        ok, reason = validate_sequence([t.stimulus for t in trials], [t.is_target for t in trials],
+                                       [t.lure_type for t in trials], n_back=2, target_rate=0.3,
+                                       tolerance=1, max_consec_targets=1)
+        assert ok, reason
+
+    # Rebuilding with the same seed reproduces the stored blocks
+    other = tmp_path / "again"
+    build_bank(str(other), [PARAMS], count=20, seed=1)
+    np.testing.assert_array_equal(SequenceBank(str(other)).array(key), arr)
+
+
+def test_quota_parameter_sets_are_not_banked(tmp_path):
+    index = build_bank(str(tmp_path), [dict(PARAMS, lure_mode="quota")], count=5, seed=1)
+    assert index["entries"] == {}
+
+
+def test_missing_bank_falls_back(tmp_path):
+    assert load_bank(str(tmp_path / "nowhere")) is None
+    assert load_bank(None) is None
+
+
+def test_registry_claims_each_block_once(tmp_path):
+    path = str(tmp_path / "issued.sqlite")
+    plan = generate_sequence(2, 30, rng=random.Random(0))
+    other = generate_sequence(2, 30, rng=random.Random(1))
+    reg = BlockRegistry(path)
+    assert not reg.is_issued(plan)
+    assert reg.claim(plan, participant="p1", session="s1", label="block_1", n_back=2)
+    assert not reg.claim(plan, participant="p2", session="s2", label="block_1", n_back=2)
+    assert reg.claim(other, participant="p2", session="s2", label="block_2", n_back=2)
+    reg.close()
+
+    # Claims persist and are shared through the file
+    reg = BlockRegistry(path)
+    assert len(reg) == 2
+    assert reg.is_issued(plan)
+    assert reg.owner(plan) == ("p1", "s1", "block_1")
+    reg.close()
+
+
+def test_block_hash_ignores_iti_and_separates_dual_blocks():
+    plan = generate_sequence(2, 30, rng=random.Random(0))
+    trials = plan.to_trials()
+    for t in trials:
+        t.iti_ms += 100
+    assert block_hash(plan) == block_hash(BlockPlan.from_trials(trials))
+    dual = generate_dual_sequence(2, 30, rng=random.Random(0))
+    assert block_hash(dual) != block_hash(BlockPlan.from_arrays(dual.stimuli, dual.is_target, dual.lure, 500))
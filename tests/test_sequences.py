@@ -0,0 +1,206 @@
+"""Sequence generator, validators and target-layout samplers (nback.sequences)."""
+
+import itertools
+import random
+
+import numpy as np
+import pytest
+
+from nback.sequences import (
+    LETTER_CODES,
+    LETTERS,
+    LURE_CODES,
+    VALIDATION_REASONS,
+    GenerationStats,
+    StreamingValidator,
+    _sample_target_indices,
+    _target_capacity,
+    count_target_placements,
+    generate_dual_sequence,
+    generate_sequence,
+    generate_sequences_batch,
+    validate_sequence,
+    validate_sequences_batch,
+)
+
+LURE_TYPES = ("none", "n-1", "n+1")
+
+
+def _columns(block):
+    trials = list(block)
+    return ([t.stimulus for t in trials], [t.is_target for t in trials], [t.lure_type for t in trials])
+
+
+def _longest_run(flags):
+    best = run = 0
+    for f in flags:
+        run = run + 1 if f else 0
+        best = max(best, run)
+    return best
+
+
+def _mutate(rng, seq, flags, lures, n_back):
+    """Copy of a block with one random field changed (often, not always, invalid)."""
+    seq, flags, lures = list(seq), list(flags), list(lures)
+    i = rng.randrange(len(seq))
+    field = rng.randrange(3)
+    if field == 0:
+        seq[i] = rng.choice([seq[i - 1], seq[i - n_back] if i >= n_back else seq[i], rng.choice(LETTERS[:3])])
+    elif field == 1:
+        flags[i] = 1 - flags[i]
+    else:
+        lures[i] = rng.choice(LURE_TYPES)
+    return seq, flags, lures
+
+
+def _random_blocks(count, seed=0):
+    """Generated blocks plus single-field mutations of them, over several N levels."""
+    rng = random.Random(seed)
+    out = []
+    for k in range(count):
+        n_back = 1 + k % 3
+        block = generate_sequence(n_back, 24, target_rate=0.3, lure_n_minus_1_rate=0.2,
+                                  lure_n_plus_1_rate=0.2, rng=rng)
+        cols = _columns(block)
+        out.append((n_back, cols))
+        out.append((n_back, _mutate(rng, *cols, n_back)))
+    return out
+
+
+@pytest.mark.parametrize("n_back", [1, 2, 3])
+@pytest.mark.parametrize("max_consec", [1, 2])
+@pytest.mark.parametrize("lure_mode", ["rate", "quota"])
+def test_generated_blocks_validate(n_back, max_consec, lure_mode):
+    for seed in range(20):
+        st = GenerationStats()
+        block = generate_sequence(n_back, 40, target_rate=0.3, max_consec_targets=max_consec,
+                                  lure_mode=lure_mode, rng=random.Random(seed), stats=st)
+        ok, reason = validate_sequence(*_columns(block), n_back=n_back, target_rate=0.3, tolerance=1,
+                                       max_consec_targets=max_consec)
+        assert ok, reason
+        assert not st.fallback
+
+
+def test_streaming_validator_agrees_with_validate_sequence():
+    for n_back, (seq, flags, lures) in _random_blocks(150):
+        ok, reason = validate_sequence(seq, flags, lures, n_back=n_back, target_rate=0.3, tolerance=1,
+                                       max_consec_targets=1)
+        sv = StreamingValidator(n_back, len(seq), target_rate=0.3, max_consec_targets=1)
+        for letter, flag, lure in zip(seq, flags, lures):
+            if not sv.append(letter, flag, lure):
+                break
+        stream_ok, stream_reason = sv.finish()
+        assert stream_ok == ok, (reason, stream_reason)
+
+
+def test_batch_validator_agrees_with_validate_sequence():
+    blocks = _random_blocks(150, seed=1)
+    for n_back in (1, 2, 3):
+        rows = [cols for n, cols in blocks if n == n_back]
+        stim = np.array([[LETTER_CODES[c] for c in seq] for seq, _, _ in rows], dtype=np.uint8)
+        tgt = np.array([flags for _, flags, _ in rows], dtype=np.uint8)
+        lur = np.array([[LURE_CODES[t] for t in lures] for _, _, lures in rows], dtype=np.uint8)
+        mask, codes = validate_sequences_batch(stim, tgt, lur, n_back=n_back, target_rate=0.3,
+                                               max_consec_targets=1)
+        for k, cols in enumerate(rows):
+            ok, reason = validate_sequence(*cols, n_back=n_back, target_rate=0.3, tolerance=1,
+                                           max_consec_targets=1)
+            assert bool(mask[k]) == ok, (reason, VALIDATION_REASONS[codes[k]])
+            if reason in VALIDATION_REASONS:
+                assert VALIDATION_REASONS[codes[k]] == reason
+
+
+@pytest.mark.parametrize("n_back,n_trials", [(1, 7), (2, 9), (3, 10)])
+@pytest.mark.parametrize("max_consec", [1, 2, 3])
+def test_placement_counts_match_brute_force(n_back, n_trials, max_consec):
+    slots = n_trials - n_back
+    for desired in range(slots + 1):
+        brute = sum(1 for bits in itertools.product((0, 1), repeat=slots)
+                    if sum(bits) == desired and _longest_run(bits) <= max_consec)
+        assert count_target_placements(n_back, n_trials, desired, max_consec) == brute
+    assert _target_capacity(slots, 0, max_consec) == max(
+        sum(bits) for bits in itertools.product((0, 1), repeat=slots) if _longest_run(bits) <= max_consec)
+
+
+def test_target_sampler_covers_every_layout_evenly():
+    n_back, n_trials, desired, max_consec = 2, 9, 3, 2
+    total = count_target_placements(n_back, n_trials, desired, max_consec)
+    rng = random.Random(0)
+    draws = 200 * total
+    seen = {}
+    for _ in range(draws):
+        layout = tuple(_sample_target_indices(n_back, n_trials, desired, max_consec, rng=rng))
+        seen[layout] = seen.get(layout, 0) + 1
+    assert len(seen) == total
+    # Each layout expects 200 draws; 5 standard deviations either way
+    assert all(130 <= c <= 270 for c in seen.values())
+
+
+@pytest.mark.parametrize("n_back,n_trials,rate", [(1, 200, 0.15), (2, 60, 0.3), (3, 60, 0.3), (3, 60, 0.1)])
+def test_quota_lures_hit_their_counts(n_back, n_trials, rate):
+    for seed in range(30):
+        st = GenerationStats()
+        block = generate_sequence(n_back, n_trials, lure_mode="quota", lure_n_minus_1_rate=rate,
+                                  lure_n_plus_1_rate=rate, rng=random.Random(seed), stats=st)
+        _, flags, lures = _columns(block)
+        quota = round(rate * (n_trials - sum(flags)))
+        assert st.lure_shortfall == 0
+        assert lures.count("n+1") == quota
+        assert lures.count("n-1") == (quota if n_back > 1 else 0)
+
+
+def test_quota_shortfall_is_reported():
+    # n-1 lures at 2-back repeat the previous letter, which max_identical_run=1 forbids
+    st = GenerationStats()
+    block = generate_sequence(2, 60, lure_mode="quota", lure_n_minus_1_rate=0.2, lure_n_plus_1_rate=0.2,
+                              max_identical_run=1, rng=random.Random(0), stats=st)
+    _, flags, lures = _columns(block)
+    quota = round(0.2 * (60 - sum(flags)))
+    assert lures.count("n-1") == 0
+    assert st.lure_shortfall == quota + max(0, quota - lures.count("n+1"))
+
+
+def test_rate_mode_reports_no_shortfall():
+    st = GenerationStats()
+    generate_sequence(2, 40, rng=random.Random(0), stats=st)
+    assert st.lure_shortfall is None
+
+
+@pytest.mark.parametrize("n_back", [1, 2, 3])
+@pytest.mark.parametrize("max_consec", [1, 2])
+def test_dual_blocks_respect_caps(n_back, max_consec):
+    for seed in range(10):
+        st = GenerationStats()
+        plan = generate_dual_sequence(n_back, 40, target_rate=0.3, max_consec_targets=max_consec,
+                                      max_dual_targets=3, rng=random.Random(seed), stats=st)
+        letter_flags = plan.is_target.tolist()
+        position_flags = plan.position_is_target.tolist()
+        assert not st.fallback
+        assert _longest_run(letter_flags) <= max_consec
+        assert _longest_run(position_flags) <= max_consec
+        assert plan.dual_targets() == sum(a and b for a, b in zip(letter_flags, position_flags)) <= 3
+        positions = plan.positions.tolist()
+        assert all(position_flags[i] == int(i >= n_back and positions[i] == positions[i - n_back])
+                   for i in range(40))
+
+
+def test_batch_blocks_validate():
+    batch = generate_sequences_batch(2, 40, 200, target_rate=0.3, seed=0)
+    mask, codes = validate_sequences_batch(batch.stimuli, batch.is_target, batch.lure, n_back=2,
+                                           target_rate=0.3, max_consec_targets=1)
+    assert mask.all(), [VALIDATION_REASONS[c] for c in codes[~mask]]
+
+
+@pytest.mark.parametrize("max_identical_run", [0, 1])
+def test_batch_identical_run_cap_matches_scalar_convention(max_identical_run):
+    # max_identical_run <= 0 means no cap in both generators
+    batch = generate_sequences_batch(2, 60, 500, lure_n_minus_1_rate=0.3, lure_n_plus_1_rate=0.0,
+                                     max_identical_run=max_identical_run, seed=0)
+    repeats = (batch.stimuli[:, 1:] == batch.stimuli[:, :-1]) & (batch.lure[:, 1:] > 0)
+    scalar_repeats = 0
+    for seed in range(50):
+        seq, _, lures = _columns(generate_sequence(2, 60, lure_n_minus_1_rate=0.3, lure_n_plus_1_rate=0.0,
+                                                   max_identical_run=max_identical_run,
+                                                   rng=random.Random(seed)))
+        scalar_repeats += sum(1 for i in range(1, 60) if seq[i] == seq[i - 1] and lures[i] != "none")
+    assert bool(repeats.any()) == (scalar_repeats > 0) == (max_identical_run <= 0)